@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timers', '0007_room'),
+        ('line_integration', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linenotification',
+            name='room',
+            field=models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='line_notifications', to='timers.room', verbose_name='ルーム'),
+            preserve_default=False,
+        ),
+        migrations.AlterUniqueTogether(
+            name='linenotification',
+            unique_together={('room', 'timer', 'notification_type')},
+        ),
+    ]
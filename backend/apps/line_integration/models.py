@@ -1,5 +1,5 @@
 from django.db import models
-from apps.timers.models import Timer
+from apps.timers.models import Room, Timer
 
 
 class LineNotification(models.Model):
@@ -11,6 +11,12 @@ class LineNotification(models.Model):
         ('rehearsal_end', 'リハーサル終了通知'),
     ]
 
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        related_name='line_notifications',
+        verbose_name='ルーム'
+    )
     timer = models.ForeignKey(
         Timer,
         on_delete=models.CASCADE,
@@ -32,7 +38,7 @@ class LineNotification(models.Model):
         ordering = ['-sent_at']
         verbose_name = 'LINE通知履歴'
         verbose_name_plural = 'LINE通知履歴'
-        unique_together = [['timer', 'notification_type']]  # 重複防止
+        unique_together = [['room', 'timer', 'notification_type']]  # 重複防止
 
     def __str__(self):
         timer_name = self.timer.band_name if self.timer else 'システム通知'
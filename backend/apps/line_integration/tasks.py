@@ -1,8 +1,17 @@
-"""LINE通知 Celery タスク"""
+"""
+LINE通知 Celery タスク
+
+tickパイプラインは通知の条件を評価して送信履歴（LineNotification）を記録するだけで、
+LINE API への送信はコミット後にtickの外で行う（Celeryモードは send_line_messages タスク、
+asgiモードは送信用のスレッド）。送信は失敗しても例外にならず履歴は残るため、
+記録を先にしても再送の有無は変わらない。
+"""
 from celery import shared_task
-from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.db import transaction
-from apps.timers.models import Timer, TimerState
+from apps.timers.models import DEFAULT_ROOM_ID
+from apps.timers.tick import TickSnapshot
 from apps.members.models import Member
 from .models import LineNotification
 from .line_client import send_line_message_bulk
@@ -11,10 +20,62 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _get_linked_line_user_ids():
+    """全LINE連携済みメンバーのLINE User IDを取得"""
+    return list(
+        Member.objects.filter(
+            is_active=True,
+            line_user_id__isnull=False
+        ).exclude(line_user_id='').values_list('line_user_id', flat=True)
+    )
+
+
+# asgiモードの送信用スレッド（Celery Workerがないため。1本にして送信順を保つ）
+_sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix='line-send')
+
+
+def _mark_sent(snapshot, notification_type, timer=None):
+    """送信済みをスナップショットにも反映（同じtick内の重複送信防止）"""
+    snapshot.sent_notifications.add(((timer.id if timer else None), notification_type))
+
+
 @shared_task
-def check_and_send_notifications():
+def send_line_messages(line_user_ids, message_text, label):
+    """LINEメッセージを一括送信（送信履歴はtickで記録済み）"""
+    try:
+        success_count, failure_count = send_line_message_bulk(line_user_ids, message_text)
+        logger.info(f'{label}完了: 送信={success_count}, 失敗={failure_count}')
+    except Exception as e:
+        logger.error(f'{label}送信エラー: {e}', exc_info=True)
+
+
+def _deliver(line_user_ids, message_text, label):
     """
-    5分前通知チェック - Celery Beatで1秒ごとに実行
+    コミット後にtickの外で送信（LINE API の応答待ちでtickを遅らせない）
+
+    asgiモードではtickがリーダーロックを持つ間に実行されるため、送信用のスレッドに渡す。
+    """
+    def deliver():
+        if settings.TIMER_SCHEDULER_MODE == 'asgi':
+            _sender.submit(send_line_messages, line_user_ids, message_text, label)
+        else:
+            send_line_messages.delay(line_user_ids, message_text, label)
+
+    transaction.on_commit(deliver)
+
+
+@shared_task
+def check_and_send_notifications(room_id=DEFAULT_ROOM_ID):
+    """5分前通知チェック（単体実行用。通常はtickパイプラインから呼ばれる）"""
+    try:
+        process_five_minute_notification(TickSnapshot.load(room_id))
+    except Exception as e:
+        logger.error(f'5分前通知エラー: {e}', exc_info=True)
+
+
+def process_five_minute_notification(snapshot):
+    """
+    5分前通知チェック - tickパイプラインで1秒ごとに実行
 
     ロジック:
     1. 実行中かつ未一時停止のタイマーがあるか確認
@@ -22,36 +83,30 @@ def check_and_send_notifications():
     3. 次のタイマー開始まで残り時間を計算
     4. 297〜303秒の範囲なら通知送信
     5. 重複送信防止（LineNotificationで確認）
+
+    Args:
+        snapshot: TickSnapshot インスタンス
     """
     try:
-        timer_state = TimerState.load()
+        timer_state = snapshot.timer_state
 
         # LINE通知が無効の場合はスキップ
         if not timer_state.line_notifications_enabled:
             return
 
         # 実行中でない、または一時停止中の場合はスキップ
-        if not timer_state.is_running or not timer_state.current_timer:
-            return
-        if timer_state.is_paused:
+        if not snapshot.is_ticking:
             return
 
         # 次のタイマーを取得
-        next_timer = Timer.objects.filter(
-            completed_at__isnull=True,
-            order__gt=timer_state.current_timer.order
-        ).order_by('order').first()
+        next_timer = snapshot.next_timer
 
         if not next_timer:
             logger.debug('次のタイマーなし - 5分前通知スキップ')
             return
 
         # 次のタイマー開始までの残り時間を計算
-        elapsed = (timezone.now() - timer_state.started_at).total_seconds()
-        total_seconds = timer_state.current_timer.minutes * 60
-        remaining = total_seconds - elapsed
-
-        time_until_next = remaining
+        time_until_next = snapshot.remaining_seconds
 
         # 5分前（300秒）±3秒の範囲でトリガー
         TARGET_SECONDS = 300
@@ -61,12 +116,7 @@ def check_and_send_notifications():
             return  # まだ5分前でない、または既に過ぎている
 
         # 重複送信チェック
-        already_sent = LineNotification.objects.filter(
-            timer=next_timer,
-            notification_type='5min_before'
-        ).exists()
-
-        if already_sent:
+        if snapshot.is_notification_sent('5min_before', next_timer):
             logger.debug(f'既に送信済み: {next_timer.band_name} | タイプ=5min_before')
             return
 
@@ -90,38 +140,43 @@ def check_and_send_notifications():
             f'担当: {", ".join([m.name for m in members])}'
         )
 
-        # トランザクション内で送信+記録
+        # 履歴を記録し、コミット後に送信
         with transaction.atomic():
-            # 送信
-            success_count, failure_count = send_line_message_bulk(line_user_ids, message_text)
-
-            # 履歴記録
             LineNotification.objects.create(
+                room_id=snapshot.room_id,
                 timer=next_timer,
                 notification_type='5min_before',
                 line_user_ids=line_user_ids,
                 message=message_text
             )
-
-            logger.info(
-                f'5分前通知完了: {next_timer.band_name} | '
-                f'送信={success_count}, 失敗={failure_count}'
-            )
+            _mark_sent(snapshot, '5min_before', next_timer)
+            _deliver(line_user_ids, message_text, f'5分前通知（{next_timer.band_name}）')
 
     except Exception as e:
         logger.error(f'5分前通知エラー: {e}', exc_info=True)
 
 
 @shared_task
-def send_rehearsal_start_notification():
+def send_rehearsal_start_notification(room_id=DEFAULT_ROOM_ID):
+    """リハーサル開始通知（単体実行用。通常はtickパイプラインから呼ばれる）"""
+    try:
+        process_rehearsal_start_notification(TickSnapshot.load(room_id))
+    except Exception as e:
+        logger.error(f'リハーサル開始通知エラー: {e}', exc_info=True)
+
+
+def process_rehearsal_start_notification(snapshot):
     """
     リハーサル開始通知
 
     トリガー: 最初のタイマーが開始された瞬間（is_running=True, started_at設定直後）
     送信先: 全てのLINE連携済みメンバー
+
+    Args:
+        snapshot: TickSnapshot インスタンス
     """
     try:
-        timer_state = TimerState.load()
+        timer_state = snapshot.timer_state
 
         # LINE通知が無効の場合はスキップ
         if not timer_state.line_notifications_enabled:
@@ -132,22 +187,12 @@ def send_rehearsal_start_notification():
             return
 
         # 既に送信済みかチェック（timer=null, notification_type='rehearsal_start'）
-        already_sent = LineNotification.objects.filter(
-            timer__isnull=True,
-            notification_type='rehearsal_start'
-        ).exists()
-
-        if already_sent:
+        if snapshot.is_notification_sent('rehearsal_start'):
             logger.debug('リハーサル開始通知: 既に送信済み')
             return
 
         # 全LINE連携済みメンバーを取得
-        line_user_ids = list(
-            Member.objects.filter(
-                is_active=True,
-                line_user_id__isnull=False
-            ).exclude(line_user_id='').values_list('line_user_id', flat=True)
-        )
+        line_user_ids = _get_linked_line_user_ids()
 
         if not line_user_ids:
             logger.warning('LINE連携済みメンバーなし - リハーサル開始通知スキップ')
@@ -160,40 +205,50 @@ def send_rehearsal_start_notification():
             f'全員頑張りましょう🔥'
         )
 
-        # トランザクション内で送信+記録
+        # 履歴を記録し、コミット後に送信
         with transaction.atomic():
-            success_count, failure_count = send_line_message_bulk(line_user_ids, message_text)
-
             LineNotification.objects.create(
+                room_id=snapshot.room_id,
                 timer=None,  # システム通知
                 notification_type='rehearsal_start',
                 line_user_ids=line_user_ids,
                 message=message_text
             )
-
-            logger.info(f'リハーサル開始通知完了: 送信={success_count}, 失敗={failure_count}')
+            _mark_sent(snapshot, 'rehearsal_start')
+            _deliver(line_user_ids, message_text, 'リハーサル開始通知')
 
     except Exception as e:
         logger.error(f'リハーサル開始通知エラー: {e}', exc_info=True)
 
 
 @shared_task
-def send_rehearsal_end_notification():
+def send_rehearsal_end_notification(room_id=DEFAULT_ROOM_ID):
+    """リハーサル終了通知（単体実行用。通常はtickパイプラインから呼ばれる）"""
+    try:
+        process_rehearsal_end_notification(TickSnapshot.load(room_id))
+    except Exception as e:
+        logger.error(f'リハーサル終了通知エラー: {e}', exc_info=True)
+
+
+def process_rehearsal_end_notification(snapshot):
     """
     リハーサル終了通知
 
     トリガー: 最後のタイマーが完了した瞬間（全タイマーcompleted_at設定済み）
     送信先: 全てのLINE連携済みメンバー
+
+    Args:
+        snapshot: TickSnapshot インスタンス
     """
     try:
-        timer_state = TimerState.load()
+        timer_state = snapshot.timer_state
 
         # LINE通知が無効の場合はスキップ
         if not timer_state.line_notifications_enabled:
             return
 
         # タイマーの総数を取得
-        total_timers = Timer.objects.count()
+        total_timers = snapshot.timer_counts['total']
 
         # タイマーが存在しない場合はスキップ
         if total_timers == 0:
@@ -201,36 +256,25 @@ def send_rehearsal_end_notification():
             return
 
         # 全タイマーが完了しているか確認
-        incomplete_timers = Timer.objects.filter(completed_at__isnull=True).count()
+        incomplete_timers = snapshot.timer_counts['incomplete']
 
         if incomplete_timers > 0:
             return  # まだ未完了タイマーがある
 
         # 既に送信済みかチェック
-        already_sent = LineNotification.objects.filter(
-            timer__isnull=True,
-            notification_type='rehearsal_end'
-        ).exists()
-
-        if already_sent:
+        if snapshot.is_notification_sent('rehearsal_end'):
             logger.debug('リハーサル終了通知: 既に送信済み')
             return
 
         # 全LINE連携済みメンバーを取得
-        line_user_ids = list(
-            Member.objects.filter(
-                is_active=True,
-                line_user_id__isnull=False
-            ).exclude(line_user_id='').values_list('line_user_id', flat=True)
-        )
+        line_user_ids = _get_linked_line_user_ids()
 
         if not line_user_ids:
             logger.warning('LINE連携済みメンバーなし - リハーサル終了通知スキップ')
             return
 
         # 全体の時間差を計算（timer_stateは冒頭で取得済み）
-        completed_timers = Timer.objects.filter(actual_seconds__isnull=False)
-        total_diff = sum(timer.time_difference for timer in completed_timers)
+        total_diff = timer_state.total_time_difference
 
         # 累積一時停止時間を加算
         total_diff += timer_state.total_paused_seconds
@@ -258,18 +302,17 @@ def send_rehearsal_end_notification():
             f'全体の進行状況: {total_diff_display}'
         )
 
-        # トランザクション内で送信+記録
+        # 履歴を記録し、コミット後に送信
         with transaction.atomic():
-            success_count, failure_count = send_line_message_bulk(line_user_ids, message_text)
-
             LineNotification.objects.create(
+                room_id=snapshot.room_id,
                 timer=None,  # システム通知
                 notification_type='rehearsal_end',
                 line_user_ids=line_user_ids,
                 message=message_text
             )
-
-            logger.info(f'リハーサル終了通知完了: 送信={success_count}, 失敗={failure_count}')
+            _mark_sent(snapshot, 'rehearsal_end')
+            _deliver(line_user_ids, message_text, 'リハーサル終了通知')
 
     except Exception as e:
         logger.error(f'リハーサル終了通知エラー: {e}', exc_info=True)
@@ -1,11 +1,30 @@
 from django.contrib import admin
-from .models import Timer, TimerState
+from .models import ArchivedTimer, RehearsalArchive, Room, Timer, TimerEvent, TimerState, DEFAULT_ROOM_ID
+
+
+@admin.register(Room)
+class RoomAdmin(admin.ModelAdmin):
+    list_display = ('slug', 'name', 'created_at')
+    search_fields = ('slug', 'name')
+    readonly_fields = ('created_at',)
+
+    def get_readonly_fields(self, request, obj=None):
+        """作成後はスラッグを変更不可（URL・各プロセスのスラッグ → ルームIDの対応が変わるため）"""
+        if obj is not None:
+            return self.readonly_fields + ('slug',)
+        return self.readonly_fields
+
+    def has_delete_permission(self, request, obj=None):
+        """既定のルームは削除不可（ルーム指定なしのURLが使う）"""
+        if obj is not None and obj.id == DEFAULT_ROOM_ID:
+            return False
+        return super().has_delete_permission(request, obj)
 
 
 @admin.register(Timer)
 class TimerAdmin(admin.ModelAdmin):
-    list_display = ('band_name', 'minutes', 'member1', 'member2', 'member3', 'order', 'is_completed', 'actual_seconds', 'created_at')
-    list_filter = ('completed_at',)
+    list_display = ('band_name', 'room', 'minutes', 'member1', 'member2', 'member3', 'order', 'is_completed', 'actual_seconds', 'created_at')
+    list_filter = ('room', 'completed_at')
     search_fields = ('band_name',)
     readonly_fields = ('created_at', 'completed_at', 'actual_seconds')
     ordering = ('order',)
@@ -13,13 +32,53 @@ class TimerAdmin(admin.ModelAdmin):
 
 @admin.register(TimerState)
 class TimerStateAdmin(admin.ModelAdmin):
-    list_display = ('current_timer', 'is_running', 'is_paused', 'started_at', 'updated_at')
+    list_display = ('room', 'current_timer', 'is_running', 'is_paused', 'started_at', 'updated_at')
     readonly_fields = ('updated_at',)
 
     def has_add_permission(self, request):
-        """追加を禁止（Singleton）"""
-        return not TimerState.objects.exists()
+        """追加を禁止（ルーム作成時に作られる）"""
+        return False
 
     def has_delete_permission(self, request, obj=None):
-        """削除を禁止（Singleton）"""
+        """削除を禁止（ルームごとに1件）"""
+        return False
+
+
+@admin.register(TimerEvent)
+class TimerEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'room', 'kind', 'timer_id', 'version', 'created_at')
+    list_filter = ('room', 'kind')
+    readonly_fields = ('room', 'kind', 'timer_id', 'version', 'changes', 'data', 'created_at')
+
+    def has_add_permission(self, request):
+        """追加を禁止（追記のみの記録）"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """変更を禁止（追記のみの記録）"""
+        return False
+
+
+class ArchivedTimerInline(admin.TabularInline):
+    model = ArchivedTimer
+    extra = 0
+    can_delete = False
+    readonly_fields = (
+        'position', 'band_name', 'minutes', 'actual_seconds', 'overrun_seconds', 'paused_seconds',
+        'member1', 'member2', 'member3',
+    )
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RehearsalArchive)
+class RehearsalArchiveAdmin(admin.ModelAdmin):
+    list_display = ('room', 'archived_at', 'timer_count', 'total_time_difference', 'finished_at')
+    list_filter = ('room',)
+    readonly_fields = ('room', 'timer_count', 'total_time_difference', 'finished_at', 'archived_at')
+    inlines = (ArchivedTimerInline,)
+
+    def has_add_permission(self, request):
+        """追加を禁止（全削除の前に作られる）"""
         return False
@@ -5,3 +5,7 @@ class TimersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.timers'
     verbose_name = 'タイマー管理'
+
+    def ready(self):
+        # ルーム削除時にスラッグのキャッシュを破棄するシグナルを登録
+        from . import rooms  # noqa: F401
@@ -0,0 +1,148 @@
+"""
+リハーサル記録（全削除の前に完了済みタイマーを保存）と押し巻きの集計
+
+全削除（views.delete_all_timers）は Timer を削除するため、その前に同じトランザクションで
+バンド名・予定時間・実績・一時停止時間・担当者だけを ArchivedTimer に保存する
+（1行 = 1タイマーの狭いテーブル。押し巻きは保存時に計算しておく）。
+
+集計（overrun_stats）は必要な列だけを1クエリでまとめて読み、バンド・担当者ごとに
+平均・パーセンタイル・最大を求める。数百回分（数千〜数万行）でも数十ミリ秒で終わる。
+"""
+import math
+from collections import defaultdict
+from apps.members.models import Member
+from .models import ArchivedTimer, RehearsalArchive, Timer
+
+# 集計するパーセンタイル
+PERCENTILES = (50, 90)
+
+GROUPS = ('band', 'member')
+
+
+def archive_room(room_id):
+    """
+    ルームの完了済みタイマーをリハーサル記録として保存（全削除と同じトランザクションで呼ぶ）
+
+    Returns:
+        RehearsalArchive: 保存した記録（完了済みタイマーがなければ None）
+    """
+    timers = list(
+        Timer.objects.filter(room_id=room_id, actual_seconds__isnull=False).order_by('order').values_list(
+            'band_name', 'minutes', 'actual_seconds', 'paused_seconds',
+            'member1_id', 'member2_id', 'member3_id', 'completed_at',
+        )
+    )
+    if not timers:
+        return None
+
+    archived = [
+        ArchivedTimer(
+            position=position,
+            band_name=band_name,
+            minutes=minutes,
+            actual_seconds=actual_seconds,
+            overrun_seconds=actual_seconds - minutes * 60,
+            paused_seconds=paused_seconds,
+            member1_id=member1_id,
+            member2_id=member2_id,
+            member3_id=member3_id,
+        )
+        for position, (band_name, minutes, actual_seconds, paused_seconds, member1_id, member2_id, member3_id, _)
+        in enumerate(timers, start=1)
+    ]
+    archive = RehearsalArchive.objects.create(
+        room_id=room_id,
+        timer_count=len(archived),
+        total_time_difference=sum(timer.overrun_seconds for timer in archived),
+        finished_at=max((timer[-1] for timer in timers if timer[-1]), default=None),
+    )
+    for timer in archived:
+        timer.archive = archive
+    ArchivedTimer.objects.bulk_create(archived, batch_size=500)
+    return archive
+
+
+def _percentile(sorted_values, percent):
+    """パーセンタイル（線形補間。NumPy の percentile の既定と同じ）"""
+    position = (len(sorted_values) - 1) * percent / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _summarize(overruns, paused):
+    overruns.sort()
+    paused = [seconds for seconds in paused if seconds is not None]
+    stats = {
+        'count': len(overruns),
+        'mean_overrun': round(sum(overruns) / len(overruns), 1),
+        'max_overrun': overruns[-1],
+        'mean_paused': round(sum(paused) / len(paused), 1) if paused else None,
+    }
+    for percent in PERCENTILES:
+        stats[f'p{percent}_overrun'] = round(_percentile(overruns, percent), 1)
+    return stats
+
+
+def overrun_stats(room_id, group='band', since=None):
+    """
+    リハーサル記録の押し巻きをバンド・担当者ごとに集計
+
+    Args:
+        group: 'band'（バンド名ごと）または 'member'（担当者ごと。3名それぞれに計上）
+        since: この日時以降にアーカイブした記録だけを集計
+
+    Returns:
+        dict: {'rehearsal_count': 記録の件数, 'timer_count': タイマー数, 'groups': [...]}
+            groups は平均押し巻きの大きい順。各要素は count, mean_overrun, p50_overrun,
+            p90_overrun, max_overrun, mean_paused（秒）と band_name または member_id, member_name
+
+    Raises:
+        ValueError: group が不正な場合
+    """
+    if group not in GROUPS:
+        raise ValueError(f'group は {GROUPS} のいずれかを指定してください: {group}')
+
+    archives = RehearsalArchive.objects.filter(room_id=room_id)
+    if since:
+        archives = archives.filter(archived_at__gte=since)
+    rows = ArchivedTimer.objects.filter(archive__in=archives)
+
+    overruns = defaultdict(list)
+    paused = defaultdict(list)
+    timer_count = 0
+    archive_ids = set()
+    if group == 'band':
+        for archive_id, band_name, overrun, paused_seconds in rows.values_list(
+            'archive_id', 'band_name', 'overrun_seconds', 'paused_seconds'
+        ).iterator(chunk_size=2000):
+            timer_count += 1
+            archive_ids.add(archive_id)
+            overruns[band_name].append(overrun)
+            paused[band_name].append(paused_seconds)
+        groups = [
+            {'band_name': band_name, **_summarize(values, paused[band_name])}
+            for band_name, values in overruns.items()
+        ]
+    else:
+        for archive_id, member1_id, member2_id, member3_id, overrun, paused_seconds in rows.values_list(
+            'archive_id', 'member1_id', 'member2_id', 'member3_id', 'overrun_seconds', 'paused_seconds'
+        ).iterator(chunk_size=2000):
+            timer_count += 1
+            archive_ids.add(archive_id)
+            for member_id in (member1_id, member2_id, member3_id):
+                if member_id is not None:
+                    overruns[member_id].append(overrun)
+                    paused[member_id].append(paused_seconds)
+        names = dict(Member.objects.filter(id__in=overruns).values_list('id', 'name'))
+        groups = [
+            {'member_id': member_id, 'member_name': names.get(member_id), **_summarize(values, paused[member_id])}
+            for member_id, values in overruns.items()
+        ]
+
+    groups.sort(key=lambda stats: stats['mean_overrun'], reverse=True)
+    return {
+        'rehearsal_count': len(archive_ids),
+        'timer_count': timer_count,
+        'groups': groups,
+    }
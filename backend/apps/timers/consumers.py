@@ -1,86 +1,285 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
-import json
+from django.conf import settings
+from urllib.parse import parse_qs
+import time
 from channels.db import database_sync_to_async
-from .models import TimerState, Timer
-from .serializers import TimerStateSerializer, TimerSerializer
+from .payloads import get_timer_list_payload, get_timer_state_payload, encode_frame
+from .query_budget import query_budget
+from .json_codec import dumps_text, loads
+from .send_queue import SendQueue, add_counters
+from . import msgpack_protocol
+from .models import Room, DEFAULT_ROOM_SLUG
+from .rooms import get_room_id
+from .utils import (
+    TIMER_GROUP, TICK_GROUP, LIST_GROUP, DELTA_GROUP,
+    room_group, get_list_version, get_event_seq, get_events_since,
+)
 
 
 class TimerConsumer(AsyncWebsocketConsumer):
     """
     WebSocketコンシューマー（タイマー更新用）
 
-    グループ: 'timer_updates'
+    /ws/timer/ は既定のルーム、/ws/timer/<room>/ は指定したルームの配信だけを受け取る。
+    存在しないルームの場合は 4404 で切断する。
+
+    グループ（ルームごと）:
+      - 'timer_updates'     (状態遷移。全クライアント)
+      - 'timer_ticks'       (1秒ごとの状態配信。clock=sync以外のクライアント)
+      - 'timer_lists'       (リスト全体。list=delta以外のクライアント)
+      - 'timer_list_deltas' (リスト差分。list=deltaのクライアント)
     受信メッセージタイプ:
       - timer.state.updated (タイマー状態更新)
       - timer.list.updated (タイマーリスト更新)
+      - timer.upserted / timer.deleted / timers.reordered (リスト差分、version付き)
+      - timer.list.snapshot (リスト全体の入れ替え、version付き)
+
+    クエリパラメータ:
+      - clock=sync: 1秒ごとの配信を受け取らず、状態遷移時の配信（deadline, server_time付き）と
+        ping/pong による時計ずれ補正でクライアント側がカウントダウンを描画する
+      - list=delta: 接続時にバージョン付きスナップショットを受け取り、以降は差分のみ受信する
+      - last_seq=N: 再接続時、最後に受信したseqを指定するとN以降の配信だけを再送する
+        （イベントログから削除済みの場合はスナップショットを送る）
+
+    サブプロトコル:
+      - 指定なし: JSONのテキストフレーム（既定）
+      - kanritimer.msgpack.v1: コンパクトなスキーマのMessagePackバイナリフレーム
+        （msgpack_protocol を参照。TIMER_MSGPACK_PROTOCOL=False なら受け付けない）
+
+    配信メッセージは配信元（utils.send_event）で1回だけエンコードされ、そのまま送信する。
+    送信は接続ごとの送信キュー（send_queue.SendQueue）経由で、遅いクライアントには
+    1秒ごとの状態配信を最新の1件だけ送る（状態遷移・リストの配信は破棄しない）。
+    配信メッセージには seq（単調増加）が付く。1秒ごとの状態配信は再送対象外のため seq なし。
+    再送と通常配信が重なることがあるため、クライアントは受信済みseq以下を無視すること。
+
+    クライアントからのメッセージ:
+      - {"type": "ping", "client_time": <ミリ秒>}
+        → {"type": "pong", "client_time": <そのまま>, "server_time": <ミリ秒>}
+      - {"type": "resync"}
+        → バージョンの欠番を検知した場合に送信。スナップショットを送り直す
     """
 
     async def connect(self):
+        self.group_names = []
+        self.send_queue = None
+        room = self.scope['url_route']['kwargs'].get('room', DEFAULT_ROOM_SLUG)
+        self.room_id = await self.get_room_id(room)
+        if self.room_id is None:
+            await self.close(code=4404)
+            return
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.binary = (
+            settings.TIMER_MSGPACK_PROTOCOL
+            and msgpack_protocol.PROTOCOL in self.scope.get('subprotocols', [])
+        )
+        self.clock_sync = query.get('clock', [''])[0] == 'sync'
+        self.list_delta = query.get('list', [''])[0] == 'delta'
+
         # グループに参加
-        self.group_name = 'timer_updates'
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
+        self.group_names = [TIMER_GROUP, DELTA_GROUP if self.list_delta else LIST_GROUP]
+        if not self.clock_sync:
+            self.group_names.append(TICK_GROUP)
+        for group_name in self.group_names:
+            await self.channel_layer.group_add(
+                room_group(group_name, self.room_id, binary=self.binary),
+                self.channel_name
+            )
+        await self.accept(subprotocol=msgpack_protocol.PROTOCOL if self.binary else None)
+        self.send_queue = SendQueue(
+            self.send_encoded,
+            settings.TIMER_WS_MAX_PENDING,
+            on_overflow=self.close_overflowed,
+            flush=self.add_counters,
         )
-        await self.accept()
 
-        # 接続時に現在の状態を送信（状態復元）
-        await self.send_current_state()
+        # 再接続時は取りこぼした配信だけを再送、できなければ現在の状態を送信（状態復元）
+        last_seq = query.get('last_seq', [''])[0]
+        resumed = last_seq.isdigit() and await self.replay_events(int(last_seq))
+        if not resumed:
+            await self.send_current_state()
 
         # 接続確立メッセージ
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'connection_established',
-            'message': 'WebSocket接続が確立されました'
-        }))
+            'message': 'WebSocket接続が確立されました',
+            'clock': 'sync' if self.clock_sync else 'tick',
+            'list': 'delta' if self.list_delta else 'full',
+            'resumed': resumed
+        })
 
     async def disconnect(self, close_code):
         # グループから離脱
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        for group_name in self.group_names:
+            await self.channel_layer.group_discard(
+                room_group(group_name, self.room_id, binary=self.binary),
+                self.channel_name
+            )
+        if self.send_queue is not None:
+            await self.send_queue.close()
+
+    async def close_overflowed(self):
+        """送信キューが上限を超えた接続を閉じる（1013: Try Again Later。クライアントは再接続する）"""
+        await self.close(code=1013)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """クライアントからのメッセージを処理"""
+        try:
+            if bytes_data is not None:
+                message = msgpack_protocol.decode_message(bytes_data)
+            else:
+                message = loads(text_data or '')
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+
+        if message.get('type') == 'ping':
+            # NTP方式の時計ずれ推定用: offset = server_time - (client_time + 受信時刻) / 2
+            await self.send_message({
+                'type': 'pong',
+                'client_time': message.get('client_time'),
+                'server_time': time.time() * 1000
+            })
+        elif message.get('type') == 'resync':
+            await self.send_timer_list()
+
+    async def replay_events(self, last_seq):
+        """
+        last_seqより後の配信を再送
+
+        Returns:
+            bool: 再送できた場合True（イベントログから削除済みの場合False）
+        """
+        events = await self.get_events_since(last_seq)
+        if events is None:
+            return False
+
+        for group_name, message in events:
+            if group_name in self.group_names:
+                if self.binary:
+                    message = {**message, 'frame': msgpack_protocol.from_json_frame(message['frame'])}
+                await self.dispatch(message)
+        return True
 
     async def send_current_state(self):
         """接続時に現在のタイマー状態とリストを送信"""
+        # 状態より先にseqを読むため、以降の配信を取りこぼすことはない
+        seq = await self.get_event_seq()
         timer_state = await self.get_timer_state()
-        timer_list = await self.get_timer_list()
 
         # タイマー状態を送信
-        await self.send(text_data=json.dumps({
-            'type': 'timer_state_updated',
-            'data': timer_state
-        }))
+        await self.send_payload('timer_state_updated', timer_state, seq=seq)
 
         # タイマーリストを送信
-        await self.send(text_data=json.dumps({
-            'type': 'timer_list_updated',
-            'data': timer_list
-        }))
+        await self.send_timer_list(seq)
+
+    async def send_timer_list(self, seq=None):
+        """タイマーリスト全体を送信（list=deltaのクライアントにはバージョン付きスナップショット）"""
+        if seq is None:
+            seq = await self.get_event_seq()
+
+        if self.list_delta:
+            version, timer_list = await self.get_timer_list_snapshot()
+            await self.send_payload('timer_list_snapshot', timer_list, seq=seq, version=version)
+        else:
+            timer_list = await self.get_timer_list()
+            await self.send_payload('timer_list_updated', timer_list, seq=seq)
 
     async def timer_state_updated(self, event):
         """タイマー状態更新を受信して送信"""
-        await self.send(text_data=json.dumps({
-            'type': 'timer_state_updated',
-            'data': event['data']
-        }))
+        await self.send_frame(event)
 
     async def timer_list_updated(self, event):
         """タイマーリスト更新を受信して送信"""
-        await self.send(text_data=json.dumps({
-            'type': 'timer_list_updated',
-            'data': event['data']
-        }))
+        await self.send_frame(event)
+
+    async def timer_upserted(self, event):
+        """タイマー作成・更新の差分を受信して送信"""
+        await self.send_frame(event)
+
+    async def timer_deleted(self, event):
+        """タイマー削除の差分を受信して送信"""
+        await self.send_frame(event)
+
+    async def timers_reordered(self, event):
+        """順序変更の差分（id→orderのみ）を受信して送信"""
+        await self.send_frame(event)
+
+    async def timer_list_snapshot(self, event):
+        """リスト全体の入れ替えを受信して送信"""
+        await self.send_frame(event)
+
+    async def send_frame(self, event):
+        """配信元でエンコード済みのフレームをそのまま送信（ソケットごとにエンコードしない）"""
+        if event.get('replaceable'):
+            self.send_queue.put_latest(event['frame'])
+            return
+        if event['type'] == 'timer.state.updated':
+            # 保持中の1秒ごとの状態配信はこれより古い
+            self.send_queue.discard_latest()
+        self.send_queue.put(event['frame'])
+
+    async def send_payload(self, message_type, payload, seq=None, **fields):
+        """ペイロードをこの接続のプロトコルでフレームにして送信"""
+        if self.binary:
+            self.send_queue.put(msgpack_protocol.encode_frame(message_type, payload.data, seq, **fields))
+        else:
+            self.send_queue.put(encode_frame(message_type, payload, seq, **fields))
+
+    async def send_message(self, message):
+        """制御メッセージをこの接続のプロトコルで送信"""
+        if self.binary:
+            self.send_queue.put(msgpack_protocol.encode_message(message))
+        else:
+            self.send_queue.put(dumps_text(message))
+
+    async def send_encoded(self, frame):
+        """エンコード済みのフレームを送信（送信キューから呼ばれる）"""
+        if self.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    @database_sync_to_async
+    def get_room_id(self, room):
+        """ルームIDを取得（存在しなければNone）"""
+        try:
+            return get_room_id(room)
+        except Room.DoesNotExist:
+            return None
 
     @database_sync_to_async
+    def add_counters(self, counts):
+        """送信キューのカウンターをルームの合計に加算"""
+        add_counters(self.room_id, counts)
+
+    @database_sync_to_async
+    def get_event_seq(self):
+        """最後に配信したイベントのseqを取得"""
+        return get_event_seq(self.room_id)
+
+    @database_sync_to_async
+    def get_events_since(self, last_seq):
+        """イベントログから再送対象を取得"""
+        return get_events_since(self.room_id, last_seq)
+
+    # 接続時・再同期時のスナップショット（ペイロードキャッシュがなければ状態・リストを作り直す）
+    @database_sync_to_async
+    @query_budget(2, 'ws:timer-state')
     def get_timer_state(self):
-        """タイマー状態を取得（非同期対応）"""
-        timer_state = TimerState.load()
-        serializer = TimerStateSerializer(timer_state)
-        return serializer.data
+        """タイマー状態のペイロードを取得（非同期対応）"""
+        return get_timer_state_payload(self.room_id)
 
     @database_sync_to_async
+    @query_budget(1, 'ws:timer-list')
     def get_timer_list(self):
-        """タイマーリストを取得（非同期対応）"""
-        timers = Timer.objects.all().order_by('order')
-        serializer = TimerSerializer(timers, many=True)
-        return serializer.data
+        """タイマーリストのペイロードを取得（非同期対応）"""
+        return get_timer_list_payload(self.room_id)
+
+    @database_sync_to_async
+    @query_budget(1, 'ws:timer-list-snapshot')
+    def get_timer_list_snapshot(self):
+        """バージョンとタイマーリストを取得（バージョンを先に読むため、差分の取りこぼしはない）"""
+        version = get_list_version(self.room_id)
+        return version, get_timer_list_payload(self.room_id)
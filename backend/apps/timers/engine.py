@@ -0,0 +1,187 @@
+"""
+ASGIプロセス内tickエンジン（TIMER_SCHEDULER_MODE = 'asgi'）
+
+Celery Worker/Beatを使わず、Daphne(Channels)のイベントループ上のasyncioタスクとして
+1秒ごとに全ルームのtickパイプラインを実行する。
+
+- 複数のASGIレプリカのうち1台だけがtickを実行するよう、TTL付きRedisロックでリーダーを選出
+- リーダーはtickとは別のタスクで TTL の1/3ごとにロックを延長（ハートビート）するため、
+  tickが長引いてもロックは切れない。延長に失敗したらリーダーを降り、実行中のtickも
+  次のルームに進む前に中断する（2台が同時にtick・通知しないように）
+- LINE通知の送信はtickの外（送信用のスレッド）で行うため、tickの所要時間に含まれない
+- リーダーが落ちた場合はロックのTTL切れ後に他のレプリカが自動で引き継ぐ
+- tickは秒境界に揃えて実行するため、Beat→ブローカー→Workerの遅延・揺らぎがない
+"""
+from channels.db import database_sync_to_async
+from django.conf import settings
+from redis.exceptions import LockError, RedisError
+from .redis_client import get_async_redis, redis_key
+from .tick import run_room_ticks
+import asyncio
+import sys
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEADER_LOCK_KEY = redis_key('tick-engine', 'leader')
+
+
+class TickEngine:
+    """リーダー選出付きのasyncio tickループ"""
+
+    def __init__(self, interval=1.0, lock_ttl=None):
+        self.interval = interval
+        self.lock_ttl = lock_ttl or settings.TIMER_ENGINE_LOCK_TTL
+        self.task = None
+        self.redis = None
+        self.lock = None
+        self.is_leader = False
+
+    def ensure_started(self):
+        """実行中のイベントループ上でエンジンを起動（2回目以降は何もしない）"""
+        if self.task and not self.task.done():
+            return
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        logger.info('tickエンジン起動')
+
+    async def stop(self):
+        """エンジンを停止し、リーダーであればロックを解放"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self._release()
+
+    async def run(self):
+        self.redis = get_async_redis()
+        self.lock = self.redis.lock(LEADER_LOCK_KEY, timeout=self.lock_ttl)
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat())
+
+        try:
+            while True:
+                try:
+                    await self._sleep_until_next_tick()
+
+                    if not await self._hold_leadership():
+                        continue
+
+                    await database_sync_to_async(run_room_ticks)(should_continue=lambda: self.is_leader)
+
+                except asyncio.CancelledError:
+                    raise
+                except RedisError as e:
+                    # Redis障害時はリーダーを降り、復旧後に選出し直す
+                    logger.error(f'tickエンジン Redisエラー: {e}')
+                    self.is_leader = False
+                except Exception as e:
+                    logger.error(f'tickエンジン error: {e}', exc_info=True)
+        finally:
+            heartbeat.cancel()
+
+    async def _sleep_until_next_tick(self):
+        """次の秒境界まで待機（処理時間に関係なく壁時計の秒に揃える）"""
+        delay = self.interval - (time.time() % self.interval)
+        await asyncio.sleep(delay)
+
+    async def _heartbeat(self):
+        """
+        リーダーの間、TTL の1/3ごとにロックを延長（tickの実行中も延長できるよう別タスクで）
+
+        tick（run_room_ticks）はスレッドで実行されるため、その間もイベントループ上で動く。
+        """
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            if not self.is_leader:
+                continue
+            try:
+                await self.lock.reacquire()
+            except LockError:
+                logger.warning('tickエンジン: リーダーロックを失いました')
+                self.is_leader = False
+            except RedisError as e:
+                logger.error(f'tickエンジン Redisエラー（ロック延長）: {e}')
+                self.is_leader = False
+
+    async def _hold_leadership(self):
+        """リーダーなら続行（ロックはハートビートが延長）、そうでなければ取得を試みる"""
+        if self.is_leader:
+            return True
+
+        self.is_leader = await self.lock.acquire(blocking=False)
+        if self.is_leader:
+            logger.info('tickエンジン: リーダーに選出されました')
+        return self.is_leader
+
+    async def _release(self):
+        if self.is_leader and self.lock:
+            try:
+                await self.lock.release()
+            except (LockError, RedisError):
+                pass
+            self.is_leader = False
+        if self.redis:
+            await self.redis.close()
+            self.redis = None
+
+
+engine = TickEngine()
+
+
+def start_on_boot():
+    """
+    プロセスの起動時にエンジンを起動するよう予約（asgi.py でアプリケーションを読み込むときに呼ぶ）
+
+    接続がなくてもリーダー選出に参加し、リーダーが落ちた場合に引き継げるようにする。
+    イベントループ上で読み込まれた場合（uvicorn等）はそのループに、Daphne（読み込み時は
+    ループが動いていない）では Twisted の reactor が動き始めたときに起動する。
+    """
+    try:
+        asyncio.get_running_loop().call_soon(engine.ensure_started)
+        return
+    except RuntimeError:
+        pass
+
+    # Daphne が asyncio の reactor を導入済みの場合のみ（reactor を新たに導入しない）。
+    # reactor の起動直後はまだループが動いていないため、Daphne が設定したループに予約する
+    if 'twisted.internet.reactor' in sys.modules:
+        from twisted.internet import reactor
+
+        reactor.callWhenRunning(lambda: asyncio.get_event_loop().call_soon(engine.ensure_started))
+        return
+
+    logger.warning('tickエンジン: イベントループがないため、最初の接続時に起動します')
+
+
+class TickEngineMiddleware:
+    """
+    ASGIアプリをラップしてtickエンジンを起動するミドルウェア
+
+    起動は start_on_boot で予約済み。lifespanに対応したサーバーでは起動・終了時にも、
+    それ以外では接続のたびに（予約できなかった場合の予備として）起動を確認する。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        engine.ensure_started()
+        await self.app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                engine.ensure_started()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await engine.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
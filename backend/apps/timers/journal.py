@@ -0,0 +1,213 @@
+"""
+タイマーイベントの記録（追記のみ）と状態の再構築
+
+TimerState を変更する書き込みは全てイベントとして記録する:
+  - 状態遷移（transitions.apply_transition）: 遷移の種類と UPDATE したフィールド
+  - TimerState.save(): 保存したフィールド（kind='state'）
+どちらも変更後の version を持つ。version はルーム内で1ずつ進むため、あるスナップショット
+以降のイベントを version 順に適用すれば、その時点の状態を再構築できる（rebuild）。
+タイマーリストの操作（作成・削除・並べ替え等）は状態を変更しないイベントとして記録する
+（version は null。監査・集計用）。
+
+イベントは状態の書き込みと同じトランザクションで INSERT する。buffered() のブロック内
+（一括操作・一括登録）では溜めておき、ブロックを抜けるときに1回の bulk_create で書き込む。
+
+version が TIMER_EVENT_SNAPSHOT_INTERVAL の倍数になるたびに状態全体のスナップショットを
+保存するため、再構築で読むイベントは最大でもその件数になる。
+"""
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import models
+from django.utils.dateparse import parse_datetime
+from datetime import datetime
+from .models import TimerEvent, TimerState, TimerStateSnapshot
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 記録しない TimerState のフィールド（version は TimerEvent.version に持つ）
+_EXCLUDED_FIELDS = ('id', 'room', 'version', 'updated_at')
+
+_local = threading.local()
+
+
+class JournalError(Exception):
+    """イベントから状態を再構築できない"""
+
+
+def is_enabled():
+    return settings.TIMER_EVENT_JOURNAL
+
+
+def state_fields():
+    """記録する TimerState のフィールド"""
+    return [field for field in TimerState._meta.concrete_fields if field.name not in _EXCLUDED_FIELDS]
+
+
+def _encode(value):
+    """JSONに保存できる値に変換（モデルは主キー、日時はマイクロ秒まで含むISO形式）"""
+    if isinstance(value, models.Model):
+        return value.pk
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_changes(changes):
+    """{フィールド名: 値} を {attname: JSONの値} に変換"""
+    return {
+        TimerState._meta.get_field(name).attname: _encode(value)
+        for name, value in changes.items()
+        if name not in _EXCLUDED_FIELDS
+    }
+
+
+def encode_state(timer_state):
+    """TimerState の記録するフィールド全体"""
+    return {field.attname: _encode(getattr(timer_state, field.attname)) for field in state_fields()}
+
+
+def decode_state(values):
+    """encode_state・encode_changes の値を TimerState に渡せる値に戻す"""
+    decoded = {}
+    for field in state_fields():
+        if field.attname not in values:
+            continue
+        value = values[field.attname]
+        if isinstance(field, models.DateTimeField) and value is not None:
+            value = parse_datetime(value)
+        decoded[field.attname] = value
+    return decoded
+
+
+def _snapshot(timer_state, version):
+    """version がスナップショットの間隔の倍数ならスナップショットを返す"""
+    interval = settings.TIMER_EVENT_SNAPSHOT_INTERVAL
+    if interval <= 0 or version % interval:
+        return None
+    return TimerStateSnapshot(room_id=timer_state.room_id, version=version, state=encode_state(timer_state))
+
+
+def _write(events, snapshots):
+    if len(events) == 1:
+        events[0].save()
+    elif events:
+        TimerEvent.objects.bulk_create(events)
+    if snapshots:
+        # 同じ version のスナップショットは内容も同じ
+        TimerStateSnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+
+
+def record(room_id, kind, timer_id=None, data=None, timer_state=None, changes=None):
+    """
+    イベントを記録（buffered() のブロック内ならブロックを抜けるときに書き込む）
+
+    Args:
+        kind: TimerEvent.KIND_CHOICES の種類
+        timer_id: 対象のタイマーID
+        data: 詳細（JSONに保存できる値）
+        timer_state: 状態を変更した場合、変更後の TimerState（version を記録し、
+            スナップショットを取る version ならスナップショットも保存）
+        changes: 状態を変更した場合、変更したフィールドの {フィールド名: 値}
+    """
+    if not is_enabled():
+        return
+
+    event = TimerEvent(room_id=room_id, kind=kind, timer_id=timer_id, data=data or {})
+    snapshot = None
+    if timer_state is not None:
+        event.version = timer_state.version
+        event.changes = encode_changes(changes or {})
+        snapshot = _snapshot(timer_state, timer_state.version)
+
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        _write([event], [snapshot] if snapshot else [])
+        return
+    buffer[0].append(event)
+    if snapshot:
+        buffer[1].append(snapshot)
+
+
+def record_state(timer_state, update_fields=None):
+    """TimerState.save() で保存したフィールドを記録"""
+    if update_fields is None:
+        changes = {field.name: getattr(timer_state, field.attname) for field in state_fields()}
+    else:
+        changes = {name: getattr(timer_state, name) for name in update_fields}
+    record(
+        timer_state.room_id, 'state',
+        timer_id=timer_state.current_timer_id, timer_state=timer_state, changes=changes,
+    )
+
+
+@contextmanager
+def buffered():
+    """
+    ブロック内で記録したイベントを、ブロックを抜けるときに1回の bulk_create で書き込む
+
+    トランザクション（transaction.atomic）の内側で使う。例外で抜けた場合は書き込まない
+    （トランザクションごと取り消される）。入れ子の場合は一番外側でまとめて書き込む。
+    """
+    if getattr(_local, 'buffer', None) is not None:
+        yield
+        return
+
+    _local.buffer = ([], [])
+    try:
+        yield
+        events, snapshots = _local.buffer
+    finally:
+        _local.buffer = None
+    _write(events, snapshots)
+
+
+def rebuild(room_id, version=None):
+    """
+    スナップショットとそれ以降のイベントから TimerState を再構築
+
+    Args:
+        version: この version 時点の状態（省略時は最新）
+
+    Returns:
+        TimerState: 再構築した状態（保存しない）
+
+    Raises:
+        JournalError: スナップショットがない・イベントが欠けている場合
+    """
+    snapshots = TimerStateSnapshot.objects.filter(room_id=room_id)
+    if version is not None:
+        snapshots = snapshots.filter(version__lte=version)
+    snapshot = snapshots.order_by('-version').first()
+    if snapshot is None:
+        raise JournalError(f'スナップショットがありません (room={room_id})')
+
+    events = TimerEvent.objects.filter(room_id=room_id, version__gt=snapshot.version)
+    if version is not None:
+        events = events.filter(version__lte=version)
+
+    values = dict(snapshot.state)
+    current = snapshot.version
+    for event_version, changes in events.order_by('version').values_list('version', 'changes'):
+        if event_version != current + 1:
+            raise JournalError(f'イベントが欠けています (room={room_id}, version={current + 1})')
+        values.update(changes)
+        current = event_version
+
+    if version is not None and current != version:
+        raise JournalError(f'イベントが欠けています (room={room_id}, version={current + 1})')
+
+    return TimerState(room_id=room_id, version=current, **decode_state(values))
+
+
+def take_snapshot(room_id):
+    """現在の状態のスナップショットを保存（イベントを記録していなかった期間の後の起点に）"""
+    from .state_cache import load_from_db
+
+    timer_state = load_from_db(room_id)
+    snapshot, _ = TimerStateSnapshot.objects.get_or_create(
+        room_id=room_id, version=timer_state.version,
+        defaults={'state': encode_state(timer_state)},
+    )
+    return snapshot
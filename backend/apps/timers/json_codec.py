@@ -0,0 +1,66 @@
+"""
+JSONエンコード・デコード（REST・WebSocket・ペイロードキャッシュ共通）
+
+orjson がインストールされていれば orjson で、なければ標準の json で処理する
+（settings.JSON_ENCODER: auto / orjson / json）。
+
+出力はどちらも DRF の JSONRenderer（UNICODE_JSON・COMPACT_JSON が既定値の場合）と同じ:
+  - 区切りは空白なし（',' ':'）、日本語はエスケープしない（UTF-8）
+  - datetime・Decimal・UUID などは DRF の JSONEncoder と同じ変換
+    （datetime は isoformat、UTCは末尾 'Z'。Decimal は float）
+  - U+2028・U+2029 はエスケープする
+ただし orjson は NaN・Infinity を null にする（DRF の STRICT_JSON では例外）。
+"""
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# DRF の JSONEncoder と同じ変換（orjson の default としても使う）
+_encoder = JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+if orjson is not None:
+    # datetime は DRF と同じ表記にするため default に回す
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def _escape_line_separators(encoded):
+    """JavaScriptの文字列リテラルとして扱えるよう U+2028・U+2029 をエスケープ"""
+    return encoded.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def dumps_json(data):
+    """標準の json でエンコード（bytes）"""
+    return _escape_line_separators(_encoder.encode(data).encode())
+
+
+def dumps_orjson(data):
+    """orjson でエンコード（bytes）"""
+    return _escape_line_separators(orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS))
+
+
+def get_backend():
+    """使用するエンコーダー（'orjson' / 'json'）"""
+    backend = getattr(settings, 'JSON_ENCODER', 'auto')
+    if backend == 'auto':
+        return 'orjson' if orjson is not None else 'json'
+    if backend == 'orjson' and orjson is None:
+        raise ImportError('JSON_ENCODER=orjson ですが orjson がインストールされていません')
+    return backend
+
+
+if get_backend() == 'orjson':
+    dumps = dumps_orjson
+    loads = orjson.loads
+else:
+    dumps = dumps_json
+    loads = json.loads
+
+
+def dumps_text(data):
+    """エンコードして str で返す（WebSocketのテキストフレーム用）"""
+    return dumps(data).decode()
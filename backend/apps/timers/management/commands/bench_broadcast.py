@@ -0,0 +1,92 @@
+"""
+WebSocket配信1回あたりのエンコードコストを視聴者数ごとに計測する
+
+従来方式（チャネルレイヤーにデータの辞書を渡し、各コンシューマーが json.dumps する）と
+現在の方式（utils.send_event がフレームを1回だけ作り、チャネルレイヤーにはエンコード済みの
+文字列を渡す）を、チャネルレイヤー（channels_redis）のメッセージのシリアライズ込みで比較する。
+Redisへの送信自体は含まない。あわせてJSONとMessagePackサブプロトコルのフレームサイズを表示する。
+
+    python manage.py bench_broadcast                       # 既定のルームのタイマー状態
+    python manage.py bench_broadcast --payload list        # タイマーリスト
+    python manage.py bench_broadcast --audience 1 100 1000 --repeat 50
+"""
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from channels_redis.core import RedisChannelLayer
+from apps.timers.models import Room, DEFAULT_ROOM_SLUG
+from apps.timers.payloads import get_timer_state_payload, get_timer_list_payload, frame_parts
+from apps.timers import msgpack_protocol
+
+PAYLOADS = {
+    'state': ('timer.state.updated', get_timer_state_payload),
+    'list': ('timer.list.updated', get_timer_list_payload),
+}
+
+
+class Command(BaseCommand):
+    help = 'WebSocket配信のエンコードコストを視聴者数ごとに計測する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', default=DEFAULT_ROOM_SLUG, help='対象のルームID（スラッグ）')
+        parser.add_argument('--payload', choices=sorted(PAYLOADS), default='state', help='配信するペイロード')
+        parser.add_argument('--audience', type=int, nargs='+', default=[1, 10, 100, 500, 1000],
+                            help='視聴者数（複数指定可）')
+        parser.add_argument('--repeat', type=int, default=20, help='視聴者数ごとの配信回数')
+
+    def handle(self, *args, **options):
+        try:
+            room = Room.objects.get(slug=options['room'])
+        except Room.DoesNotExist:
+            raise CommandError(f'ルームが見つかりません: {options["room"]}')
+
+        event_type, get_payload = PAYLOADS[options['payload']]
+        payload = get_payload(room.id)
+        # シリアライズのみ使う（Redisには接続しない）
+        layer = RedisChannelLayer()
+        channel_name = 'specific.bench!channel'
+
+        binary_frame = msgpack_protocol.encode_frame(event_type.replace('.', '_'), payload.data, 1)
+        self.stdout.write(
+            f'ペイロード: {options["payload"]} (JSON {len(self.encode_once(event_type, payload).encode())} bytes, '
+            f'{msgpack_protocol.PROTOCOL} {len(binary_frame)} bytes), 配信回数: {options["repeat"]}'
+        )
+        self.stdout.write(f'{"視聴者数":>8} {"従来(ms/配信)":>14} {"現在(ms/配信)":>14} {"現在のエンコード(ms)":>20}')
+
+        for audience in options['audience']:
+            legacy = self.measure(options['repeat'], lambda: self.legacy_broadcast(
+                layer, channel_name, event_type, payload.data, audience
+            ))
+            encode = self.measure(options['repeat'], lambda: self.encode_once(event_type, payload))
+            current = self.measure(options['repeat'], lambda: self.current_broadcast(
+                layer, channel_name, event_type, self.encode_once(event_type, payload), audience
+            ))
+            self.stdout.write(f'{audience:>8} {legacy:>14.3f} {current:>14.3f} {encode:>20.4f}')
+
+    def measure(self, repeat, func):
+        """1回あたりの平均時間（ミリ秒）"""
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) * 1000 / repeat
+
+    def encode_once(self, event_type, payload):
+        """配信元でのフレーム作成（utils.send_event と同じ）"""
+        prefix, suffix = frame_parts(event_type.replace('.', '_'), payload)
+        return f'{prefix}1{suffix}'
+
+    def legacy_broadcast(self, layer, channel_name, event_type, data, audience):
+        """従来方式: 視聴者ごとにデータの辞書をシリアライズし、コンシューマーで json.dumps"""
+        for _ in range(audience):
+            message = layer.deserialize(layer.serialize({
+                'type': event_type, 'data': data, 'seq': 1, '__asgi_channel__': channel_name
+            }))
+            json.dumps({'type': event_type.replace('.', '_'), 'seq': message['seq'], 'data': message['data']})
+
+    def current_broadcast(self, layer, channel_name, event_type, frame, audience):
+        """現在の方式: 視聴者ごとにはエンコード済みの文字列を受け渡すだけ"""
+        for _ in range(audience):
+            message = layer.deserialize(layer.serialize({
+                'type': event_type, 'frame': frame, '__asgi_channel__': channel_name
+            }))
+            message['frame']
@@ -0,0 +1,90 @@
+"""
+JSONエンコードのマイクロベンチマーク
+
+実際のタイマーリストと同じ形（TimerSerializer の出力。日本語のバンド名・担当者名、
+ISO形式の日時、押し巻き表示）のデータを件数ごとに作り、以下を比較する。
+
+  - drf:    DRF の JSONRenderer（従来の経路）
+  - json:   json_codec.dumps_json（標準の json）
+  - orjson: json_codec.dumps_orjson（orjson がインストールされている場合）
+
+あわせて、各エンコーダーの出力が JSONRenderer とバイト単位で一致するかを確認する。
+DBには書き込まない（未保存のモデルインスタンスをシリアライズする）。
+
+    python manage.py bench_json
+    python manage.py bench_json --timers 10 100 1000 --repeat 200
+"""
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from apps.members.models import Member
+from apps.timers.models import Timer
+from apps.timers.serializers import TimerSerializer
+from apps.timers import json_codec
+
+MEMBER_NAMES = ['山田', '佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '中村']
+
+
+def build_timers(count):
+    """TimerSerializer(many=True) の出力と同じ形のデータを作る"""
+    now = timezone.now()
+    members = [Member(id=index + 1, name=name) for index, name in enumerate(MEMBER_NAMES)]
+    timers = []
+    for index in range(count):
+        completed = index < count // 2
+        timers.append(Timer(
+            id=index + 1,
+            band_name=f'バンド{index + 1}「夏の終わりのハーモニー」',
+            minutes=15,
+            member1=members[index % 8],
+            member2=members[(index + 1) % 8],
+            member3=members[(index + 2) % 8],
+            order=index + 1,
+            actual_seconds=900 + (index % 7) * 37 - 100 if completed else None,
+            completed_at=now - timedelta(minutes=count - index) if completed else None,
+            created_at=now - timedelta(days=1, microseconds=index * 1234),
+        ))
+    return TimerSerializer(timers, many=True).data
+
+
+class Command(BaseCommand):
+    help = 'JSONエンコード（DRF JSONRenderer / 標準json / orjson）を比較する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timers', type=int, nargs='+', default=[10, 50, 200, 1000],
+                            help='タイマー件数（複数指定可）')
+        parser.add_argument('--repeat', type=int, default=100, help='件数ごとのエンコード回数')
+
+    def handle(self, *args, **options):
+        encoders = {
+            'drf': JSONRenderer().render,
+            'json': json_codec.dumps_json,
+        }
+        if json_codec.orjson is not None:
+            encoders['orjson'] = json_codec.dumps_orjson
+
+        self.stdout.write(f'使用中のエンコーダー: {json_codec.get_backend()}, エンコード回数: {options["repeat"]}')
+        self.stdout.write(f'{"件数":>6} {"サイズ":>9} ' + ' '.join(f'{name + "(ms)":>12}' for name in encoders))
+
+        for count in options['timers']:
+            data = build_timers(count)
+            expected = JSONRenderer().render(data)
+            for name, encode in encoders.items():
+                if encode(data) != expected:
+                    raise CommandError(f'{name} の出力が JSONRenderer と一致しません（{count}件）')
+
+            results = [self.measure(options['repeat'], encode, data) for encode in encoders.values()]
+            self.stdout.write(
+                f'{count:>6} {len(expected):>9} ' + ' '.join(f'{result:>12.4f}' for result in results)
+            )
+
+        self.stdout.write(self.style.SUCCESS('すべての出力が JSONRenderer と一致しました'))
+
+    def measure(self, repeat, encode, data):
+        """1回あたりの平均時間（ミリ秒）"""
+        started = time.perf_counter()
+        for _ in range(repeat):
+            encode(data)
+        return (time.perf_counter() - started) * 1000 / repeat
@@ -0,0 +1,239 @@
+"""
+REST APIのベンチマーク（タイマー件数ごとのレイテンシとクエリ数）
+
+専用のルームにタイマーを件数ごと（既定 10 / 100 / 1,000 / 10,000件）に作成し、
+apps/timers/views.py の各ビューを繰り返し呼んで、レイテンシ（中央値・p95・最小）と
+1リクエストあたりのクエリ数（最大）を計測する。ビューはHTTPを経由せずURLの解決結果から
+直接呼ぶ（ミドルウェアは含まない）。配信・ペイロードキャッシュ等は設定どおりに動く。
+
+結果はJSONで保存でき（--output）、別のコミットで保存した結果と比較できる（--compare）。
+
+    python manage.py bench_rest --output bench/rest-$(git rev-parse --short HEAD).json
+    python manage.py bench_rest --sizes 10 1000 --compare bench/rest-abc1234.json
+
+計測するビュー（件数ごとにこの順で実行）:
+  get_timers, get_timer_state, create_timer, update_timer, reorder_timers,
+  move_timer（create_timer で作成した分を2番目に移動）, delete_timer（create_timer で作成した分を削除）, skip_timer（開始してからスキップ）
+
+専用のルーム・担当者は終了時に削除する。LINE通知は無効にする。
+"""
+import json
+import subprocess
+import time
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from channels.layers import channel_layers
+from rest_framework.test import APIRequestFactory
+from apps.members.models import Member
+from apps.timers import json_codec
+from apps.timers.models import Room, Timer, TimerState
+from apps.timers.ordering import ORDER_STEP
+
+ENDPOINTS = (
+    'get_timers', 'get_timer_state', 'create_timer', 'update_timer',
+    'reorder_timers', 'move_timer', 'delete_timer', 'skip_timer',
+)
+
+
+def summarize(durations, query_counts):
+    ordered = sorted(durations)
+    return {
+        'iterations': len(ordered),
+        'median_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))] * 1000, 3),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'queries': max(query_counts),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'REST APIのレイテンシとクエリ数をタイマー件数ごとに計測する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                            help='タイマー件数（複数指定可）')
+        parser.add_argument('--iterations', type=int, default=20, help='ビューごとの呼び出し回数')
+        parser.add_argument('--layer', choices=['memory', 'redis'], default='memory',
+                            help='配信に使うチャネルレイヤー（memory: インメモリ / redis: 設定どおり）')
+        parser.add_argument('--output', help='結果を保存するJSONファイル')
+        parser.add_argument('--compare', help='比較する過去の結果（JSONファイル）')
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help='比較時、中央値がこの倍率を超えたら劣化とみなす')
+
+    def handle(self, *args, **options):
+        if options['layer'] == 'memory':
+            settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            channel_layers.backends.clear()
+
+        self.factory = APIRequestFactory()
+        results = {name: {} for name in ENDPOINTS}
+
+        for size in options['sizes']:
+            self.stdout.write(f'\nタイマー {size}件')
+            room, members = self.create_room(size)
+            try:
+                for name, summary in self.run_size(room, members, options['iterations']):
+                    results[name][str(size)] = summary
+                    self.stdout.write(
+                        f'  {name:<16} 中央値 {summary["median_ms"]:>9.3f} ms / p95 {summary["p95_ms"]:>9.3f} ms / '
+                        f'最小 {summary["min_ms"]:>9.3f} ms / クエリ {summary["queries"]:>4}'
+                    )
+            finally:
+                self.delete_room(room, members)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'settings': {
+                'TIMER_STATE_CACHE': settings.TIMER_STATE_CACHE,
+                'TIMER_PAYLOAD_CACHE': settings.TIMER_PAYLOAD_CACHE,
+                'TIMER_SCHEDULER_MODE': settings.TIMER_SCHEDULER_MODE,
+                'JSON_ENCODER': json_codec.get_backend(),
+                'layer': options['layer'],
+            },
+            'iterations': options['iterations'],
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(f'\n結果を保存しました: {options["output"]}')
+
+        if options['compare']:
+            self.compare(report, options['compare'], options['threshold'])
+
+    def create_room(self, size):
+        """試験用のルーム・担当者・タイマーを作成"""
+        suffix = uuid.uuid4().hex[:8]
+        with transaction.atomic():
+            room = Room.objects.create(slug=f'bench-{suffix}', name=f'ベンチマーク {suffix}')
+            TimerState.objects.create(room=room, line_notifications_enabled=False)
+            members = [Member.objects.create(name=f'bench-{suffix}-{index}') for index in range(1, 4)]
+            Timer.objects.bulk_create([
+                Timer(
+                    room=room, band_name=f'ベンチマークバンド{order}', minutes=15, order=order * ORDER_STEP,
+                    member1=members[0], member2=members[1], member3=members[2],
+                )
+                for order in range(1, size + 1)
+            ], batch_size=1000)
+        # 最初のタイマーを現在のタイマーにする（通常の作成と同じ状態）
+        timer_state = TimerState.objects.get(room=room)
+        timer_state.current_timer = Timer.objects.filter(room=room).order_by('order').first()
+        timer_state.save()
+        return room, members
+
+    def delete_room(self, room, members):
+        room.delete()
+        Member.objects.filter(id__in=[member.id for member in members]).delete()
+
+    def call(self, method, path, data=None):
+        """ビューを1回呼び、(経過時間, クエリ数, レスポンス) を返す"""
+        request = getattr(self.factory, method)(path, data, format='json')
+        match = resolve(path)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = match.func(request, *match.args, **match.kwargs)
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise CommandError(f'{method.upper()} {path}: {response.status_code} {getattr(response, "data", "")}')
+        return elapsed, len(queries), response
+
+    def measure(self, calls):
+        """calls（(method, path, data) の反復可能オブジェクト）を順に呼んで集計"""
+        durations, query_counts, responses = [], [], []
+        for method, path, data in calls:
+            elapsed, query_count, response = self.call(method, path, data)
+            durations.append(elapsed)
+            query_counts.append(query_count)
+            responses.append(response)
+        return summarize(durations, query_counts), responses
+
+    def run_size(self, room, members, iterations):
+        base = f'/api/rooms/{room.slug}/timers/'
+        member_ids = {f'member{index}_id': member.id for index, member in enumerate(members, start=1)}
+
+        summary, _ = self.measure(('get', base, None) for _ in range(iterations))
+        yield 'get_timers', summary
+
+        summary, _ = self.measure(('get', f'{base}timer-state/', None) for _ in range(iterations))
+        yield 'get_timer_state', summary
+
+        summary, responses = self.measure(
+            ('post', f'{base}create/', {'band_name': f'追加バンド{index}', 'minutes': 10, **member_ids})
+            for index in range(iterations)
+        )
+        created_ids = [response.data['timer']['id'] for response in responses]
+        yield 'create_timer', summary
+
+        summary, _ = self.measure(
+            ('put', f'{base}{timer_id}/', {'band_name': f'更新バンド{timer_id}', 'minutes': 12, **member_ids})
+            for timer_id in created_ids
+        )
+        yield 'update_timer', summary
+
+        timer_ids = list(Timer.objects.filter(room=room).order_by('order').values_list('id', flat=True))
+        summary, _ = self.measure(
+            ('post', f'{base}reorder/', {'timer_ids': timer_ids[::-1] if index % 2 == 0 else timer_ids})
+            for index in range(iterations)
+        )
+        yield 'reorder_timers', summary
+
+        summary, _ = self.measure(
+            ('post', f'{base}{timer_id}/move/', {'after_id': timer_ids[0]}) for timer_id in created_ids
+        )
+        yield 'move_timer', summary
+
+        summary, _ = self.measure(('delete', f'{base}{timer_id}/delete/', None) for timer_id in created_ids)
+        yield 'delete_timer', summary
+
+        self.call('post', f'{base}timer-state/start/')
+        skips = min(iterations, Timer.objects.filter(room=room).count() - 1)
+        if skips > 0:
+            summary, _ = self.measure(('post', f'{base}timer-state/skip/', None) for _ in range(skips))
+            yield 'skip_timer', summary
+
+    def compare(self, report, path, threshold):
+        """過去の結果と中央値・クエリ数を比較（劣化があれば終了コード1）"""
+        try:
+            with open(path) as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'比較する結果を読み込めません: {e}')
+
+        self.stdout.write(f'\n比較: {baseline.get("commit") or path} → {report["commit"] or "現在"}')
+        regressions = []
+        for name, sizes in report['results'].items():
+            for size, current in sizes.items():
+                previous = baseline.get('results', {}).get(name, {}).get(size)
+                if previous is None:
+                    continue
+                ratio = current['median_ms'] / previous['median_ms'] if previous['median_ms'] else 0
+                query_diff = current['queries'] - previous['queries']
+                regressed = ratio > threshold or query_diff > 0
+                if regressed:
+                    regressions.append(f'{name}({size})')
+                self.stdout.write(
+                    f'  {"!" if regressed else " "} {name:<16} {size:>6}件: 中央値 x{ratio:.2f} '
+                    f'({previous["median_ms"]:.3f} → {current["median_ms"]:.3f} ms), '
+                    f'クエリ {previous["queries"]} → {current["queries"]}'
+                )
+
+        if regressions:
+            raise CommandError(f'劣化あり: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('劣化はありません'))
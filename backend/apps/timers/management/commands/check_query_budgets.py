@@ -0,0 +1,162 @@
+"""
+クエリバジェットの確認（QUERY_BUDGET_MODE = 'raise' で各経路を実行）
+
+専用のルームにタイマーを件数ごと（既定 1 / 50件）に作成し、クエリバジェットを宣言した
+経路（REST の読み取り・WebSocket配信・WebSocket接続時のスナップショット）を
+QUERY_BUDGET_MODE = 'raise' で一通り実行する。件数ごとに、設定どおりのキャッシュと
+キャッシュなし（TIMER_STATE_CACHE・TIMER_PAYLOAD_CACHE を無効。毎回DBから作り直す）の
+両方で実行する。タイマーの件数によってクエリ数が
+増える経路（N+1）があれば QueryBudgetExceeded になり、終了コード1で終わる。
+
+    python manage.py check_query_budgets
+    python manage.py check_query_budgets --sizes 1 10 200
+
+実行する経路（件数ごとにこの順で実行）:
+  - 待機中: get_timers, get_timer_state, get_schedule, WebSocket接続時のスナップショット
+  - 作成・開始・全タイマーのスキップ（状態・リストの配信）
+  - 実行中: get_timer_state, get_schedule
+  - リハーサル記録の保存後: get_events, get_archives, get_analytics（band / member）
+  - 配信: broadcast_timer_state, broadcast_timer_list, broadcast_timer_changes
+
+専用のルーム・担当者は終了時に削除する。LINE通知は無効にする。
+"""
+import uuid
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from channels.layers import channel_layers
+from rest_framework.test import APIRequestFactory
+from apps.members.models import Member
+from apps.timers import archive, transitions
+from apps.timers.consumers import TimerConsumer
+from apps.timers.models import Room, Timer, TimerState
+from apps.timers.ordering import ORDER_STEP
+from apps.timers.query_budget import QueryBudgetExceeded
+from apps.timers.utils import broadcast_timer_state, broadcast_timer_list, broadcast_timer_changes
+
+
+class Command(BaseCommand):
+    help = 'クエリバジェットを宣言した経路をタイマー件数ごとに raise モードで実行する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 50],
+                            help='タイマー件数（複数指定可）')
+        parser.add_argument('--layer', choices=['memory', 'redis'], default='memory',
+                            help='配信に使うチャネルレイヤー（memory: インメモリ / redis: 設定どおり）')
+
+    def handle(self, *args, **options):
+        if options['layer'] == 'memory':
+            settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            channel_layers.backends.clear()
+        settings.QUERY_BUDGET_MODE = 'raise'
+
+        self.factory = APIRequestFactory()
+        self.failures = []
+
+        cache_settings = {name: getattr(settings, name) for name in ('TIMER_STATE_CACHE', 'TIMER_PAYLOAD_CACHE')}
+        for size in options['sizes']:
+            for cached in (True, False):
+                self.stdout.write(f'\nタイマー {size}件（{"キャッシュあり" if cached else "キャッシュなし"}）')
+                for name, value in cache_settings.items():
+                    setattr(settings, name, value and cached)
+                room, members = self.create_room(size)
+                try:
+                    self.run_size(room, members, size)
+                finally:
+                    self.delete_room(room, members)
+        for name, value in cache_settings.items():
+            setattr(settings, name, value)
+
+        if self.failures:
+            for label, error in self.failures:
+                self.stderr.write(f'\n{label}: {error}')
+            raise CommandError(f'クエリ数超過: {len(self.failures)}件')
+        self.stdout.write(self.style.SUCCESS('\nすべての経路がクエリバジェット内です'))
+
+    def create_room(self, size):
+        """試験用のルーム・担当者・タイマーを作成（最初のタイマーを現在のタイマーにする）"""
+        suffix = uuid.uuid4().hex[:8]
+        with transaction.atomic():
+            room = Room.objects.create(slug=f'budget-{suffix}', name=f'クエリバジェット {suffix}')
+            TimerState.objects.create(room=room, line_notifications_enabled=False)
+            members = [Member.objects.create(name=f'budget-{suffix}-{index}') for index in range(1, 4)]
+            Timer.objects.bulk_create([
+                Timer(
+                    room=room, band_name=f'バンド{order % 5}', minutes=15, order=order * ORDER_STEP,
+                    member1=members[0], member2=members[1], member3=members[2],
+                )
+                for order in range(1, size + 1)
+            ], batch_size=1000)
+        transitions.attach(room.id, Timer.objects.filter(room=room).order_by('order').first())
+        return room, members
+
+    def delete_room(self, room, members):
+        room.delete()
+        Member.objects.filter(id__in=[member.id for member in members]).delete()
+
+    def check(self, label, func):
+        """func を実行してクエリ数を表示（超過は記録して続行）"""
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                result = func()
+        except QueryBudgetExceeded as e:
+            self.failures.append((label, e))
+            self.stdout.write(f'  ! {label:<32} {e.label} ({len(e.queries)}/{e.budget})')
+            return None
+        self.stdout.write(f'    {label:<32} クエリ {len(queries):>3}')
+        return result
+
+    def call(self, method, path, data=None):
+        """ビューを1回呼ぶ（4xx・5xx は CommandError）"""
+        request = getattr(self.factory, method)(path, data, format='json')
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.status_code >= 400:
+            raise CommandError(f'{method.upper()} {path}: {response.status_code} {getattr(response, "data", "")}')
+        return response
+
+    def snapshot(self, room, list_delta):
+        """WebSocket接続時に送るスナップショット（TimerConsumer の取得処理）"""
+        consumer = TimerConsumer()
+        consumer.room_id = room.id
+        consumer.list_delta = list_delta
+        async_to_sync(consumer.get_timer_state)()
+        if list_delta:
+            return async_to_sync(consumer.get_timer_list_snapshot)()
+        return async_to_sync(consumer.get_timer_list)()
+
+    def run_size(self, room, members, size):
+        base = f'/api/rooms/{room.slug}/timers/'
+        member_ids = {f'member{index}_id': member.id for index, member in enumerate(members, start=1)}
+
+        self.check('GET timers', lambda: self.call('get', base))
+        self.check('GET timer-state', lambda: self.call('get', f'{base}timer-state/'))
+        self.check('GET schedule', lambda: self.call('get', f'{base}schedule/'))
+        self.check('ws snapshot (full)', lambda: self.snapshot(room, list_delta=False))
+        self.check('ws snapshot (delta)', lambda: self.snapshot(room, list_delta=True))
+
+        self.check('POST create', lambda: self.call(
+            'post', f'{base}create/', {'band_name': '追加バンド', 'minutes': 10, **member_ids}
+        ))
+        self.check('POST start', lambda: self.call('post', f'{base}timer-state/start/'))
+        self.check('GET timer-state (running)', lambda: self.call('get', f'{base}timer-state/'))
+        self.check('GET schedule (running)', lambda: self.call('get', f'{base}schedule/'))
+        # 追加した分を含め、最後のタイマーまでスキップ（最後は終了状態の配信）
+        self.check(f'POST skip x{size + 1}', lambda: [
+            self.call('post', f'{base}timer-state/skip/') for _ in range(size + 1)
+        ])
+
+        with transaction.atomic():
+            archive.archive_room(room.id)
+        self.check('GET events', lambda: self.call('get', f'{base}events/', {'limit': 1000}))
+        self.check('GET archives', lambda: self.call('get', f'{base}archives/'))
+        self.check('GET analytics (band)', lambda: self.call('get', f'{base}analytics/', {'group': 'band'}))
+        self.check('GET analytics (member)', lambda: self.call('get', f'{base}analytics/', {'group': 'member'}))
+
+        timers = list(Timer.objects.with_members().filter(room=room))
+        self.check('broadcast timer-state', lambda: broadcast_timer_state(room.id))
+        self.check('broadcast timer-list', lambda: broadcast_timer_list(room.id))
+        self.check('broadcast timer-changes', lambda: broadcast_timer_changes(room.id, upserted=timers))
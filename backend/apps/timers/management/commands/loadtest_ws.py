@@ -0,0 +1,320 @@
+"""
+WebSocket負荷試験（1プロセスで何台の表示端末に配信できるかの目安を測る）
+
+backend.asgi:application をこのプロセス内で起動し（channels の WebsocketCommunicator。
+ネットワーク・Daphneは経由しない）、N台分の /ws/timer/<room>/ クライアントを同時に接続する。
+REST のビュー（開始・一時停止・再開・スキップ）を順に呼び、各操作の状態配信が全クライアントに
+届くまでの時間を計測する。
+
+計測項目:
+  - 接続レイテンシ（接続開始〜connection_established 受信）の p50/p95/p99/最大
+  - 配信レイテンシ（操作の呼び出し開始〜各クライアントが状態遷移のフレームを受信）の
+    操作ごと・全体の p50/p95/p99/最大
+  - CPU時間（接続処理の1接続あたり、配信1回の1接続あたり）
+  - メモリ（接続前後のRSSの差の1接続あたり）
+CPU・メモリには同じプロセス内で動くクライアント側の処理も含まれる（実際のサーバーより多めに出る）。
+
+専用のルーム（loadtest-xxxx）と担当者を作成し、終了時に削除する（--keep-room で残す）。
+チャネルレイヤーは既定でインメモリ（--layer redis で設定どおりのRedis）。状態キャッシュ・
+イベントログにRedisを使うため、REDIS_URL のRedisは必要（ローカルのRedisでよい）。
+
+    python manage.py loadtest_ws --clients 1000
+    python manage.py loadtest_ws --clients 500 --protocol msgpack --list delta --clock sync
+    python manage.py loadtest_ws --clients 200 --tick --layer redis
+"""
+import asyncio
+import os
+import resource
+import re
+import time
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from django.urls import resolve
+from channels.db import database_sync_to_async
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from msgpack import Unpacker
+from apps.members.models import Member
+from apps.timers import msgpack_protocol
+from apps.timers.models import Room, Timer, TimerState
+from apps.timers.ordering import ORDER_STEP
+from apps.timers.redis_client import get_redis, redis_key
+from apps.timers.send_queue import counters_key
+from apps.timers.state_cache import state_cache_key
+from apps.timers.utils import list_version_key, event_seq_key, event_stream_key
+
+# 各操作で状態遷移の配信が発生する順序（開始 → 一時停止 → 再開 → スキップ）
+ACTIONS = ('start', 'pause', 'resume', 'skip')
+
+# JSONフレームの先頭（payloads.frame_parts の形式）
+JSON_FRAME_HEAD = re.compile(r'^\{"type":"(\w+)"(?:,"seq":(null|\d+))?')
+
+
+def percentiles(values):
+    """(p50, p95, p99, 最大)（ミリ秒）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def at(percent):
+        return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))] * 1000
+
+    return at(50), at(95), at(99), ordered[-1] * 1000
+
+
+def rss_kb():
+    """現在のRSS（KB）。/proc がない環境ではピーク値"""
+    try:
+        with open(f'/proc/{os.getpid()}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Viewer:
+    """1台分の表示端末（受信したフレームの種類・seq・受信時刻を記録）"""
+
+    def __init__(self, application, path, binary):
+        self.binary = binary
+        self.communicator = WebsocketCommunicator(
+            application, path, subprotocols=[msgpack_protocol.PROTOCOL] if binary else None
+        )
+        self.received = []
+        self.connect_latency = None
+        self.reader = None
+
+    def parse(self, message):
+        """フレームの (type, seq)。全体はデコードしない"""
+        if self.binary:
+            unpacker = Unpacker(raw=False)
+            unpacker.feed(message['bytes'])
+            fields = {}
+            for _ in range(min(unpacker.read_map_header(), 2)):
+                key = unpacker.unpack()
+                fields[key] = unpacker.unpack()
+            return fields.get('t'), fields.get('s')
+
+        match = JSON_FRAME_HEAD.match(message['text'])
+        if match is None:
+            return None, None
+        seq = match.group(2)
+        return match.group(1), int(seq) if seq and seq != 'null' else None
+
+    async def connect(self, timeout):
+        started = time.perf_counter()
+        connected, _ = await self.communicator.connect(timeout)
+        if not connected:
+            raise ConnectionError('接続が拒否されました')
+        while True:
+            message_type, _ = self.parse(await self.communicator.receive_output(timeout))
+            if message_type == 'connection_established':
+                break
+        self.connect_latency = time.perf_counter() - started
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        while True:
+            message = await self.communicator.receive_output(timeout=None)
+            if message['type'] != 'websocket.send':
+                return
+            message_type, seq = self.parse(message)
+            self.received.append((time.perf_counter(), message_type, seq))
+
+    def transition_latency(self, started):
+        """started 以降に最初に受信した状態遷移（seq付きの状態配信）までの時間"""
+        for received_at, message_type, seq in self.received:
+            if received_at >= started and message_type == 'timer_state_updated' and seq is not None:
+                return received_at - started
+        return None
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        try:
+            await self.communicator.disconnect()
+        except (Exception, asyncio.CancelledError):
+            # 接続に失敗してアプリケーションが終了済み
+            pass
+
+
+class Command(BaseCommand):
+    help = 'WebSocketの負荷試験（N台のクライアントを接続し、接続・配信のレイテンシとCPU・メモリを計測）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='同時接続数')
+        parser.add_argument('--rounds', type=int, default=3, help='開始→一時停止→再開→スキップの繰り返し回数')
+        parser.add_argument('--layer', choices=['memory', 'redis'], default='memory',
+                            help='チャネルレイヤー（memory: インメモリ / redis: 設定どおり）')
+        parser.add_argument('--protocol', choices=['json', 'msgpack'], default='json', help='WebSocketのプロトコル')
+        parser.add_argument('--list', choices=['full', 'delta'], default='full', help='リストの受信方式')
+        parser.add_argument('--clock', choices=['tick', 'sync'], default='tick', help='1秒ごとの状態配信の受信方式')
+        parser.add_argument('--tick', action='store_true', help='試験中に1秒ごとのtick（状態配信）も実行する')
+        parser.add_argument('--concurrency', type=int, default=100, help='同時に接続処理を行う数')
+        parser.add_argument('--interval', type=float, default=0.5, help='操作の間隔（秒）')
+        parser.add_argument('--timeout', type=float, default=10.0, help='接続・配信待ちのタイムアウト（秒）')
+        parser.add_argument('--keep-room', action='store_true', help='試験用のルームを削除しない')
+
+    def handle(self, *args, **options):
+        if options['layer'] == 'memory':
+            # インメモリのチャネルレイヤー（このプロセス内のクライアントだけに配信）
+            settings.CHANNEL_LAYERS = {'default': {
+                'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                'CONFIG': {'capacity': 1000},
+            }}
+            channel_layers.backends.clear()
+
+        try:
+            get_redis().ping()
+        except Exception as e:
+            raise CommandError(f'Redis（{settings.REDIS_URL}）に接続できません: {e}')
+
+        room, members = self.create_room(options['rounds'] + 1)
+        self.stdout.write(f'試験用ルーム: {room.slug}（クライアント {options["clients"]}台, '
+                          f'{options["protocol"]}, list={options["list"]}, clock={options["clock"]}, '
+                          f'layer={options["layer"]}）')
+        try:
+            asyncio.run(self.run(room, options))
+        finally:
+            if options['keep_room']:
+                self.stdout.write(f'ルームを残しました: {room.slug}')
+            else:
+                self.delete_room(room, members)
+
+    def create_room(self, timer_count):
+        """試験用のルーム・担当者・タイマーを作成（LINE通知は無効）"""
+        suffix = uuid.uuid4().hex[:8]
+        with transaction.atomic():
+            room = Room.objects.create(slug=f'loadtest-{suffix}', name=f'負荷試験 {suffix}')
+            TimerState.objects.create(room=room, line_notifications_enabled=False)
+            members = [Member.objects.create(name=f'lt-{suffix}-{index}') for index in range(1, 4)]
+            Timer.objects.bulk_create([
+                Timer(
+                    room=room, band_name=f'負荷試験バンド{order}', minutes=15, order=order * ORDER_STEP,
+                    member1=members[0], member2=members[1], member3=members[2],
+                )
+                for order in range(1, timer_count + 1)
+            ])
+        TimerState.refresh_next_timer(room.id)
+        return room, members
+
+    def delete_room(self, room, members):
+        """試験用のデータとRedisのキーを削除"""
+        room_id = room.id
+        room.delete()
+        Member.objects.filter(id__in=[member.id for member in members]).delete()
+        client = get_redis()
+        client.delete(
+            state_cache_key(room_id), list_version_key(room_id), event_seq_key(room_id),
+            event_stream_key(room_id), counters_key(room_id),
+            *client.keys(redis_key('payload', '*', room_id)),
+        )
+
+    def call_view(self, path):
+        """RESTのビューをHTTPを経由せずに呼ぶ"""
+        match = resolve(path)
+        response = match.func(RequestFactory().post(path, content_type='application/json'),
+                              *match.args, **match.kwargs)
+        if response.status_code >= 400:
+            raise CommandError(f'{path}: {response.status_code} {getattr(response, "data", "")}')
+
+    async def run(self, room, options):
+        from backend.asgi import application
+
+        query = f'?list={options["list"]}&clock={options["clock"]}'
+        binary = options['protocol'] == 'msgpack'
+        viewers = [
+            Viewer(application, f'/ws/timer/{room.slug}/{query}', binary)
+            for _ in range(options['clients'])
+        ]
+
+        # 接続
+        rss_before = rss_kb()
+        cpu_before = cpu_seconds()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def connect(viewer):
+            async with semaphore:
+                try:
+                    await viewer.connect(options['timeout'])
+                except Exception as e:
+                    return e
+
+        started = time.perf_counter()
+        errors = [error for error in await asyncio.gather(*[connect(viewer) for viewer in viewers]) if error]
+        connect_seconds = time.perf_counter() - started
+        connect_cpu = cpu_seconds() - cpu_before
+        rss_after = rss_kb()
+        connected = [viewer for viewer in viewers if viewer.connect_latency is not None]
+
+        self.stdout.write(f'\n接続: {len(connected)}/{len(viewers)}台 ({connect_seconds:.2f}秒, 失敗 {len(errors)}件)')
+        if errors:
+            self.stdout.write(f'  最初の失敗: {errors[0]!r}')
+        self.write_percentiles('  接続レイテンシ', [viewer.connect_latency for viewer in connected])
+        if connected:
+            self.stdout.write(f'  CPU: {connect_cpu * 1000 / len(connected):.3f} ms/接続, '
+                              f'メモリ: {(rss_after - rss_before) / len(connected):.1f} KB/接続 '
+                              f'(RSS {rss_before / 1024:.1f} → {rss_after / 1024:.1f} MB)')
+
+        ticker = asyncio.create_task(self.tick(room.id)) if options['tick'] else None
+
+        # 操作ごとの配信レイテンシ
+        self.stdout.write('\n配信レイテンシ（操作の呼び出し開始〜状態遷移のフレーム受信）')
+        all_latencies = []
+        broadcasts = 0
+        cpu_before = cpu_seconds()
+        for action in ACTIONS * options['rounds']:
+            started = time.perf_counter()
+            await database_sync_to_async(self.call_view)(f'/api/rooms/{room.slug}/timers/timer-state/{action}/')
+            latencies = await self.wait_for_transition(connected, started, options['timeout'])
+            broadcasts += 1
+            all_latencies.extend(latencies)
+            self.write_percentiles(f'  {action:<7} {len(latencies):>6}/{len(connected)}台', latencies)
+            await asyncio.sleep(options['interval'])
+        broadcast_cpu = cpu_seconds() - cpu_before
+
+        if ticker is not None:
+            ticker.cancel()
+
+        self.write_percentiles('  全体', all_latencies)
+        if connected:
+            frames = sum(len(viewer.received) for viewer in connected)
+            self.stdout.write(f'  CPU: {broadcast_cpu * 1000 / broadcasts / len(connected):.3f} ms/配信/接続, '
+                              f'受信フレーム {frames}件')
+
+        await asyncio.gather(*[viewer.close() for viewer in viewers])
+
+    async def wait_for_transition(self, viewers, started, timeout):
+        """全クライアントが状態遷移のフレームを受信するまで待ち、各クライアントのレイテンシを返す"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            latencies = [viewer.transition_latency(started) for viewer in viewers]
+            if all(latency is not None for latency in latencies) or time.perf_counter() > deadline:
+                return [latency for latency in latencies if latency is not None]
+            await asyncio.sleep(0.005)
+
+    async def tick(self, room_id):
+        """1秒ごとのtick（tick.run_tick）"""
+        from apps.timers.tick import run_tick
+
+        while True:
+            await database_sync_to_async(run_tick)(room_id)
+            await asyncio.sleep(1)
+
+    def write_percentiles(self, label, values):
+        result = percentiles(values)
+        if result is None:
+            self.stdout.write(f'{label}: 計測値なし')
+            return
+        p50, p95, p99, maximum = result
+        self.stdout.write(f'{label}: p50 {p50:.1f} / p95 {p95:.1f} / p99 {p99:.1f} / 最大 {maximum:.1f} ms')
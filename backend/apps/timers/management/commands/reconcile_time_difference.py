@@ -0,0 +1,57 @@
+"""
+押し巻き合計（TimerState.completed_time_difference）を完了済みタイマーから集計し直す
+
+完了・スキップ時に加算している値が、管理画面での直接編集などでずれた場合に使う。
+
+    python manage.py reconcile_time_difference                 # 既定のルームを確認して修正
+    python manage.py reconcile_time_difference --room stage-b  # ルームを指定
+    python manage.py reconcile_time_difference --check         # 確認のみ（ずれていれば終了コード1）
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from apps.timers import transitions
+from apps.timers.models import Room, TimerState, DEFAULT_ROOM_SLUG
+from apps.timers.utils import broadcast_timer_state
+
+
+class Command(BaseCommand):
+    help = '押し巻き合計を完了済みタイマーから集計し直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--room',
+            default=DEFAULT_ROOM_SLUG,
+            help='対象のルームID（スラッグ）',
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='修正せず、ずれがあれば終了コード1で終了する',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            room = Room.objects.get(slug=options['room'])
+        except Room.DoesNotExist:
+            raise CommandError(f'ルームが見つかりません: {options["room"]}')
+
+        with transaction.atomic():
+            timer_state = TimerState.objects.select_for_update().get_or_create(room=room)[0]
+            stored = timer_state.completed_time_difference
+            actual = timer_state.aggregate_completed_time_difference()
+
+            if stored == actual:
+                self.stdout.write(self.style.SUCCESS(f'押し巻き合計は正しい値です: {actual}秒'))
+                return
+
+            if options['check']:
+                raise CommandError(f'押し巻き合計がずれています: 保存値 {stored}秒 / 集計値 {actual}秒')
+
+            # 他の書き込みと同じく version を進めてイベントに記録する
+            try:
+                timer_state = transitions.set_fields(room.id, {'completed_time_difference': actual})[0]
+            except transitions.TransitionConflict as e:
+                raise CommandError(str(e))
+
+        broadcast_timer_state(room.id, timer_state=timer_state)
+        self.stdout.write(self.style.SUCCESS(f'押し巻き合計を修正しました: {stored}秒 → {actual}秒'))
@@ -0,0 +1,122 @@
+"""
+イベント（TimerEvent）から TimerState を再構築する（監査・障害時の復旧）
+
+直前のスナップショット以降のイベントだけを適用するため、読むイベントは
+TIMER_EVENT_SNAPSHOT_INTERVAL 件以下。
+
+    python manage.py replay_events                      # 最新の状態を再構築してDBの状態と比較
+    python manage.py replay_events --room stage-b       # ルームを指定
+    python manage.py replay_events --at-version 120     # version 120 時点の状態を表示
+    python manage.py replay_events --timeline           # イベントを古い順に表示（--after で続きから）
+    python manage.py replay_events --restore            # 再構築した状態をDBに書き戻して配信
+    python manage.py replay_events --snapshot           # 現在の状態のスナップショットを保存
+"""
+import json
+from django.core.management.base import BaseCommand, CommandError
+from apps.timers import journal, transitions
+from apps.timers.models import Room, TimerEvent, DEFAULT_ROOM_SLUG
+from apps.timers.state_cache import load_from_db
+from apps.timers.utils import broadcast_timer_state
+
+
+class Command(BaseCommand):
+    help = 'イベントから TimerState を再構築する'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--room',
+            default=DEFAULT_ROOM_SLUG,
+            help='対象のルームID（スラッグ）',
+        )
+        parser.add_argument(
+            '--at-version',
+            type=int,
+            help='この version 時点の状態を再構築する（省略時は最新）',
+        )
+        parser.add_argument(
+            '--timeline',
+            action='store_true',
+            help='イベントを古い順に表示する',
+        )
+        parser.add_argument(
+            '--after',
+            type=int,
+            default=0,
+            help='--timeline で、このイベントIDより後のイベントを表示する',
+        )
+        parser.add_argument(
+            '--restore',
+            action='store_true',
+            help='再構築した最新の状態をDBに書き戻す',
+        )
+        parser.add_argument(
+            '--snapshot',
+            action='store_true',
+            help='現在の状態のスナップショットを保存する',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            room = Room.objects.get(slug=options['room'])
+        except Room.DoesNotExist:
+            raise CommandError(f'ルームが見つかりません: {options["room"]}')
+
+        if options['timeline']:
+            self._timeline(room, options['after'])
+            return
+
+        if options['snapshot']:
+            snapshot = journal.take_snapshot(room.id)
+            self.stdout.write(self.style.SUCCESS(f'スナップショットを保存しました (version {snapshot.version})'))
+            return
+
+        try:
+            rebuilt = journal.rebuild(room.id, version=options['at_version'])
+        except journal.JournalError as e:
+            raise CommandError(str(e))
+
+        if options['at_version'] is not None:
+            self.stdout.write(json.dumps(
+                {'version': rebuilt.version, **journal.encode_state(rebuilt)}, ensure_ascii=False, indent=2
+            ))
+            return
+
+        current = load_from_db(room.id)
+        replayed, stored = journal.encode_state(rebuilt), journal.encode_state(current)
+        differences = {
+            name: (value, stored[name]) for name, value in replayed.items() if value != stored[name]
+        }
+        if rebuilt.version != current.version:
+            differences['version'] = (rebuilt.version, current.version)
+
+        if not differences:
+            self.stdout.write(self.style.SUCCESS(f'イベントから再構築した状態はDBの状態と一致します (version {current.version})'))
+            return
+
+        for name, (replayed_value, stored_value) in differences.items():
+            self.stdout.write(f'  {name}: イベント {replayed_value!r} / DB {stored_value!r}')
+
+        if not options['restore']:
+            raise CommandError(f'イベントから再構築した状態がDBの状態と異なります ({len(differences)}項目)')
+
+        # 再構築した version には戻さず、他の書き込みと同じく version を進めてイベントに記録する
+        try:
+            restored = transitions.set_fields(room.id, journal.decode_state(replayed))[0]
+        except transitions.TransitionConflict as e:
+            raise CommandError(str(e))
+
+        broadcast_timer_state(room.id, timer_state=restored)
+        self.stdout.write(self.style.SUCCESS(f'イベントから再構築した状態を書き戻しました (version {restored.version})'))
+
+    def _timeline(self, room, after):
+        events = TimerEvent.objects.filter(room=room, id__gt=after).order_by('id')
+        count = 0
+        for event in events.iterator(chunk_size=500):
+            count += 1
+            version = f'v{event.version}' if event.version is not None else '-'
+            detail = json.dumps({**event.data, **event.changes}, ensure_ascii=False)
+            self.stdout.write(
+                f'{event.id:>8} {event.created_at:%Y-%m-%d %H:%M:%S} {version:>7} '
+                f'{event.kind:<9} timer={event.timer_id or "-"} {detail}'
+            )
+        self.stdout.write(f'{count}件')
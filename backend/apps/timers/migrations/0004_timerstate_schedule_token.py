@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timers', '0003_add_line_notifications_enabled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timerstate',
+            name='schedule_token',
+            field=models.CharField(blank=True, default='', max_length=36, verbose_name='完了タスク予約トークン'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def populate_completed_time_difference(apps, schema_editor):
+    """既存の完了済みタイマーから押し巻き合計を集計"""
+    Timer = apps.get_model('timers', 'Timer')
+    TimerState = apps.get_model('timers', 'TimerState')
+
+    total = Timer.objects.filter(actual_seconds__isnull=False).aggregate(
+        total=Sum(F('actual_seconds') - F('minutes') * 60)
+    )['total'] or 0
+    TimerState.objects.filter(pk=1).update(completed_time_difference=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timers', '0004_timerstate_schedule_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timerstate',
+            name='completed_time_difference',
+            field=models.IntegerField(default=0, verbose_name='完了済みタイマーの押し巻き合計（秒）'),
+        ),
+        migrations.RunPython(populate_completed_time_difference, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_next_timer(apps, schema_editor):
+    """現在のタイマーの次の未完了タイマーを設定"""
+    Timer = apps.get_model('timers', 'Timer')
+    TimerState = apps.get_model('timers', 'TimerState')
+
+    timer_state = TimerState.objects.filter(pk=1).select_related('current_timer').first()
+    if not timer_state or not timer_state.current_timer:
+        return
+
+    timer_state.next_timer = Timer.objects.filter(
+        completed_at__isnull=True,
+        order__gt=timer_state.current_timer.order
+    ).order_by('order').first()
+    timer_state.save(update_fields=['next_timer'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timers', '0005_timerstate_completed_time_difference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timerstate',
+            name='next_timer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='timers.timer', verbose_name='次のタイマー'),
+        ),
+        migrations.RunPython(populate_next_timer, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:00
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_default_room(apps, schema_editor):
+    """既存のタイマー・状態を所属させる既定のルームを作成"""
+    Room = apps.get_model('timers', 'Room')
+    Room.objects.get_or_create(id=1, defaults={'slug': 'default', 'name': 'デフォルト'})
+
+    # IDを指定して作成したため、シーケンスを進めておく（PostgreSQL）
+    for sql in schema_editor.connection.ops.sequence_reset_sql(no_style(), [Room]):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timers', '0006_timerstate_next_timer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Room',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(unique=True, verbose_name='ルームID')),
+                ('name', models.CharField(max_length=100, verbose_name='ルーム名')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+            ],
+            options={
+                'verbose_name': 'ルーム',
+                'verbose_name_plural': 'ルーム',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(create_default_room, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='timer',
+            name='room',
+            field=models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='timers', to='timers.room', verbose_name='ルーム'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='timerstate',
+            name='room',
+            field=models.OneToOneField(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='timer_state', to='timers.room', verbose_name='ルーム'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.20 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+# apps.timers.ordering.ORDER_STEP（マイグレーション時点の値）
+ORDER_STEP = 1024
+
+
+def respace_orders(apps, schema_editor, step=ORDER_STEP):
+    """ルームごとに既存のタイマーのorderを並び順のまま step 間隔に振り直す"""
+    Timer = apps.get_model('timers', 'Timer')
+    timers = list(Timer.objects.order_by('room_id', 'order', 'id').only('id', 'room_id', 'order'))
+    room_id, position = None, 0
+    for timer in timers:
+        if timer.room_id != room_id:
+            room_id, position = timer.room_id, 0
+        position += 1
+        timer.order = position * step
+    Timer.objects.bulk_update(timers, ['order'], batch_size=1000)
+
+
+def compact_orders(apps, schema_editor):
+    """連番（1, 2, 3, ...）に戻す"""
+    respace_orders(apps, schema_editor, step=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timers', '0007_room'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='timer',
+            index=models.Index(fields=['room', 'order'], name='timers_time_room_id_order_idx'),
+        ),
+        migrations.RunPython(respace_orders, compact_orders),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timers', '0008_sparse_timer_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timerstate',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='バージョン'),
+        ),
+    ]
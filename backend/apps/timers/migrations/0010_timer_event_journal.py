@@ -0,0 +1,80 @@
+# Generated by Django 4.2.20 on 2026-10-18 23:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from datetime import datetime
+
+
+def create_baseline_snapshots(apps, schema_editor):
+    """既存のルームの現在の状態をスナップショットにする（状態の再構築の起点。journal.encode_state と同じ形式）"""
+    TimerState = apps.get_model('timers', 'TimerState')
+    TimerStateSnapshot = apps.get_model('timers', 'TimerStateSnapshot')
+    fields = [
+        field for field in TimerState._meta.concrete_fields
+        if field.name not in ('id', 'room', 'version', 'updated_at')
+    ]
+    snapshots = []
+    for timer_state in TimerState.objects.all():
+        state = {}
+        for field in fields:
+            value = getattr(timer_state, field.attname)
+            state[field.attname] = value.isoformat() if isinstance(value, datetime) else value
+        snapshots.append(TimerStateSnapshot(room_id=timer_state.room_id, version=timer_state.version, state=state))
+    TimerStateSnapshot.objects.bulk_create(snapshots)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timers', '0009_timerstate_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimerStateSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(verbose_name='状態のバージョン')),
+                ('state', models.JSONField(verbose_name='状態')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='作成日時')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='state_snapshots', to='timers.room', verbose_name='ルーム')),
+            ],
+            options={
+                'verbose_name': '状態スナップショット',
+                'verbose_name_plural': '状態スナップショット',
+                'ordering': ['-version'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TimerEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('start', '開始'), ('pause', '一時停止'), ('resume', '再開'), ('skip', 'スキップ'), ('complete', '完了'), ('state', '状態の保存'), ('create', 'タイマー作成'), ('update', 'タイマー更新'), ('delete', 'タイマー削除'), ('reorder', '並べ替え'), ('move', '移動'), ('import', '一括登録'), ('reset', '全削除')], max_length=20, verbose_name='種類')),
+                ('timer_id', models.BigIntegerField(blank=True, null=True, verbose_name='タイマーID')),
+                ('version', models.PositiveIntegerField(blank=True, null=True, verbose_name='状態のバージョン')),
+                ('changes', models.JSONField(blank=True, default=dict, verbose_name='状態の変更')),
+                ('data', models.JSONField(blank=True, default=dict, verbose_name='詳細')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='日時')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timer_events', to='timers.room', verbose_name='ルーム')),
+            ],
+            options={
+                'verbose_name': 'タイマーイベント',
+                'verbose_name_plural': 'タイマーイベント',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timerstatesnapshot',
+            constraint=models.UniqueConstraint(fields=('room', 'version'), name='timers_snapshot_room_version_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='timerevent',
+            index=models.Index(fields=['room', 'created_at'], name='timers_event_room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timerevent',
+            index=models.Index(fields=['room', 'version'], name='timers_event_room_version_idx'),
+        ),
+        migrations.RunPython(create_baseline_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0001_initial'),
+        ('timers', '0010_timer_event_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timer',
+            name='paused_seconds',
+            field=models.IntegerField(blank=True, null=True, verbose_name='一時停止していた時間（秒）'),
+        ),
+        migrations.CreateModel(
+            name='RehearsalArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timer_count', models.IntegerField(verbose_name='タイマー数')),
+                ('total_time_difference', models.IntegerField(verbose_name='押し巻き合計（秒）')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='最後のタイマーの完了時刻')),
+                ('archived_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='アーカイブ日時')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archives', to='timers.room', verbose_name='ルーム')),
+            ],
+            options={
+                'verbose_name': 'リハーサル記録',
+                'verbose_name_plural': 'リハーサル記録',
+                'ordering': ['-archived_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTimer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='順番')),
+                ('band_name', models.CharField(db_index=True, max_length=50, verbose_name='バンド名')),
+                ('minutes', models.IntegerField(verbose_name='予定時間（分）')),
+                ('actual_seconds', models.IntegerField(verbose_name='実際にかかった時間（秒）')),
+                ('overrun_seconds', models.IntegerField(verbose_name='押し巻き（秒）')),
+                ('paused_seconds', models.IntegerField(blank=True, null=True, verbose_name='一時停止していた時間（秒）')),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timers', to='timers.rehearsalarchive', verbose_name='リハーサル記録')),
+                ('member1', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='members.member', verbose_name='担当者1')),
+                ('member2', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='members.member', verbose_name='担当者2')),
+                ('member3', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='members.member', verbose_name='担当者3')),
+            ],
+            options={
+                'verbose_name': 'アーカイブしたタイマー',
+                'verbose_name_plural': 'アーカイブしたタイマー',
+                'ordering': ['archive', 'position'],
+            },
+        ),
+    ]
@@ -1,11 +1,49 @@
 from django.db import models
+from django.utils import timezone
 from django.db.models import Sum, F
 from apps.members.models import Member
 
+# シリアライズ時に参照する担当者のリレーション
+MEMBER_RELATIONS = ('member1', 'member2', 'member3')
+
+# 既存のAPI・WebSocket（ルーム指定なし）が操作するルーム
+DEFAULT_ROOM_ID = 1
+DEFAULT_ROOM_SLUG = 'default'
+
+
+class Room(models.Model):
+    """ルーム（同時進行するステージ・リハーサルごとのタイムライン）"""
+
+    slug = models.SlugField('ルームID', max_length=50, unique=True)
+    name = models.CharField('ルーム名', max_length=100)
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'ルーム'
+        verbose_name_plural = 'ルーム'
+
+    def __str__(self):
+        return f'{self.name} ({self.slug})'
+
+
+class TimerQuerySet(models.QuerySet):
+    """タイマーのクエリセット"""
+
+    def with_members(self):
+        """担当者を結合して取得（TimerSerializerで行ごとにクエリが発行されないように）"""
+        return self.select_related(*MEMBER_RELATIONS)
+
 
 class Timer(models.Model):
     """タイマー（バンドごと）"""
 
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        related_name='timers',
+        verbose_name='ルーム'
+    )
     band_name = models.CharField('バンド名', max_length=50)
     minutes = models.IntegerField('予定時間（分）', default=15)
     member1 = models.ForeignKey(
@@ -26,13 +64,20 @@ class Timer(models.Model):
         on_delete=models.PROTECT,
         verbose_name='担当者3'
     )
-    order = models.IntegerField('実行順序')
+    order = models.IntegerField('実行順序')  # 大小のみ意味を持つ（間隔を空けて割り当てる。apps/timers/ordering.py）
     actual_seconds = models.IntegerField('実際にかかった時間（秒）', null=True, blank=True)
+    paused_seconds = models.IntegerField('一時停止していた時間（秒）', null=True, blank=True)
     completed_at = models.DateTimeField('完了時刻', null=True, blank=True)
     created_at = models.DateTimeField('作成日時', auto_now_add=True)
 
+    objects = TimerQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
+        indexes = [
+            # ルーム内の並び順（前後のタイマーの検索・移動）
+            models.Index(fields=['room', 'order'], name='timers_time_room_id_order_idx'),
+        ]
         verbose_name = 'タイマー'
         verbose_name_plural = 'タイマー'
 
@@ -66,8 +111,14 @@ class Timer(models.Model):
 
 
 class TimerState(models.Model):
-    """タイマー状態（Singleton）"""
+    """タイマー状態（ルームごとに1件）"""
 
+    room = models.OneToOneField(
+        Room,
+        on_delete=models.CASCADE,
+        related_name='timer_state',
+        verbose_name='ルーム'
+    )
     current_timer = models.ForeignKey(
         Timer,
         null=True,
@@ -75,6 +126,15 @@ class TimerState(models.Model):
         on_delete=models.SET_NULL,
         verbose_name='現在のタイマー'
     )
+    # 現在のタイマーの次の未完了タイマー（save() で更新。配信・通知のたびに検索しないため）
+    next_timer = models.ForeignKey(
+        Timer,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name='次のタイマー'
+    )
     started_at = models.DateTimeField('開始時刻', null=True, blank=True)
     paused_at = models.DateTimeField('一時停止時刻', null=True, blank=True)
     elapsed_seconds = models.IntegerField('経過時間（秒）', default=0)
@@ -82,6 +142,10 @@ class TimerState(models.Model):
     is_running = models.BooleanField('実行中', default=False)
     is_paused = models.BooleanField('一時停止中', default=False)
     line_notifications_enabled = models.BooleanField('LINE通知有効', default=True)
+    schedule_token = models.CharField('完了タスク予約トークン', max_length=36, blank=True, default='')
+    completed_time_difference = models.IntegerField('完了済みタイマーの押し巻き合計（秒）', default=0)
+    # 更新のたびに1ずつ進める（状態遷移は読んだ時点の version を条件に更新する。transitions.py）
+    version = models.PositiveIntegerField('バージョン', default=0)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
 
     class Meta:
@@ -95,9 +159,8 @@ class TimerState(models.Model):
 
     @property
     def total_time_difference(self):
-        """全体の押し巻き（秒）"""
-        completed_timers = Timer.objects.filter(actual_seconds__isnull=False)
-        return sum(timer.time_difference for timer in completed_timers)
+        """全体の押し巻き（秒）。完了時に加算済みの合計を返す（集計はしない）"""
+        return self.completed_time_difference
 
     @property
     def total_time_difference_display(self):
@@ -117,17 +180,217 @@ class TimerState(models.Model):
 
         return f'{sign}{minutes}:{seconds:02d} {status}'
 
+    def aggregate_completed_time_difference(self):
+        """完了済みタイマーから押し巻き合計を集計し直す（整合性チェック・再構築用）"""
+        return Timer.objects.filter(room_id=self.room_id, actual_seconds__isnull=False).aggregate(
+            total=Sum(F('actual_seconds') - F('minutes') * 60)
+        )['total'] or 0
+
+    def find_next_timer(self):
+        """現在のタイマーの次の未完了タイマーを検索"""
+        if not self.current_timer:
+            return None
+        return Timer.objects.with_members().filter(
+            room_id=self.room_id,
+            completed_at__isnull=True,
+            order__gt=self.current_timer.order
+        ).order_by('order').first()
+
     def save(self, *args, **kwargs):
-        """Singleton パターン: 1件のみ保存"""
-        self.pk = 1
+        """
+        保存してRedisキャッシュにも書き込む
+
+        保存のたびに次のタイマーを更新する（update_fields 指定時は next_timer を含む場合のみ）。
+        version も進めるため、同時に適用しようとした状態遷移は競合として読み直される。
+        保存したフィールドはイベントとして記録する（journal.py）。
+        """
+        from .state_cache import store
+        from .journal import record_state
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'next_timer' in update_fields:
+            self.next_timer = self.find_next_timer()
+        if not self._state.adding:
+            self.version = F('version') + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = [*update_fields, 'version']
         super().save(*args, **kwargs)
 
+        # F() で保存したフィールドはDBの値を読み直してからキャッシュに書き込む
+        expression_fields = [
+            field.attname for field in self._meta.concrete_fields
+            if hasattr(getattr(self, field.attname), 'resolve_expression')
+        ]
+        if expression_fields:
+            self.refresh_from_db(fields=expression_fields)
+
+        store(self)
+        record_state(self, update_fields)
+
     def delete(self, *args, **kwargs):
         """削除を禁止"""
         pass
 
     @classmethod
-    def load(cls):
-        """Singletonインスタンスを取得"""
-        obj, created = cls.objects.get_or_create(pk=1)
-        return obj
+    def refresh_next_timer(cls, room_id):
+        """タイマーリストの変更（並び替え・移動）後に次のタイマーを更新（更新後の状態を返す）"""
+        from .transitions import refresh_next
+
+        return refresh_next(room_id)
+
+    @classmethod
+    def load(cls, room_id):
+        """ルームのタイマー状態を取得（Redisキャッシュ経由、現在のタイマー・担当者込み）"""
+        from .state_cache import load
+
+        return load(room_id)
+
+    @classmethod
+    def invalidate_cache(cls, room_id):
+        """Timerの変更で現在のタイマーの内容が変わった場合にキャッシュを破棄"""
+        from .state_cache import invalidate
+
+        invalidate(room_id)
+
+
+class TimerEvent(models.Model):
+    """タイマーの操作・状態遷移の記録（追記のみ。apps/timers/journal.py）"""
+
+    KIND_CHOICES = [
+        ('start', '開始'),
+        ('pause', '一時停止'),
+        ('resume', '再開'),
+        ('skip', 'スキップ'),
+        ('complete', '完了'),
+        ('state', '状態の保存'),
+        ('create', 'タイマー作成'),
+        ('update', 'タイマー更新'),
+        ('delete', 'タイマー削除'),
+        ('reorder', '並べ替え'),
+        ('move', '移動'),
+        ('import', '一括登録'),
+        ('reset', '全削除'),
+    ]
+
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        related_name='timer_events',
+        verbose_name='ルーム'
+    )
+    kind = models.CharField('種類', max_length=20, choices=KIND_CHOICES)
+    # タイマーを削除しても記録を残すため外部キーにしない
+    timer_id = models.BigIntegerField('タイマーID', null=True, blank=True)
+    # 状態を変更したイベントのみ、変更後の TimerState.version（ルーム内で連番）
+    version = models.PositiveIntegerField('状態のバージョン', null=True, blank=True)
+    changes = models.JSONField('状態の変更', default=dict, blank=True)
+    data = models.JSONField('詳細', default=dict, blank=True)
+    created_at = models.DateTimeField('日時', default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['room', 'created_at'], name='timers_event_room_created_idx'),
+            # スナップショット以降のイベントの取得（状態の再構築）
+            models.Index(fields=['room', 'version'], name='timers_event_room_version_idx'),
+        ]
+        verbose_name = 'タイマーイベント'
+        verbose_name_plural = 'タイマーイベント'
+
+    def __str__(self):
+        return f'{self.get_kind_display()} ({self.created_at:%Y-%m-%d %H:%M:%S})'
+
+
+class TimerStateSnapshot(models.Model):
+    """ある version 時点の TimerState（状態の再構築はここから後のイベントだけを適用する）"""
+
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        related_name='state_snapshots',
+        verbose_name='ルーム'
+    )
+    version = models.PositiveIntegerField('状態のバージョン')
+    state = models.JSONField('状態')
+    created_at = models.DateTimeField('作成日時', default=timezone.now)
+
+    class Meta:
+        ordering = ['-version']
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'version'], name='timers_snapshot_room_version_uniq'),
+        ]
+        verbose_name = '状態スナップショット'
+        verbose_name_plural = '状態スナップショット'
+
+    def __str__(self):
+        return f'{self.room} (version {self.version})'
+
+
+class RehearsalArchive(models.Model):
+    """終了したリハーサルの記録（全削除の前に保存。apps/timers/archive.py）"""
+
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        related_name='archives',
+        verbose_name='ルーム'
+    )
+    timer_count = models.IntegerField('タイマー数')
+    total_time_difference = models.IntegerField('押し巻き合計（秒）')
+    finished_at = models.DateTimeField('最後のタイマーの完了時刻', null=True, blank=True)
+    archived_at = models.DateTimeField('アーカイブ日時', default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['-archived_at']
+        verbose_name = 'リハーサル記録'
+        verbose_name_plural = 'リハーサル記録'
+
+    def __str__(self):
+        return f'{self.room} ({self.archived_at:%Y-%m-%d %H:%M})'
+
+
+class ArchivedTimer(models.Model):
+    """アーカイブしたタイマー（集計に使う列だけを持つ）"""
+
+    archive = models.ForeignKey(
+        RehearsalArchive,
+        on_delete=models.CASCADE,
+        related_name='timers',
+        verbose_name='リハーサル記録'
+    )
+    position = models.PositiveIntegerField('順番')
+    band_name = models.CharField('バンド名', max_length=50, db_index=True)
+    minutes = models.IntegerField('予定時間（分）')
+    actual_seconds = models.IntegerField('実際にかかった時間（秒）')
+    # 押し巻き（actual_seconds - minutes * 60）。集計のたびに計算しないよう保存時に求める
+    overrun_seconds = models.IntegerField('押し巻き（秒）')
+    paused_seconds = models.IntegerField('一時停止していた時間（秒）', null=True, blank=True)
+    member1 = models.ForeignKey(
+        Member,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name='担当者1'
+    )
+    member2 = models.ForeignKey(
+        Member,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name='担当者2'
+    )
+    member3 = models.ForeignKey(
+        Member,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name='担当者3'
+    )
+
+    class Meta:
+        ordering = ['archive', 'position']
+        verbose_name = 'アーカイブしたタイマー'
+        verbose_name_plural = 'アーカイブしたタイマー'
+
+    def __str__(self):
+        return f'{self.band_name} ({self.overrun_seconds:+d}秒)'
@@ -0,0 +1,132 @@
+"""
+MessagePack サブプロトコル（kanritimer.msgpack.v1）
+
+WebSocketのハンドシェイクで Sec-WebSocket-Protocol: kanritimer.msgpack.v1 を指定した
+クライアントには、JSONのテキストフレームの代わりに MessagePack のバイナリフレームを送る。
+指定しないクライアント（既存のフロントエンド）には従来どおりJSONを送る。
+
+コンパクトなフィールドスキーマ（JSONのデータから変換する）:
+  - キーは短縮名にする（KEY_MAP。表にないキーはそのまま）
+  - 担当者（member1〜3）は {"id", "name"} の代わりに [id, name]
+  - 他のフィールドから作れる表示用の値（members, time_difference_display,
+    total_time_difference_display）は送らない
+  - 日時（ISO 8601 文字列）はUNIXエポックからのミリ秒（整数）
+フレームは {"t": type, "s": seq, "v": version, "d": data} のマップ（version は差分のみ）。
+
+クライアントからのメッセージ（ping, resync）はJSONと同じキーのマップをバイナリで送る
+（テキストフレームのJSONも受け付ける）。
+"""
+from django.utils.dateparse import parse_datetime
+from msgpack import packb, unpackb
+
+PROTOCOL = 'kanritimer.msgpack.v1'
+
+KEY_MAP = {
+    # フレーム
+    'type': 't',
+    'seq': 's',
+    'version': 'v',
+    'data': 'd',
+    # タイマー
+    'id': 'i',
+    'band_name': 'b',
+    'minutes': 'mi',
+    'member1': 'm1',
+    'member2': 'm2',
+    'member3': 'm3',
+    'order': 'o',
+    'actual_seconds': 'as',
+    'time_difference': 'td',
+    'completed_at': 'ca',
+    'is_completed': 'c',
+    'created_at': 'cr',
+    # タイマー状態
+    'current_timer': 'ct',
+    'next_timer': 'nt',
+    'started_at': 'sa',
+    'paused_at': 'pa',
+    'elapsed_seconds': 'es',
+    'remaining_seconds': 'rs',
+    'is_running': 'r',
+    'is_paused': 'p',
+    'line_notifications_enabled': 'ln',
+    'total_time_difference': 'ttd',
+    'deadline': 'dl',
+    'planned_end': 'pe',
+    'projected_end': 'xe',
+    'next_timer_projected_start': 'ns',
+    'server_time': 'st',
+    'updated_at': 'ua',
+}
+
+MEMBER_KEYS = {'member1', 'member2', 'member3'}
+
+DATETIME_KEYS = {
+    'completed_at', 'created_at', 'started_at', 'paused_at', 'deadline',
+    'planned_end', 'projected_end', 'next_timer_projected_start', 'server_time', 'updated_at',
+}
+
+DROPPED_KEYS = {'members', 'time_difference_display', 'total_time_difference_display'}
+
+
+def _epoch_ms(value):
+    """ISO 8601 文字列 → エポックミリ秒（解釈できなければそのまま）"""
+    parsed = parse_datetime(value)
+    if parsed is None or parsed.tzinfo is None:
+        return value
+    return int(parsed.timestamp() * 1000)
+
+
+def _compact_field(key, value):
+    if key in MEMBER_KEYS and isinstance(value, dict):
+        return [value['id'], value['name']]
+    if key in DATETIME_KEYS and isinstance(value, str):
+        return _epoch_ms(value)
+    return compact(value)
+
+
+def compact(value):
+    """JSONのデータをコンパクトなスキーマに変換"""
+    if isinstance(value, dict):
+        return {
+            KEY_MAP.get(key, key): _compact_field(key, item)
+            for key, item in value.items() if key not in DROPPED_KEYS
+        }
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    return value
+
+
+def encode_frame(message_type, data, seq=None, **fields):
+    """data（JSONのデータ）を d にしたバイナリフレームを作る"""
+    # {"t", "s", その他のフィールド, "d"} の固定長マップ（15要素まで）
+    return b''.join([
+        bytes([0x80 | (3 + len(fields))]),
+        packb('t'), packb(message_type),
+        packb('s'), packb(seq),
+        *(packb(KEY_MAP.get(name, name)) + packb(value) for name, value in fields.items()),
+        packb('d'), packb(compact(data)),
+    ])
+
+
+def encode_message(message):
+    """制御メッセージ（connection_established, pong など）をエンコード"""
+    return packb(compact(message))
+
+
+def from_json_frame(frame):
+    """JSONのテキストフレームをバイナリフレームに変換（イベントログからの再送用）"""
+    from .json_codec import loads
+
+    message = loads(frame)
+    return encode_frame(message.pop('type'), message.pop('data'), message.pop('seq'), **message)
+
+
+def decode_message(data):
+    """
+    クライアントからのバイナリメッセージをデコード
+
+    Raises:
+        ValueError: MessagePackとして解釈できない場合
+    """
+    return unpackb(data, raw=False)
@@ -0,0 +1,169 @@
+"""
+タイマーの実行順序（order）の割り当て
+
+order は間隔（ORDER_STEP）を空けた整数で、値の大小だけが意味を持つ（連番ではない）。
+- 作成: 最後尾の order + ORDER_STEP
+- 移動（order_between）: 前後のタイマーの order の中間値を割り当て、移動したタイマーの1行だけを更新
+- 削除: 後ろのタイマーの order は詰めない
+- 並べ替え（assign_orders）: order を変える必要のあるタイマーだけを1つのUPDATE文（CASE式）で更新
+前後の order の間に空きがない場合だけ、ルームのタイマー全体を ORDER_STEP 間隔に振り直す。
+"""
+from bisect import bisect_left
+from django.db import models
+from django.db.models import Case, Value, When
+from .models import Timer
+
+# 隣り合うタイマーの order の間隔
+ORDER_STEP = 1024
+
+
+def next_order(room_id):
+    """最後尾に追加するタイマーの order"""
+    max_order = Timer.objects.filter(room_id=room_id).aggregate(models.Max('order'))['order__max'] or 0
+    return max_order + ORDER_STEP
+
+
+def update_orders(orders):
+    """
+    複数のタイマーの order を1つのUPDATE文で更新
+
+    Args:
+        orders: {タイマーID: 新しいorder} の辞書
+    """
+    if not orders:
+        return
+    Timer.objects.filter(id__in=orders).update(order=Case(
+        *[When(id=timer_id, then=Value(order)) for timer_id, order in orders.items()],
+        output_field=models.IntegerField(),
+    ))
+
+
+def respaced_orders(timer_ids):
+    """並び順どおりに ORDER_STEP 間隔で振り直した {タイマーID: order}"""
+    return {timer_id: (index + 1) * ORDER_STEP for index, timer_id in enumerate(timer_ids)}
+
+
+def _kept_positions(orders):
+    """
+    order をそのまま残せる位置（orders の最長の狭義単調増加部分列の添字）
+
+    ここに含まれないタイマーだけが新しい order を必要とする。
+    """
+    tails, tail_positions, previous = [], [], [None] * len(orders)
+    for position, order in enumerate(orders):
+        index = bisect_left(tails, order)
+        if index == len(tails):
+            tails.append(order)
+            tail_positions.append(position)
+        else:
+            tails[index] = order
+            tail_positions[index] = position
+        previous[position] = tail_positions[index - 1] if index else None
+
+    kept = set()
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        kept.add(position)
+        position = previous[position]
+    return kept
+
+
+def assign_orders(current_orders, timer_ids):
+    """
+    timer_ids の順に並ぶよう、order を変える必要のあるタイマーの新しい order を求める
+
+    並び順が変わらないタイマーの order はそのまま残し、移動したタイマーには前後の
+    order の間の値を割り当てる。間に空きがなければ全体を振り直す。
+
+    Args:
+        current_orders: {タイマーID: 現在のorder} の辞書
+        timer_ids: 新しい並び順のタイマーIDのリスト
+
+    Returns:
+        dict: {タイマーID: 新しいorder}（変更のあるタイマーのみ）
+    """
+    orders = [current_orders[timer_id] for timer_id in timer_ids]
+    kept = _kept_positions(orders)
+
+    changes = {}
+    position = 0
+    while position < len(timer_ids):
+        if position in kept:
+            position += 1
+            continue
+
+        # 残すタイマーに挟まれた区間 [position, end) に order を割り当てる
+        end = position
+        while end < len(timer_ids) and end not in kept:
+            end += 1
+        lower = orders[position - 1] if position else 0
+        count = end - position
+        if end == len(timer_ids):
+            spacing = ORDER_STEP
+        else:
+            spacing = (orders[end] - lower) // (count + 1)
+            if spacing < 1:
+                # 空きがないため全体を振り直す
+                return {
+                    timer_id: order for timer_id, order in respaced_orders(timer_ids).items()
+                    if current_orders[timer_id] != order
+                }
+        for offset in range(count):
+            new_order = lower + spacing * (offset + 1)
+            orders[position + offset] = new_order
+            changes[timer_ids[position + offset]] = new_order
+        position = end
+
+    return changes
+
+
+def order_between(room_id, timer_id, after_id=None, before_id=None):
+    """
+    タイマーを after_id の直後・before_id の直前に移動するときの order
+
+    Args:
+        timer_id: 移動するタイマーのID
+        after_id: 直前に来るタイマーのID
+        before_id: 直後に来るタイマーのID
+            少なくとも一方を指定する（一方だけの場合、もう一方は現在の並びから求める）
+
+    Returns:
+        dict: {タイマーID: 新しいorder}（通常は移動するタイマーのみ。空きがない場合は振り直した全体）
+
+    Raises:
+        Timer.DoesNotExist: after_id・before_id のタイマーがルームにない場合
+        ValueError: どちらも指定されていない・after_id と before_id が隣り合っていない場合
+    """
+    if not after_id and not before_id:
+        raise ValueError('after_id または before_id を指定してください')
+
+    others = Timer.objects.filter(room_id=room_id).exclude(id=timer_id)
+    neighbors = {
+        neighbor_id: order
+        for neighbor_id, order in others.filter(id__in=[i for i in (after_id, before_id) if i]).values_list('id', 'order')
+    }
+    if any(i and i not in neighbors for i in (after_id, before_id)):
+        raise Timer.DoesNotExist
+    lower = neighbors[after_id] if after_id else None
+    upper = neighbors[before_id] if before_id else None
+
+    # 指定されなかった側の隣のタイマー
+    if after_id and not before_id:
+        upper = others.filter(order__gt=lower).order_by('order').values_list('order', flat=True).first()
+    elif before_id and not after_id:
+        lower = others.filter(order__lt=upper).order_by('-order').values_list('order', flat=True).first()
+    elif not (lower < upper and not others.filter(order__gt=lower, order__lt=upper).exists()):
+        raise ValueError('after_id と before_id が隣り合っていません')
+
+    if upper is None:
+        return {timer_id: (lower or 0) + ORDER_STEP}
+    lower = lower or 0
+    if upper - lower > 1:
+        return {timer_id: (lower + upper) // 2}
+
+    # 空きがないため、移動後の並びで全体を振り直す
+    timers = list(others.order_by('order', 'id').values_list('id', 'order'))
+    position = next(index for index, (_, order) in enumerate(timers) if order >= upper)
+    timer_ids = [other_id for other_id, _ in timers]
+    timer_ids.insert(position, timer_id)
+    return respaced_orders(timer_ids)
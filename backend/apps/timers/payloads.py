@@ -0,0 +1,204 @@
+"""
+シリアライズ済みペイロードのキャッシュ
+
+タイマーリストとタイマー状態のJSON（エンコード済みバイト列）をデータのバージョンごとに
+1回だけ作り、REST・WebSocket配信・WebSocket接続時の送信で共有する。
+
+- タイマーリスト: リストのバージョン（broadcast_timer_changes で進む）ごと
+- タイマー状態: 状態キャッシュのバージョン + リストのバージョン（+ 実行中・一時停止中は
+  残り時間等が変わるため秒単位の時刻）ごと。server_time はペイロードを作った時刻を表す
+- スケジュール予測: 状態・リストのバージョン（+ 予測が現在時刻に依存する間は秒単位の時刻）ごと
+
+キャッシュはルームごとに、Redis（プロセス間で共有）とプロセス内のコピーの2段。キーには
+状態キャッシュの世代（state_cache.py）も含めるため、Redisのキーが消えてバージョンが
+やり直しになっても、同じ番号の古いコピーを使うことはない。バージョンは
+シリアライズ前に読むため、途中で変更があっても古い内容が新しいキーで残ることはない。
+リストのバージョンは broadcast_timer_changes でしか進まないため、タイマーを変更する処理は
+必ず broadcast_timer_changes を呼ぶこと（管理画面からの直接編集は反映が次の変更まで遅れる）。
+
+WebSocketのフレームはペイロードを再エンコードせず連結して作る（frame_parts, encode_frame）。
+"""
+from django.conf import settings
+from django.utils import timezone
+from .models import Timer, TimerState
+from .serializers import TimerSerializer, TimerStateSerializer
+from .redis_client import get_redis, redis_key
+from .state_cache import state_cache_key, ensure_generation
+from .utils import list_version_key
+from .query_budget import query_budget
+from .json_codec import dumps, dumps_text, loads
+import logging
+
+logger = logging.getLogger(__name__)
+
+TIMER_LIST_PAYLOAD = 'timer-list'
+TIMER_STATE_PAYLOAD = 'timer-state'
+SCHEDULE_PAYLOAD = 'schedule'
+
+# プロセス内のコピー: (ペイロード名, ルームID) → Payload
+_local_payloads = {}
+
+
+class Payload:
+    """エンコード済みJSONと、そのデコード結果（必要になった時だけ作る）"""
+
+    def __init__(self, key, json_bytes):
+        self.key = key
+        self.json = json_bytes
+        self._data = None
+
+    @property
+    def text(self):
+        return self.json.decode()
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = loads(self.json)
+        return self._data
+
+
+def encode_payload(data):
+    """シリアライズ済みのデータをエンコードしてペイロードにする（キャッシュしない）"""
+    return Payload(None, dumps(data))
+
+
+def frame_parts(message_type, payload, **fields):
+    """
+    WebSocketフレームを seq の前後で分けて作る（payloadは再エンコードしない）
+
+    seq はイベントログへの追記時に決まるため、配信時は prefix + seq + suffix を
+    1回だけ連結し、全ソケットにその文字列をそのまま送る。
+
+    Returns:
+        tuple: (prefix, suffix)
+    """
+    prefix = f'{{"type":{dumps_text(message_type)},"seq":'
+    suffix = ''.join(f',{dumps_text(name)}:{dumps_text(value)}' for name, value in fields.items())
+    return prefix, f'{suffix},"data":{payload.text}}}'
+
+
+def encode_frame(message_type, payload, seq=None, **fields):
+    """payload を data にしたWebSocketフレームを作る（payloadは再エンコードしない）"""
+    prefix, suffix = frame_parts(message_type, payload, **fields)
+    return f'{prefix}{dumps_text(seq)}{suffix}'
+
+
+def _read_versions(room_id):
+    """
+    ルームの状態とリストのバージョンを1往復で取得
+
+    リストのバージョンは世代と組にする（状態に依存するペイロードのキーはリストの
+    バージョンも含むため、どちらのキーにも世代が入る。世代がなければ書いてから使う）。
+    """
+    client = get_redis()
+    pipeline = client.pipeline(transaction=False)
+    pipeline.hmget(state_cache_key(room_id), ['version', 'generation'])
+    pipeline.get(list_version_key(room_id))
+    (state_version, generation), list_version = pipeline.execute()
+    if generation is None:
+        generation = ensure_generation(client, room_id)
+    list_version = f'{generation.decode()}.{(list_version or b"0").decode()}'
+    return (state_version or b'0').decode(), list_version
+
+
+def _state_key(state_version, list_version, depends_on_now):
+    """状態に依存するペイロードのキー（現在時刻に依存する間は秒単位で変わる）"""
+    second = int(timezone.now().timestamp()) if depends_on_now else 0
+    return f'{state_version}:{list_version}:{second}'
+
+
+def _get_payload(name, room_id, key, build):
+    """キーが一致するキャッシュを返す。なければ build() で作ってキャッシュする"""
+    local = _local_payloads.get((name, room_id))
+    if local is not None and local.key == key:
+        return local
+
+    redis_name = redis_key('payload', name, room_id)
+    client = get_redis()
+    cached_key, cached_json = client.hmget(redis_name, ['key', 'json'])
+    if cached_key is not None and cached_key.decode() == key and cached_json is not None:
+        payload = Payload(key, cached_json)
+    else:
+        payload = Payload(key, dumps(build()))
+        client.hset(redis_name, mapping={'key': key, 'json': payload.json})
+        logger.debug(f'ペイロード作成: {name} ({key})')
+
+    _local_payloads[(name, room_id)] = payload
+    return payload
+
+
+def _build_timer_list(room_id):
+    timers = Timer.objects.with_members().filter(room_id=room_id).order_by('order')
+    return TimerSerializer(timers, many=True).data
+
+
+def _build_timer_state(room_id, timer_state=None):
+    return TimerStateSerializer(timer_state or TimerState.load(room_id)).data
+
+
+@query_budget(1, 'payload:timer-list')
+def get_timer_list_payload(room_id):
+    """ルームのタイマーリスト（TimerSerializer(many=True)）のペイロード"""
+    if not settings.TIMER_PAYLOAD_CACHE:
+        return Payload(None, dumps(_build_timer_list(room_id)))
+
+    try:
+        _, list_version = _read_versions(room_id)
+        return _get_payload(TIMER_LIST_PAYLOAD, room_id, list_version, lambda: _build_timer_list(room_id))
+    except Exception as e:
+        logger.warning(f'ペイロードキャッシュ利用不可（直接シリアライズ）: {e}')
+        return Payload(None, dumps(_build_timer_list(room_id)))
+
+
+# 状態（キャッシュなし時）・スケジュール予測
+@query_budget(2, 'payload:timer-state')
+def get_timer_state_payload(room_id, timer_state=None):
+    """
+    ルームのタイマー状態（TimerStateSerializer）のペイロード
+
+    Args:
+        room_id: ルームID
+        timer_state: 読み込み済みのTimerState（状態遷移が返した状態。省略時はキャッシュから取得）
+    """
+    # 状態のバージョンはライトスルーキャッシュが進めるため、無効なら毎回シリアライズする
+    if not (settings.TIMER_PAYLOAD_CACHE and settings.TIMER_STATE_CACHE):
+        return Payload(None, dumps(_build_timer_state(room_id, timer_state)))
+
+    try:
+        state_version, list_version = _read_versions(room_id)
+        # 実行中（一時停止中を含む）は残り時間・押し巻きが毎秒変わる
+        if timer_state is None:
+            timer_state = TimerState.load(room_id)
+        key = _state_key(state_version, list_version, timer_state.is_running)
+        return _get_payload(TIMER_STATE_PAYLOAD, room_id, key, lambda: TimerStateSerializer(timer_state).data)
+    except Exception as e:
+        logger.warning(f'ペイロードキャッシュ利用不可（直接シリアライズ）: {e}')
+        return Payload(None, dumps(_build_timer_state(room_id, timer_state)))
+
+
+# 状態（キャッシュなし時）・タイマー一覧
+@query_budget(2, 'payload:schedule')
+def get_schedule_payload(room_id, timer_state=None):
+    """
+    ルームのスケジュール予測（schedule.project_schedule）のペイロード
+
+    Args:
+        room_id: ルームID
+        timer_state: 読み込み済みのTimerState（省略時はキャッシュから取得）
+    """
+    from .schedule import project_schedule, depends_on_now
+
+    if timer_state is None:
+        timer_state = TimerState.load(room_id)
+
+    if not (settings.TIMER_PAYLOAD_CACHE and settings.TIMER_STATE_CACHE):
+        return Payload(None, dumps(project_schedule(timer_state)))
+
+    try:
+        state_version, list_version = _read_versions(room_id)
+        key = _state_key(state_version, list_version, depends_on_now(timer_state))
+        return _get_payload(SCHEDULE_PAYLOAD, room_id, key, lambda: project_schedule(timer_state))
+    except Exception as e:
+        logger.warning(f'ペイロードキャッシュ利用不可（直接計算）: {e}')
+        return Payload(None, dumps(project_schedule(timer_state)))
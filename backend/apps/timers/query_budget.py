@@ -0,0 +1,99 @@
+"""
+クエリ数の上限（クエリバジェット）
+
+読み取り経路（REST・WebSocket配信・接続時の送信）ごとに発行してよいSQLの数を宣言し、
+超えた場合に警告または例外にする。タイマーの件数に関係なく一定のクエリ数で
+済んでいること（N+1がないこと）を確認するためのもの。
+
+    @query_budget(1, 'timer-list')
+    def build():
+        ...
+
+    with query_budget(3, 'timer-state'):
+        ...
+
+動作は QUERY_BUDGET_MODE で切り替える:
+  - off:   何もしない（本番のデフォルト）
+  - warn:  超過をログに警告
+  - raise: QueryBudgetExceeded を送出（テスト・開発時）
+
+宣言した経路はタイマー1件・N件で raise モードで実行して確認する:
+
+    python manage.py check_query_budgets
+"""
+from contextlib import ContextDecorator
+from django.conf import settings
+from django.db import connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+MODES = ('off', 'warn', 'raise')
+
+
+class QueryBudgetExceeded(Exception):
+    """宣言したクエリ数を超えた"""
+
+    def __init__(self, label, budget, queries):
+        self.label = label
+        self.budget = budget
+        self.queries = queries
+        super().__init__(
+            f'クエリ数超過: {label} ({len(queries)}/{budget})\n' + '\n'.join(queries)
+        )
+
+
+class query_budget(ContextDecorator):
+    """
+    ブロック・関数内で発行されたSQLを数え、上限を超えたら警告または例外にする
+
+    Args:
+        max_queries: 許容するクエリ数
+        label: ログ・例外に表示する名前
+        mode: 'off' / 'warn' / 'raise'（省略時は QUERY_BUDGET_MODE）
+    """
+
+    def __init__(self, max_queries, label=None, mode=None):
+        self.max_queries = max_queries
+        self.label = label
+        self.mode = mode
+        self.queries = []
+        self._wrapper = None
+
+    def _recreate_cm(self):
+        # デコレータとして使う場合は呼び出しごとに別インスタンスで数える（スレッド・再帰対策）
+        return type(self)(self.max_queries, self.label, self.mode)
+
+    def __call__(self, func):
+        if self.label is None:
+            self.label = func.__qualname__
+        return super().__call__(func)
+
+    @property
+    def active_mode(self):
+        return self.mode or settings.QUERY_BUDGET_MODE
+
+    def __enter__(self):
+        self.queries = []
+        if self.active_mode != 'off':
+            self._wrapper = connection.execute_wrapper(self._record)
+            self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._wrapper is None:
+            return False
+
+        self._wrapper.__exit__(exc_type, exc, tb)
+        self._wrapper = None
+
+        if exc_type is None and len(self.queries) > self.max_queries:
+            error = QueryBudgetExceeded(self.label, self.max_queries, self.queries)
+            if self.active_mode == 'raise':
+                raise error
+            logger.warning(str(error))
+        return False
+
+    def _record(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
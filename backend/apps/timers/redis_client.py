@@ -0,0 +1,27 @@
+"""Redis クライアント（tickエンジンのリーダー選出・タイマーリストのバージョン管理などで使用）"""
+from django.conf import settings
+import redis
+import redis.asyncio
+
+# キーの名前空間（Celery・Channelsと同じRedisを共有するため）
+KEY_PREFIX = 'kanritimer'
+
+_sync_client = None
+
+
+def redis_key(*parts):
+    """名前空間付きのキーを生成"""
+    return ':'.join((KEY_PREFIX, *[str(part) for part in parts]))
+
+
+def get_redis():
+    """同期用Redisクライアント（プロセス内で共有）"""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(settings.REDIS_URL)
+    return _sync_client
+
+
+def get_async_redis():
+    """非同期用Redisクライアント（イベントループごとに生成すること）"""
+    return redis.asyncio.Redis.from_url(settings.REDIS_URL)
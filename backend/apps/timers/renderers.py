@@ -0,0 +1,20 @@
+from rest_framework.renderers import JSONRenderer
+from .json_codec import dumps
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer と同じ出力を json_codec（orjson があれば orjson）で作るレンダラー
+
+    インデント指定（Acceptヘッダーの indent 等）がある場合や、UNICODE_JSON・COMPACT_JSON を
+    既定値から変えている場合は JSONRenderer にそのまま任せる。
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return dumps(data)
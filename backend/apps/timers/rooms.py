@@ -0,0 +1,58 @@
+"""
+ルームの解決（URLのスラッグ → ルームID）
+
+既存のURL（/api/timers/..., /ws/timer/）はルーム指定なしで既定のルームを操作し、
+/api/rooms/<room>/timers/..., /ws/timer/<room>/ は指定したルームを操作する。
+"""
+from functools import wraps
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+from .models import Room, DEFAULT_ROOM_ID, DEFAULT_ROOM_SLUG
+import time
+
+# スラッグ → (ルームID, 有効期限)。スラッグは管理画面でも変更できない（RoomAdmin）が、
+# ルームは削除できるため、他のプロセスで削除されたルームも ROOM_ID_TTL 秒で解決し直す
+# （削除したプロセスでは post_delete で即座に破棄する）。既定のルームは削除できない
+ROOM_ID_TTL = 30
+_room_ids = {}
+
+
+def get_room_id(slug):
+    """
+    スラッグからルームIDを取得
+
+    Raises:
+        Room.DoesNotExist: ルームが存在しない場合
+    """
+    if slug == DEFAULT_ROOM_SLUG:
+        return DEFAULT_ROOM_ID
+
+    room_id, expires_at = _room_ids.get(slug, (None, 0))
+    if room_id is None or expires_at < time.monotonic():
+        _room_ids.pop(slug, None)
+        room_id = Room.objects.values_list('id', flat=True).get(slug=slug)
+        _room_ids[slug] = (room_id, time.monotonic() + ROOM_ID_TTL)
+    return room_id
+
+
+@receiver(post_delete, sender=Room)
+def forget_room(sender, instance, **kwargs):
+    """削除したルームのスラッグを破棄"""
+    _room_ids.pop(instance.slug, None)
+
+
+def room_view(view):
+    """URLの room（スラッグ、省略時は既定のルーム）を room_id に解決してビューに渡す"""
+    @wraps(view)
+    def wrapper(request, *args, room=DEFAULT_ROOM_SLUG, **kwargs):
+        try:
+            room_id = get_room_id(room)
+        except Room.DoesNotExist:
+            return Response(
+                {'detail': '指定されたルームが見つかりません。'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return view(request, *args, room_id=room_id, **kwargs)
+    return wrapper
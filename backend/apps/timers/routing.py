@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     path('ws/timer/', consumers.TimerConsumer.as_asgi()),
+    path('ws/timer/<slug:room>/', consumers.TimerConsumer.as_asgi()),
 ]
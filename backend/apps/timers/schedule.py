@@ -0,0 +1,129 @@
+"""
+スケジュール予測（各タイマーの予定/予測の開始・終了時刻）
+
+「○○の出番は実際には何時からか」を、タイマーの順序・予定時間・実績と現在の
+タイマー状態から計算する。
+
+- 予定（planned）: 最初のタイマーが始まった時刻（未開始なら現在時刻）から、全タイマーが
+  予定時間どおりに進んだ場合の時刻
+- 予測（projected）: 完了済みは実績、現在のタイマーは残り時間、以降の未完了タイマーは
+  予定時間どおりに進むと仮定した時刻
+
+予定時間の累積和（itertools.accumulate）で全タイマー分を1回で計算する。
+未完了タイマーは完了処理と同じく order 順に実行される前提。
+
+計算結果はペイロードキャッシュ（payloads.get_schedule_payload）で状態・リストの
+バージョンごとにキャッシュする。
+"""
+from django.utils import timezone
+from datetime import timedelta
+from itertools import accumulate
+from rest_framework import serializers
+from .models import Timer
+from .scheduler import get_deadline
+
+STATUS_COMPLETED = 'completed'
+STATUS_CURRENT = 'current'
+STATUS_PENDING = 'pending'
+
+
+def depends_on_now(timer_state, now=None):
+    """予測が現在時刻によって変わるか（一時停止中・未開始・予定時間超過中）"""
+    deadline = get_deadline(timer_state)
+    return deadline is None or deadline <= (now or timezone.now())
+
+
+def _current_window(timer_state, now):
+    """現在のタイマーの（開始時刻, 予測終了時刻）"""
+    timer = timer_state.current_timer
+    total_seconds = timer.minutes * 60
+
+    if not timer_state.is_running or not timer_state.started_at:
+        # 未開始: 今すぐ開始した場合
+        return now, now + timedelta(seconds=total_seconds)
+
+    if timer_state.is_paused:
+        # 一時停止中: 再開すれば残り時間で終わる
+        started = timer_state.paused_at - timedelta(
+            seconds=timer_state.elapsed_seconds + timer_state.total_paused_seconds
+        )
+        return started, now + timedelta(seconds=total_seconds - timer_state.elapsed_seconds)
+
+    # started_at は一時停止分ずらされているため、実際の開始時刻は累積一時停止時間だけ前
+    started = timer_state.started_at - timedelta(seconds=timer_state.total_paused_seconds)
+    return started, max(get_deadline(timer_state), now)
+
+
+def project_schedule(timer_state, timers=None, now=None):
+    """
+    全タイマーの予定・予測時刻を計算
+
+    Args:
+        timer_state: TimerState（現在のタイマー込み）
+        timers: order順のTimerのリスト（省略時はルームのタイマーをDBから1クエリで取得）
+        now: 基準時刻（省略時は現在時刻）
+
+    Returns:
+        dict: planned_end, projected_end, delay_seconds と、タイマーごとの
+              status, planned_start/end, projected_start/end, delay_seconds
+    """
+    now = now or timezone.now()
+    if timers is None:
+        timers = list(Timer.objects.filter(room_id=timer_state.room_id).order_by('order').only(
+            'id', 'band_name', 'order', 'minutes', 'actual_seconds', 'completed_at'
+        ))
+
+    current = timer_state.current_timer
+    completed = [timer for timer in timers if timer.completed_at]
+    pending = [timer for timer in timers if not timer.completed_at and (not current or timer.id != current.id)]
+
+    # 予測: 完了済みは実績、現在のタイマー以降は予定時間の累積和
+    windows = [
+        (timer.completed_at - timedelta(seconds=timer.actual_seconds or 0), timer.completed_at)
+        for timer in completed
+    ]
+    rows = [(timer, STATUS_COMPLETED) for timer in completed]
+
+    if current:
+        cursor_start, cursor = _current_window(timer_state, now)
+        windows.append((cursor_start, cursor))
+        rows.append((current, STATUS_CURRENT))
+    else:
+        cursor = max([now] + [end for _, end in windows])
+
+    pending_ends = list(accumulate(timer.minutes * 60 for timer in pending))
+    windows.extend(
+        (cursor + timedelta(seconds=end - timer.minutes * 60), cursor + timedelta(seconds=end))
+        for timer, end in zip(pending, pending_ends)
+    )
+    rows.extend((timer, STATUS_PENDING) for timer in pending)
+
+    if not rows:
+        return {'planned_end': None, 'projected_end': None, 'delay_seconds': 0, 'timers': []}
+
+    # 予定: 最初に始まったタイマーの開始時刻から予定時間どおりに進んだ場合
+    anchor = min(start for start, _ in windows)
+    planned_ends = list(accumulate(timer.minutes * 60 for timer, _ in rows))
+
+    to_representation = serializers.DateTimeField().to_representation
+    result = []
+    for (timer, status), (projected_start, projected_end), planned_end_offset in zip(rows, windows, planned_ends):
+        planned_end = anchor + timedelta(seconds=planned_end_offset)
+        result.append({
+            'id': timer.id,
+            'band_name': timer.band_name,
+            'order': timer.order,
+            'status': status,
+            'planned_start': to_representation(planned_end - timedelta(seconds=timer.minutes * 60)),
+            'planned_end': to_representation(planned_end),
+            'projected_start': to_representation(projected_start),
+            'projected_end': to_representation(projected_end),
+            'delay_seconds': int((projected_end - planned_end).total_seconds()),
+        })
+
+    return {
+        'planned_end': result[-1]['planned_end'],
+        'projected_end': result[-1]['projected_end'],
+        'delay_seconds': result[-1]['delay_seconds'],
+        'timers': result,
+    }
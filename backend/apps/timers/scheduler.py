@@ -0,0 +1,119 @@
+"""
+タイマー完了スケジューラ（deadlineモード）
+
+TIMER_SCHEDULER_MODE = 'deadline' の場合、Celery Beatで毎秒ポーリングする代わりに
+開始/再開時に完了時刻（deadline）を計算し、ETAタスクを1件だけ予約する。
+
+- 予約トークン(TimerState.schedule_token)を完了タスクのtask_idとして使用
+- 状態が変わるたびにトークンを作り直し、古いタスクはrevoke（届いても無視される）
+- 実行中のみ1秒ごとの配信タスクを自己再予約で回すため、アイドル時のDBアクセスは0
+- 配信タスクは実行中しか回らないため、スキップ等で実行が終わった場合はLINE通知
+  （リハーサル終了通知）のステージだけを1回実行するタスクを予約する
+"""
+from celery import current_app
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def is_deadline_mode():
+    """deadlineモードで動作しているか"""
+    return settings.TIMER_SCHEDULER_MODE == 'deadline'
+
+
+def get_deadline(timer_state):
+    """
+    現在のタイマーの完了予定時刻を返す
+
+    Returns:
+        datetime: 完了予定時刻（実行中でない、または一時停止中の場合はNone）
+    """
+    if not timer_state.is_running or timer_state.is_paused:
+        return None
+    if not timer_state.current_timer or not timer_state.started_at:
+        return None
+    return timer_state.started_at + timedelta(seconds=timer_state.current_timer.minutes * 60)
+
+
+def next_tick_at(now=None):
+    """次の秒境界の時刻を返す"""
+    now = now or timezone.now()
+    return now.replace(microsecond=0) + timedelta(seconds=1)
+
+
+def new_schedule_token(timer_state):
+    """状態に対応する新しい予約トークン（実行中でなければ空）"""
+    return str(uuid.uuid4()) if timer_state.is_running else ''
+
+
+def dispatch(room_id, timer_state, old_token, notify=True):
+    """
+    保存済みの予約トークンに合わせて古い完了タスクを取り消し、新しいタスクを予約
+
+    Args:
+        room_id: ルームID
+        timer_state: 新しい schedule_token を保存済みの TimerState
+        old_token: 保存前の schedule_token
+        notify: 実行が終わった場合にLINE通知のステージを1回実行するか
+            （完了はtickパイプライン内で通知まで実行するため False）
+    """
+    try:
+        new_token = timer_state.schedule_token
+
+        # 古い完了タスクを取り消し（配信タスクはトークン不一致で自然停止）
+        if old_token:
+            current_app.control.revoke(old_token)
+
+        if not new_token:
+            logger.debug('スケジュール解除: 実行中のタイマーなし')
+            if old_token and notify:
+                # 配信タスクが止まるため、終了通知はここで1回だけ評価する
+                current_app.send_task('apps.timers.tasks.run_notifications', args=[room_id])
+            return
+
+        deadline = get_deadline(timer_state)
+        if deadline:
+            current_app.send_task(
+                'apps.timers.tasks.complete_timer_at_deadline',
+                args=[new_token, room_id],
+                eta=deadline,
+                task_id=new_token,
+            )
+            logger.debug(f'完了タスク予約: {timer_state.current_timer.band_name} deadline={deadline.isoformat()}')
+
+        current_app.send_task(
+            'apps.timers.tasks.tick_running_timer',
+            args=[new_token, room_id],
+            eta=next_tick_at(),
+        )
+    except Exception as e:
+        logger.error(f'dispatch error: {e}', exc_info=True)
+
+
+def reschedule(room_id):
+    """
+    タイマー状態に合わせて完了タスク・配信タスクを予約し直す
+
+    状態遷移（transitions.py）は予約トークンを遷移と同じ UPDATE で更新して dispatch を呼ぶため、
+    これはタイマーリストの変更で完了予定が変わりうる場合に使う。予約トークンの書き込みも
+    version を条件にした UPDATE で行う（transitions.renew_schedule）。
+
+    使用箇所:
+      - services.py (delete, reorder, move)
+
+    Args:
+        room_id: ルームID
+    """
+    if not is_deadline_mode():
+        return
+
+    try:
+        from .transitions import renew_schedule
+
+        renew_schedule(room_id)
+    except Exception as e:
+        logger.error(f'reschedule error: {e}', exc_info=True)
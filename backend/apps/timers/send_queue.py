@@ -0,0 +1,159 @@
+"""
+WebSocket接続ごとの送信キュー（遅いクライアントのバックプレッシャー）
+
+コンシューマーはチャネルレイヤーから受け取ったフレームをすぐにこのキューに入れて次の
+メッセージの処理に戻り、送信は接続ごとの送信タスクが行う。送信が追いつかない接続でも
+チャネルレイヤーのキューや他の接続への配信を遅らせない。
+
+- 置き換え可能なフレーム（1秒ごとの状態配信）は最新の1件だけを保持する（古いものは破棄）
+- それ以外（状態遷移・リスト・差分・制御メッセージ）は破棄せず順番どおりに送る
+- 状態遷移のフレームを入れた時点で、保持中の1秒ごとの状態配信は古いため破棄する
+- 順番どおりに送るフレームが上限（TIMER_WS_MAX_PENDING）を超えたら接続を閉じる
+  （クライアントは last_seq を指定して再接続し、取りこぼした配信を再送してもらう）
+
+送信が実際に詰まるかはASGIサーバーによる（送信バッファが一杯のとき send() が待つサーバー
+では送信タスクが待つ。Daphneは送信をすぐに返すため、主にイベントループの混雑時に効く）。
+
+カウンター（接続ごとに集計し、定期的・切断時にルームごとのRedisハッシュに加算）:
+  - sent:      送信したフレーム数
+  - coalesced: 新しいフレームで置き換えて送らなかったフレーム数
+  - dropped:   上限超過で接続を閉じたときに送らずに破棄したフレーム数
+  - overflows: 上限超過で閉じた接続数
+"""
+from collections import Counter, deque
+from .redis_client import get_redis, redis_key
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# この間隔（秒）ごとにカウンターをRedisに加算
+FLUSH_INTERVAL = 30
+
+COUNTER_NAMES = ('sent', 'coalesced', 'dropped', 'overflows')
+
+
+def counters_key(room_id):
+    return redis_key('ws', 'counters', room_id)
+
+
+def add_counters(room_id, counts):
+    """接続のカウンターをルームの合計に加算"""
+    pipeline = get_redis().pipeline(transaction=False)
+    for name, value in counts.items():
+        if value:
+            pipeline.hincrby(counters_key(room_id), name, value)
+    pipeline.execute()
+
+
+def get_counters(room_id):
+    """ルームのカウンターの合計"""
+    values = get_redis().hgetall(counters_key(room_id))
+    return {name: int(values.get(name.encode(), 0)) for name in COUNTER_NAMES}
+
+
+class SendQueue:
+    """
+    接続ごとの送信キュー
+
+    Args:
+        send: フレームを送信するコルーチン関数
+        max_pending: 順番どおりに送るフレームの上限
+        on_overflow: 上限を超えたときに呼ぶコルーチン関数（接続を閉じる）
+        flush: カウンターの差分を受け取って集計するコルーチン関数
+    """
+
+    def __init__(self, send, max_pending, on_overflow, flush):
+        self._send = send
+        self._max_pending = max_pending
+        self._on_overflow = on_overflow
+        self._flush = flush
+        self._frames = deque()
+        self._latest = None
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._flushed_at = time.monotonic()
+        self._unflushed = Counter()
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, frame):
+        """破棄せずに順番どおりに送るフレームを追加"""
+        if self._closed:
+            return
+        if len(self._frames) >= self._max_pending:
+            self._overflow()
+            return
+        self._frames.append(frame)
+        self._wakeup.set()
+
+    def put_latest(self, frame):
+        """置き換え可能なフレームを追加（未送信の前のフレームは破棄）"""
+        if self._closed:
+            return
+        if self._latest is not None:
+            self._count('coalesced')
+        self._latest = frame
+        self._wakeup.set()
+
+    def discard_latest(self):
+        """保持中の置き換え可能なフレームを破棄（より新しい状態を put した場合）"""
+        if self._latest is not None:
+            self._latest = None
+            self._count('coalesced')
+
+    async def close(self):
+        """送信タスクを止めてカウンターを集計"""
+        self._closed = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await self._flush_counts(force=True)
+
+    def _count(self, name, value=1):
+        self._unflushed[name] += value
+
+    def _overflow(self):
+        dropped = len(self._frames) + 1 + (self._latest is not None)
+        self._frames.clear()
+        self._latest = None
+        self._closed = True
+        self._count('dropped', dropped)
+        self._count('overflows')
+        logger.warning(f'WebSocket送信キュー上限超過のため切断（破棄 {dropped}件）')
+        asyncio.create_task(self._on_overflow())
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._frames or self._latest is not None:
+                if self._frames:
+                    frame = self._frames.popleft()
+                else:
+                    frame, self._latest = self._latest, None
+                try:
+                    await self._send(frame)
+                except Exception as e:
+                    # 切断済み等。以降は disconnect で close() される
+                    logger.debug(f'WebSocket送信失敗: {e}')
+                    self._closed = True
+                    return
+                self._count('sent')
+
+            await self._flush_counts()
+
+    async def _flush_counts(self, force=False):
+        if not self._unflushed:
+            return
+        if not force and time.monotonic() - self._flushed_at < FLUSH_INTERVAL:
+            return
+        counts, self._unflushed = self._unflushed, Counter()
+        self._flushed_at = time.monotonic()
+        try:
+            await self._flush(counts)
+        except Exception as e:
+            logger.warning(f'WebSocket送信カウンターの集計に失敗: {e}')
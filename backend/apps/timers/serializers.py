@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Timer, TimerState
+from .models import RehearsalArchive, Room, Timer, TimerEvent, TimerState
 from apps.members.models import Member
 
 
@@ -11,6 +11,15 @@ class MemberSerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
 
 
+class RoomSerializer(serializers.ModelSerializer):
+    """ルームシリアライザー"""
+
+    class Meta:
+        model = Room
+        fields = ('id', 'slug', 'name', 'created_at')
+        read_only_fields = ('id', 'created_at')
+
+
 class TimerSerializer(serializers.ModelSerializer):
     """タイマーシリアライザー"""
     members = serializers.SerializerMethodField()
@@ -33,6 +42,7 @@ class TimerSerializer(serializers.ModelSerializer):
             'member3',
             'order',
             'actual_seconds',
+            'paused_seconds',
             'time_difference',
             'time_difference_display',
             'completed_at',
@@ -52,6 +62,11 @@ class TimerStateSerializer(serializers.ModelSerializer):
     remaining_seconds = serializers.SerializerMethodField()
     total_time_difference = serializers.SerializerMethodField()
     total_time_difference_display = serializers.SerializerMethodField()
+    deadline = serializers.SerializerMethodField()
+    planned_end = serializers.SerializerMethodField()
+    projected_end = serializers.SerializerMethodField()
+    next_timer_projected_start = serializers.SerializerMethodField()
+    server_time = serializers.SerializerMethodField()
 
     class Meta:
         model = TimerState
@@ -67,18 +82,18 @@ class TimerStateSerializer(serializers.ModelSerializer):
             'line_notifications_enabled',
             'total_time_difference',
             'total_time_difference_display',
+            'deadline',
+            'planned_end',
+            'projected_end',
+            'next_timer_projected_start',
+            'server_time',
             'updated_at'
         )
 
     def get_next_timer(self, obj):
-        """次のタイマーを返す"""
-        if obj.current_timer:
-            next_timer = Timer.objects.filter(
-                order__gt=obj.current_timer.order,
-                completed_at__isnull=True
-            ).first()
-            if next_timer:
-                return TimerSerializer(next_timer).data
+        """次のタイマーを返す（TimerState.next_timer に保存済み）"""
+        if obj.current_timer and obj.next_timer:
+            return TimerSerializer(obj.next_timer).data
         return None
 
     def get_remaining_seconds(self, obj):
@@ -109,9 +124,8 @@ class TimerStateSerializer(serializers.ModelSerializer):
         """全体の押し巻き（秒）をリアルタイム計算"""
         from django.utils import timezone
 
-        # 完了済みタイマーの時間差を合計
-        completed_timers = Timer.objects.filter(actual_seconds__isnull=False)
-        total_diff = sum(timer.time_difference for timer in completed_timers)
+        # 完了済みタイマーの時間差の合計（完了時に加算済み）
+        total_diff = obj.total_time_difference
 
         # 実行中のタイマーがある場合、累積一時停止時間を加算
         if obj.current_timer and obj.is_running:
@@ -141,3 +155,57 @@ class TimerStateSerializer(serializers.ModelSerializer):
             status = '定刻通り⚪'
 
         return f'{sign}{minutes}:{seconds:02d} {status}'
+
+    def get_deadline(self, obj):
+        """完了予定時刻（実行中のみ。クライアント側のカウントダウン描画用）"""
+        from .scheduler import get_deadline
+
+        deadline = get_deadline(obj)
+        return serializers.DateTimeField().to_representation(deadline) if deadline else None
+
+    def _get_schedule(self, obj):
+        """スケジュール予測（ペイロードキャッシュ経由、シリアライズ中は1回だけ取得）"""
+        from .payloads import get_schedule_payload
+
+        if not hasattr(self, '_schedule'):
+            self._schedule = get_schedule_payload(obj.room_id, obj).data
+        return self._schedule
+
+    def get_planned_end(self, obj):
+        """全タイマーが予定時間どおりに進んだ場合の終了時刻"""
+        return self._get_schedule(obj)['planned_end']
+
+    def get_projected_end(self, obj):
+        """現在の進行状況から予測した全体の終了時刻"""
+        return self._get_schedule(obj)['projected_end']
+
+    def get_next_timer_projected_start(self, obj):
+        """次のタイマーの予測開始時刻"""
+        if not obj.next_timer_id:
+            return None
+        for timer in self._get_schedule(obj)['timers']:
+            if timer['id'] == obj.next_timer_id:
+                return timer['projected_start']
+        return None
+
+    def get_server_time(self, obj):
+        """シリアライズ時点のサーバー時刻（クライアントの時計ずれ補正用）"""
+        from django.utils import timezone
+
+        return serializers.DateTimeField().to_representation(timezone.now())
+
+
+class TimerEventSerializer(serializers.ModelSerializer):
+    """タイマーイベントシリアライザー"""
+
+    class Meta:
+        model = TimerEvent
+        fields = ('id', 'kind', 'timer_id', 'version', 'changes', 'data', 'created_at')
+
+
+class RehearsalArchiveSerializer(serializers.ModelSerializer):
+    """リハーサル記録シリアライザー"""
+
+    class Meta:
+        model = RehearsalArchive
+        fields = ('id', 'timer_count', 'total_time_difference', 'finished_at', 'archived_at')
@@ -0,0 +1,428 @@
+"""
+タイマー操作のサービス層（REST APIのビューと一括操作で共有）
+
+各操作はDBを変更するだけで配信はせず、配信する内容を Changes に蓄積する。
+ビューは1操作ごとに、一括操作（apply_operations）は全操作をコミットした後に1回だけ
+Changes.publish() で配信する。
+
+各操作はイベントとして記録する（journal.py）。
+
+一括操作では全操作を1つのトランザクションで実行し、途中の操作が失敗したら全て
+取り消す（OperationError に失敗した操作の位置を持たせる）。トランザクション内では
+Redisの状態キャッシュがコミット前の変更を反映していないため、状態はDBから読む。
+"""
+from django.db import transaction
+from rest_framework import status
+from .models import Room, Timer, TimerState
+from .ordering import ORDER_STEP, next_order, update_orders, assign_orders, order_between
+from .scheduler import reschedule
+from .state_cache import load_from_db
+from . import journal, transitions
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 一括操作で1回に指定できる操作数の上限
+MAX_OPERATIONS = 50
+
+
+class ServiceError(Exception):
+    """操作できない（ビューは detail と status_code をそのままレスポンスにする）"""
+
+    def __init__(self, detail, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+class OperationError(ServiceError):
+    """一括操作の途中の操作が失敗した"""
+
+    def __init__(self, index, op, error):
+        super().__init__(error.detail, error.status_code)
+        self.index = index
+        self.op = op
+
+
+class Changes:
+    """配信する変更の蓄積（同じタイマーへの複数の変更は最後のものだけを配信）"""
+
+    def __init__(self):
+        self.timer_state = None
+        self.state_changed = False
+        self.upserted = {}
+        self.deleted = set()
+        self.reordered = {}
+        self.needs_reschedule = False
+
+    def state(self, timer_state, changed=True):
+        """最新の状態を記録（changed=False は次のタイマーの更新等、状態を配信しない変更）"""
+        self.timer_state = timer_state
+        self.state_changed = self.state_changed or changed
+
+    def upsert(self, timer):
+        self.upserted[timer.id] = timer
+        # 状態が持つ現在・次のタイマーが古くなるため、配信時に読み直す
+        if self.timer_state is not None and timer.id in (
+            self.timer_state.current_timer_id, self.timer_state.next_timer_id
+        ):
+            self.timer_state = None
+
+    def delete(self, timer_id):
+        self.deleted.add(timer_id)
+
+    def reorder(self, orders):
+        self.reordered.update(orders)
+
+    def publish(self, room_id):
+        """蓄積した変更を配信（コミット後に呼ぶ）"""
+        from .utils import broadcast_timer_state, broadcast_timer_changes
+
+        if self.needs_reschedule:
+            # 完了タスクを再予約（deadlineモードのみ）
+            reschedule(room_id)
+
+        if self.state_changed:
+            broadcast_timer_state(room_id, timer_state=self.timer_state)
+
+        upserted = [timer for timer_id, timer in self.upserted.items() if timer_id not in self.deleted]
+        reordered = {
+            timer_id: order for timer_id, order in self.reordered.items()
+            if timer_id not in self.deleted
+        }
+        if upserted or self.deleted or reordered:
+            broadcast_timer_changes(room_id, upserted=upserted, deleted=sorted(self.deleted), reordered=reordered)
+
+
+def _load_state(room_id, changes):
+    """操作の前提にする状態（一括操作の途中ならDBから、そうでなければキャッシュから）"""
+    if changes.timer_state is not None:
+        return changes.timer_state
+    if transaction.get_connection().in_atomic_block:
+        return load_from_db(room_id)
+    return TimerState.load(room_id)
+
+
+def validate_timer_data(data):
+    """
+    タイマーデータのバリデーション
+
+    Returns:
+        dict: 検証済みデータ（band_name, minutes, member1〜3 のMemberインスタンス）
+
+    Raises:
+        ServiceError: 不正な場合
+    """
+    from apps.members.models import Member
+
+    band_name = data.get('band_name', '').strip()
+    minutes = data.get('minutes')
+    member1_id = data.get('member1_id')
+    member2_id = data.get('member2_id')
+    member3_id = data.get('member3_id')
+
+    # 必須フィールドチェック
+    if not band_name:
+        raise ServiceError('バンド名は必須です。')
+
+    if not minutes or minutes <= 0:
+        raise ServiceError('予定時間は1分以上で指定してください。')
+
+    if not all([member1_id, member2_id, member3_id]):
+        raise ServiceError('担当者3名を全て選択してください。')
+
+    # 重複チェック
+    if len(set([member1_id, member2_id, member3_id])) != 3:
+        raise ServiceError('同じメンバーを複数回選択することはできません。')
+
+    # メンバーの存在確認（3名を1クエリで取得）
+    members = Member.objects.filter(
+        id__in=[member1_id, member2_id, member3_id], is_active=True
+    ).in_bulk()
+    try:
+        member1, member2, member3 = [
+            members[int(member_id)] for member_id in (member1_id, member2_id, member3_id)
+        ]
+    except (KeyError, ValueError):
+        raise ServiceError('指定されたメンバーが見つかりません。', status.HTTP_404_NOT_FOUND)
+
+    return {
+        'band_name': band_name,
+        'minutes': minutes,
+        'member1': member1,
+        'member2': member2,
+        'member3': member3,
+    }
+
+
+def _get_editable_timer(room_id, timer_id, changes, action):
+    """編集・削除できるタイマーを取得（完了済み・実行中は不可）"""
+    try:
+        timer = Timer.objects.get(id=timer_id, room_id=room_id)
+    except (Timer.DoesNotExist, ValueError, TypeError):
+        raise ServiceError('指定されたタイマーが見つかりません。', status.HTTP_404_NOT_FOUND)
+
+    # 完了済みタイマーは不可
+    if timer.is_completed:
+        raise ServiceError(f'完了済みのタイマーは{action}できません。')
+
+    # 実行中のタイマーは不可
+    timer_state = _load_state(room_id, changes)
+    if timer_state.is_running and timer_state.current_timer and timer_state.current_timer.id == timer.id:
+        raise ServiceError(f'実行中のタイマーは{action}できません。')
+
+    return timer
+
+
+def create_timer(room_id, data, changes):
+    """タイマーを作成（最後尾に追加）"""
+    validated_data = validate_timer_data(data)
+
+    timer = Timer.objects.create(room_id=room_id, order=next_order(room_id), **validated_data)
+
+    logger.info(f'タイマー作成: {timer.band_name} (order: {timer.order})')
+    journal.record(room_id, 'create', timer_id=timer.id, data={
+        'band_name': timer.band_name, 'minutes': timer.minutes, 'order': timer.order,
+    })
+
+    # current_timerがnullの場合は新規作成したタイマーを自動セット、
+    # 最後尾に追加したタイマーが次のタイマーになる場合は次のタイマーを更新
+    timer_state, attached = transitions.attach(room_id, timer)
+    if attached:
+        changes.state(timer_state)
+        if timer_state.current_timer_id == timer.id:
+            logger.info(f'current_timerを自動設定: {timer.band_name}')
+
+    changes.upsert(timer)
+    return timer
+
+
+def import_timers(room_id, validated_rows, changes):
+    """
+    検証済みの行をまとめて最後尾に追加（タイムテーブルの取り込み）
+
+    状態への反映（attach）も同じトランザクションで行うため、競合した場合は
+    登録ごと取り消される（再試行で二重に登録しない）。
+
+    Args:
+        validated_rows: timetable.validate_rows で検証済みの行
+
+    Returns:
+        list: 作成したTimer
+    """
+    with transaction.atomic():
+        # 同じルームの作成・並べ替えと同じorderを割り当てないようにルームをロック
+        Room.objects.select_for_update().filter(id=room_id).exists()
+
+        # 順序は最後尾から1回で割り当てる
+        first_order = next_order(room_id)
+        timers = Timer.objects.bulk_create([
+            Timer(room_id=room_id, order=first_order + index * ORDER_STEP, **row)
+            for index, row in enumerate(validated_rows)
+        ])
+        journal.record(room_id, 'import', data={'timer_ids': [timer.id for timer in timers]})
+
+        # current_timer・next_timerが未設定なら、作成したタイマーから設定
+        try:
+            timer_state, attached = transitions.attach(room_id, timers[0])
+        except transitions.TransitionConflict:
+            raise ServiceError('他の操作と競合しました。もう一度お試しください。', status.HTTP_409_CONFLICT)
+
+    logger.info(f'タイマー一括登録: {len(timers)}件')
+    if attached:
+        changes.state(timer_state)
+    for timer in timers:
+        changes.upsert(timer)
+    return timers
+
+
+def update_timer(room_id, timer_id, data, changes):
+    """タイマーを更新（完了済み・実行中は不可）"""
+    timer = _get_editable_timer(room_id, timer_id, changes, '編集')
+    validated_data = validate_timer_data(data)
+
+    for name, value in validated_data.items():
+        setattr(timer, name, value)
+    timer.save()
+
+    logger.info(f'タイマー更新: {timer.band_name} (id: {timer.id})')
+    journal.record(room_id, 'update', timer_id=timer.id, data={
+        'band_name': timer.band_name, 'minutes': timer.minutes,
+        'member_ids': [timer.member1_id, timer.member2_id, timer.member3_id],
+    })
+
+    # 現在のタイマー（待機中）・次のタイマーを編集した場合に備えて状態キャッシュを破棄
+    TimerState.invalidate_cache(room_id)
+
+    changes.upsert(timer)
+    return timer
+
+
+def delete_timer(room_id, timer_id, changes):
+    """タイマーを削除（完了済み・実行中は不可。後ろのタイマーのorderは詰めない）"""
+    timer = _get_editable_timer(room_id, timer_id, changes, '削除')
+
+    deleted_id, band_name, deleted_order = timer.id, timer.band_name, timer.order
+    with transaction.atomic():
+        # 現在・次のタイマーなら削除の前に状態から外す（SET NULL で記録なしに変わらないように）
+        try:
+            timer_state, released = transitions.release(room_id, timer)
+        except transitions.TransitionError as e:
+            raise ServiceError(e.detail)
+        except transitions.TransitionConflict:
+            raise ServiceError('他の操作と競合しました。もう一度お試しください。', status.HTTP_409_CONFLICT)
+        timer.delete()
+
+        journal.record(room_id, 'delete', timer_id=deleted_id, data={'band_name': band_name, 'order': deleted_order})
+
+    logger.info(f'タイマー削除: {band_name} (order: {deleted_order})')
+    changes.state(timer_state, changed=released)
+    changes.delete(deleted_id)
+    changes.needs_reschedule = True
+
+
+def reorder_timers(room_id, timer_ids, changes):
+    """
+    タイマーの順序を変更（全タイマーのIDを新しい順に指定）
+
+    Returns:
+        dict: {タイマーID: 新しいorder}（orderが変わったタイマーのみ）
+    """
+    if not timer_ids or not isinstance(timer_ids, list):
+        raise ServiceError('timer_idsは配列で指定してください。')
+
+    with transaction.atomic():
+        # 同じルームの移動・並べ替えと同時に実行されないようにルームをロック
+        Room.objects.select_for_update().filter(id=room_id).exists()
+
+        # 全タイマーの現在のorderを取得
+        current_orders = dict(Timer.objects.filter(room_id=room_id).values_list('id', 'order'))
+
+        # IDの整合性チェック
+        if len(timer_ids) != len(current_orders) or set(timer_ids) != set(current_orders):
+            raise ServiceError('タイマーIDが不正です。全てのタイマーを指定してください。')
+
+        # 順序を更新（orderが変わるタイマーだけを1つのUPDATE文で更新）
+        orders = assign_orders(current_orders, timer_ids)
+        update_orders(orders)
+
+        if orders:
+            journal.record(room_id, 'reorder', data={'orders': orders})
+
+            # 現在のタイマーのorder変更を反映し、次のタイマーを更新
+            changes.state(TimerState.refresh_next_timer(room_id), changed=False)
+            changes.reorder(orders)
+            changes.needs_reschedule = True
+
+    logger.info(f'タイマー順序変更: {timer_ids} ({len(orders)}件更新)')
+    return orders
+
+
+def move_timer(room_id, timer_id, after_id, before_id, changes):
+    """
+    タイマーを after_id の直後・before_id の直前に移動
+
+    Returns:
+        dict: {タイマーID: 新しいorder}
+    """
+    if not after_id and not before_id:
+        raise ServiceError('after_idまたはbefore_idを指定してください。')
+    if timer_id in (after_id, before_id):
+        raise ServiceError('移動するタイマー自身は指定できません。')
+
+    with transaction.atomic():
+        # 同じルームの移動・並べ替えと同時に実行されないようにルームをロック
+        Room.objects.select_for_update().filter(id=room_id).exists()
+
+        if not Timer.objects.filter(id=timer_id, room_id=room_id).exists():
+            raise ServiceError('指定されたタイマーが見つかりません。', status.HTTP_404_NOT_FOUND)
+
+        try:
+            orders = order_between(room_id, timer_id, after_id=after_id, before_id=before_id)
+        except Timer.DoesNotExist:
+            raise ServiceError('指定されたタイマーが見つかりません。', status.HTTP_404_NOT_FOUND)
+        except ValueError:
+            raise ServiceError('after_idとbefore_idには隣り合うタイマーを指定してください。')
+
+        update_orders(orders)
+        journal.record(room_id, 'move', timer_id=timer_id, data={'orders': orders})
+
+        # 現在のタイマーのorder変更を反映し、次のタイマーを更新
+        changes.state(TimerState.refresh_next_timer(room_id), changed=False)
+        changes.reorder(orders)
+        changes.needs_reschedule = True
+
+    logger.info(f'タイマー移動: {timer_id} (after: {after_id}, before: {before_id}, {len(orders)}件更新)')
+    return orders
+
+
+def _transition(changes, apply, *args, **kwargs):
+    """状態遷移を実行して結果の状態を記録"""
+    try:
+        result = apply(*args, **kwargs)
+    except transitions.TransitionError as e:
+        raise ServiceError(e.detail)
+    except transitions.TransitionConflict:
+        raise ServiceError('他の操作と競合しました。もう一度お試しください。', status.HTTP_409_CONFLICT)
+    except Timer.DoesNotExist:
+        raise ServiceError('指定されたタイマーが見つかりません。', status.HTTP_404_NOT_FOUND)
+
+    timer_state, completed_timer = result if isinstance(result, tuple) else (result, None)
+    changes.state(timer_state)
+    if completed_timer:
+        changes.upsert(completed_timer)
+    return timer_state
+
+
+# 一括操作: op → (Changes を受け取って操作を実行する関数)
+OPERATIONS = {
+    'start': lambda room_id, op, changes: _transition(changes, transitions.start, room_id, timer_id=op.get('timer_id')),
+    'pause': lambda room_id, op, changes: _transition(changes, transitions.pause, room_id),
+    'resume': lambda room_id, op, changes: _transition(changes, transitions.resume, room_id),
+    'skip': lambda room_id, op, changes: _transition(changes, transitions.skip, room_id, timer_id=op.get('timer_id')),
+    'create': lambda room_id, op, changes: create_timer(room_id, op, changes),
+    'update': lambda room_id, op, changes: update_timer(room_id, op.get('timer_id'), op, changes),
+    'delete': lambda room_id, op, changes: delete_timer(room_id, op.get('timer_id'), changes),
+    'reorder': lambda room_id, op, changes: reorder_timers(room_id, op.get('timer_ids'), changes),
+    'move': lambda room_id, op, changes: move_timer(
+        room_id, op.get('timer_id'), op.get('after_id'), op.get('before_id'), changes
+    ),
+}
+
+
+def apply_operations(room_id, operations):
+    """
+    操作のリストを順に1つのトランザクションで実行（1つでも失敗したら全て取り消す）
+
+    配信はしない。戻り値の Changes をコミット後に publish() する。
+
+    Args:
+        operations: [{"op": "start" | "pause" | ... , ...操作ごとのパラメータ}, ...]
+
+    Returns:
+        Changes: 全操作の変更
+
+    Raises:
+        ServiceError: operations の形式が不正
+        OperationError: 途中の操作が失敗した（全操作を取り消し済み）
+    """
+    if not operations or not isinstance(operations, list):
+        raise ServiceError('operationsは配列で指定してください。')
+    if len(operations) > MAX_OPERATIONS:
+        raise ServiceError(f'一度に実行できる操作は{MAX_OPERATIONS}件までです。')
+
+    changes = Changes()
+    # イベントは全操作分をまとめて書き込む
+    with transaction.atomic(), journal.buffered():
+        for index, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
+            handler = OPERATIONS.get(op)
+            try:
+                if handler is None:
+                    raise ServiceError(f'不明な操作です: {op}')
+                handler(room_id, operation, changes)
+            except ServiceError as e:
+                raise OperationError(index, op, e)
+
+    logger.info(f'一括操作: {[operation["op"] for operation in operations]}')
+    return changes
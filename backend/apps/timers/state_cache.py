@@ -0,0 +1,198 @@
+"""
+TimerState のライトスルーキャッシュ
+
+TimerState.load(room_id) はtick・REST・WebSocket接続・通知チェックのたびに呼ばれるため、
+現在・次のタイマーと担当者まで読み込んだ状態をRedisに保持し、読み取りではSQLを発行しない。
+
+- 書き込み: TimerState.save() がDB保存後（コミット後）にRedisへ書き込む
+- 読み取り: Redisのバージョンだけを確認し、プロセス内のコピーと同じならそれを使う
+- キャッシュがない・壊れている場合はDBから作り直す
+- 古い書き込みが新しい書き込みを上書きしないよう、updated_at が新しい場合のみ更新する
+- DBから作り直した状態は、DBを読む前のバージョンから変わっていない（その間に書き込み・
+  破棄がなかった）場合のみ書き込む（Timerの変更前に読んだ状態で破棄後のキャッシュを作らない）
+- バージョンはキーが消える（Redisの再起動・FLUSH・退避）と1からやり直すため、キーを
+  作るときに1回だけ書く世代（generation。ランダムな値）と組で比較する（同じ番号の
+  古いコピーを使い続けない）。ペイロードキャッシュ（payloads.py）のキーにも含める
+- キャッシュはルームごと
+"""
+from django.conf import settings
+from django.db import transaction
+from .redis_client import get_redis, redis_key
+import pickle
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def state_cache_key(room_id):
+    return redis_key('state', 'cache', room_id)
+
+
+TIMER_RELATIONS = ('current_timer', 'next_timer')
+
+# updated_at が既存より古い書き込みは捨て、受け付けた場合はバージョンを進める
+# ARGV[3] はキーを作る場合の世代。ARGV[4]（DBから作り直した場合の、読む前のバージョン。
+# キーがなければ空）を指定した場合はバージョンが変わっていれば捨てる
+STORE_SCRIPT = """
+if ARGV[4] and (redis.call('HGET', KEYS[1], 'version') or '') ~= ARGV[4] then
+    return 0
+end
+local current = redis.call('HGET', KEYS[1], 'updated_at')
+if current and tonumber(current) > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSETNX', KEYS[1], 'generation', ARGV[3])
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HSET', KEYS[1], 'updated_at', ARGV[1], 'data', ARGV[2])
+return version
+"""
+
+_store_script = None
+
+# プロセス内のコピー: ルームID → ((version, generation), data)。Redisのバージョン・世代と
+# 一致する間だけ使う（スレッド間で組がずれないよう、タプルごと置き換える）
+_local_copies = {}
+
+
+def is_enabled():
+    return settings.TIMER_STATE_CACHE
+
+
+def new_generation():
+    return uuid.uuid4().hex
+
+
+def ensure_generation(client, room_id):
+    """
+    ルームの世代を取得（キーが消えていれば新しい世代を書く）
+
+    Returns:
+        bytes: 世代
+    """
+    key = state_cache_key(room_id)
+    client.hsetnx(key, 'generation', new_generation())
+    return client.hget(key, 'generation')
+
+
+def rotate_generation(room_id):
+    """
+    世代を作り直す（リストのバージョンのキーが作り直された場合など。全てのコピーを無効にする）
+    """
+    try:
+        get_redis().hset(state_cache_key(room_id), 'generation', new_generation())
+    except Exception as e:
+        logger.warning(f'TimerStateキャッシュの世代更新失敗: {e}')
+
+
+def _with_relations(timer_state):
+    """現在・次のタイマーと担当者が読み込まれていなければ読み込む"""
+    from .models import Timer, MEMBER_RELATIONS
+
+    for relation in TIMER_RELATIONS:
+        timer = getattr(timer_state, relation)
+        if timer is not None and not all(
+            Timer._meta.get_field(name).is_cached(timer) for name in MEMBER_RELATIONS
+        ):
+            setattr(timer_state, relation, Timer.objects.with_members().get(pk=timer.pk))
+    return timer_state
+
+
+def load_from_db(room_id):
+    """ルームのTimerStateを現在・次のタイマーと担当者込みで1クエリで取得"""
+    from .models import TimerState, MEMBER_RELATIONS
+
+    timer_state, _ = TimerState.objects.select_related(*[
+        f'{relation}__{name}' for relation in TIMER_RELATIONS for name in MEMBER_RELATIONS
+    ]).get_or_create(room_id=room_id)
+    return timer_state
+
+
+def load(room_id):
+    """キャッシュからルームのTimerStateを取得（なければDBから作り直す）"""
+    if not is_enabled():
+        return load_from_db(room_id)
+
+    key = state_cache_key(room_id)
+    try:
+        client = get_redis()
+        version, generation = client.hmget(key, ['version', 'generation'])
+
+        local_version, local_data = _local_copies.get(room_id, (None, None))
+        if version is not None and generation is not None and (version, generation) == local_version:
+            return pickle.loads(local_data)
+
+        version, generation, data = client.hmget(key, ['version', 'generation', 'data'])
+        if version is not None and data is not None:
+            if generation is not None:
+                _local_copies[room_id] = ((version, generation), data)
+            return pickle.loads(data)
+    except Exception as e:
+        logger.warning(f'TimerStateキャッシュ読み込み失敗（DBから取得）: {e}')
+        return load_from_db(room_id)
+
+    # DBを読む前のバージョンを条件に書き込む（読んだ後に破棄されていれば捨てる）
+    timer_state = load_from_db(room_id)
+    _write(room_id, timer_state.updated_at.timestamp(), pickle.dumps(timer_state), version=version or b'')
+    return timer_state
+
+
+def store(timer_state):
+    """保存済みのTimerStateをキャッシュに書き込む（トランザクション内ならコミット後）"""
+    if not is_enabled():
+        return
+
+    try:
+        data = pickle.dumps(_with_relations(timer_state))
+    except Exception as e:
+        logger.warning(f'TimerStateキャッシュ書き込み失敗: {e}')
+        invalidate(timer_state.room_id)
+        return
+
+    room_id = timer_state.room_id
+    updated_at = timer_state.updated_at.timestamp()
+    transaction.on_commit(lambda: _write(room_id, updated_at, data))
+
+
+def invalidate(room_id):
+    """キャッシュを破棄（Timerの変更で現在のタイマーの内容が変わった場合など）"""
+    if not is_enabled():
+        return
+
+    key = state_cache_key(room_id)
+
+    def _invalidate():
+        try:
+            # バージョンは進めたまま残す（他プロセスのコピーと、破棄前に読み始めた
+            # 作り直しの書き込みを確実に無効にするため）。updated_at も古い書き込みを
+            # 捨てるために残す
+            pipeline = get_redis().pipeline()
+            pipeline.hsetnx(key, 'generation', new_generation())
+            pipeline.hincrby(key, 'version', 1)
+            pipeline.hdel(key, 'data')
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f'TimerStateキャッシュ破棄失敗: {e}')
+
+    transaction.on_commit(_invalidate)
+
+
+def _write(room_id, updated_at, data, version=None):
+    """
+    キャッシュに書き込む
+
+    Args:
+        version: DBから作り直した場合、DBを読む前のRedisのバージョン（キーがなければ b''）。
+            書き込み時点のバージョンと異なれば書き込まない
+    """
+    global _store_script
+
+    args = [updated_at, data, new_generation()]
+    if version is not None:
+        args.append(version)
+    try:
+        if _store_script is None:
+            _store_script = get_redis().register_script(STORE_SCRIPT)
+        _store_script(keys=[state_cache_key(room_id)], args=args)
+    except Exception as e:
+        logger.warning(f'TimerStateキャッシュ書き込み失敗: {e}')
@@ -1,7 +1,8 @@
 from celery import shared_task
 from django.utils import timezone
-from .models import TimerState, Timer
-from .utils import broadcast_timer_state, broadcast_timer_list
+from .models import TimerState, DEFAULT_ROOM_ID
+from .scheduler import get_deadline, next_tick_at
+from .tick import run_tick, run_room_ticks
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,105 +11,79 @@ logger = logging.getLogger(__name__)
 @shared_task
 def update_timer_state():
     """
-    タイマー状態を更新し、WebSocketで配信する
-    Celery Beatで1秒ごとに実行される
+    全ルームのtickパイプライン（完了チェック→配信→LINE通知）を1回実行する
+    Celery Beatで1秒ごとに実行される（beatモード）
     """
     try:
-        timer_state = TimerState.load()
+        run_room_ticks()
+    except Exception as e:
+        logger.error(f'update_timer_state error: {e}', exc_info=True)
+
+
+@shared_task
+def complete_timer_at_deadline(token, room_id=DEFAULT_ROOM_ID):
+    """
+    完了予定時刻に1回だけ実行される完了タスク（deadlineモード）
 
-        # タイマーが実行中でない場合は何もしない
-        if not timer_state.is_running:
+    Args:
+        token: 予約時の TimerState.schedule_token（状態が変わっていれば無視）
+        room_id: ルームID
+    """
+    try:
+        timer_state = TimerState.load(room_id)
+
+        # 予約後に一時停止・スキップ等があった場合は何もしない
+        if timer_state.schedule_token != token:
+            logger.debug('完了タスク: トークン不一致のためスキップ')
             return
 
-        # 現在のタイマーがない場合は何もしない
-        if not timer_state.current_timer:
+        deadline = get_deadline(timer_state)
+        if not deadline:
             return
 
-        # 一時停止中の場合はWebSocket配信のみ（タイマー完了チェックはしない）
-        if timer_state.is_paused:
-            logger.debug(f'タイマー一時停止中: {timer_state.current_timer.band_name}')
-            broadcast_timer_state()
+        # ワーカーの時計ずれ等で早く届いた場合は再予約
+        if timezone.now() < deadline:
+            complete_timer_at_deadline.apply_async(args=[token, room_id], eta=deadline, task_id=token)
             return
 
-        # 経過時間を計算
-        elapsed = (timezone.now() - timer_state.started_at).total_seconds()
-        total_seconds = timer_state.current_timer.minutes * 60
-        remaining = total_seconds - elapsed
+        # 完了→配信→終了通知までtickパイプラインで実行
+        run_tick(room_id)
 
-        # ログ出力（デバッグ用）
-        logger.debug(
-            f'タイマー更新: {timer_state.current_timer.band_name} '
-            f'経過={int(elapsed)}秒 残り={int(remaining)}秒'
-        )
+    except Exception as e:
+        logger.error(f'complete_timer_at_deadline error: {e}', exc_info=True)
 
-        # WebSocketで配信
-        broadcast_timer_state()
 
-        # タイマー完了チェック（0:00になった？）
-        if remaining <= 0:
-            logger.info(f'タイマー完了: {timer_state.current_timer.band_name}')
-            complete_current_timer(timer_state)
+@shared_task
+def tick_running_timer(token, room_id=DEFAULT_ROOM_ID):
+    """
+    実行中のみ1秒ごとにタイマー状態の配信とLINE通知チェックを行う（deadlineモード）
+
+    次の秒境界に自分自身を再予約する。トークンが変わった時点で停止するため、
+    アイドル時はDBアクセスが発生しない。
+    """
+    try:
+        timer_state = TimerState.load(room_id)
+
+        if timer_state.schedule_token != token or not timer_state.is_running:
+            return
+
+        # 完了は complete_timer_at_deadline が担当するため、配信と通知のみ
+        run_tick(room_id, check_completion=False)
+        tick_running_timer.apply_async(args=[token, room_id], eta=next_tick_at())
 
     except Exception as e:
-        logger.error(f'update_timer_state error: {e}', exc_info=True)
+        logger.error(f'tick_running_timer error: {e}', exc_info=True)
 
 
-def complete_current_timer(timer_state):
+@shared_task
+def run_notifications(room_id=DEFAULT_ROOM_ID):
     """
-    現在のタイマーを完了し、次のタイマーを自動開始
+    LINE通知のステージだけを1回実行する（deadlineモード）
 
-    Args:
-        timer_state: TimerState インスタンス
+    スキップ等で実行が終わると配信タスクが止まるため、リハーサル終了通知は
+    scheduler.dispatch がこのタスクを予約して評価する。
     """
     try:
-        current_timer = timer_state.current_timer
-
-        # タイマーの経過時間を計算
-        timer_elapsed = int((timezone.now() - timer_state.started_at).total_seconds())
-
-        # actual_seconds = タイマー経過時間 + 累積一時停止時間
-        actual_seconds = timer_elapsed + timer_state.total_paused_seconds
-
-        # 現在のタイマーを完了マーク
-        current_timer.actual_seconds = actual_seconds
-        current_timer.completed_at = timezone.now()
-        current_timer.save()
-
-        logger.info(f'タイマー完了: {current_timer.band_name} ({actual_seconds}秒)')
-
-        # 次の未完了タイマーを取得
-        next_timer = Timer.objects.filter(
-            completed_at__isnull=True
-        ).order_by('order').first()
-
-        if next_timer:
-            # 次のタイマーを自動開始
-            timer_state.current_timer = next_timer
-            timer_state.started_at = timezone.now()
-            timer_state.paused_at = None
-            timer_state.elapsed_seconds = 0
-            timer_state.total_paused_seconds = 0
-            timer_state.is_running = True
-            timer_state.is_paused = False
-            timer_state.save()
-
-            logger.info(f'次のタイマー自動開始: {next_timer.band_name}')
-        else:
-            # すべてのタイマーが完了
-            timer_state.current_timer = None
-            timer_state.started_at = None
-            timer_state.paused_at = None
-            timer_state.elapsed_seconds = 0
-            timer_state.total_paused_seconds = 0
-            timer_state.is_running = False
-            timer_state.is_paused = False
-            timer_state.save()
-
-            logger.info('すべてのタイマーが完了しました')
-
-        # WebSocketで配信（状態とリストの両方）
-        broadcast_timer_state()
-        broadcast_timer_list()
-
+        run_tick(room_id, check_completion=False, broadcast=False)
     except Exception as e:
-        logger.error(f'complete_current_timer error: {e}', exc_info=True)
+        logger.error(f'run_notifications error: {e}', exc_info=True)
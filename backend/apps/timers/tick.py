@@ -0,0 +1,223 @@
+"""
+tick処理（1秒ごとの完了チェック・配信・LINE通知を1本にまとめたパイプライン）
+
+TimerState（キャッシュ。現在・次のタイマー込み）を1回だけ読み込んだスナップショットを
+全ステージで共有する。完了ステージで状態が変わった場合は遷移が返した状態で
+スナップショットを作り直すため、後続ステージは常に完了後の状態を見る（読み直しはしない）。
+
+ステージ:
+  1. completion    - 残り0秒になったタイマーを完了し、次のタイマーを開始
+  2. broadcast     - タイマー状態をWebSocketで配信
+  3. notifications - 5分前通知・リハーサル開始/終了通知
+
+tickはルームごとに実行する（run_room_ticks で全ルーム分）。
+"""
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+from functools import cached_property
+from .models import Room, Timer, TimerState
+from . import transitions
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 1回のtickがこの時間（秒）を超えたら警告
+SLOW_TICK_SECONDS = 0.5
+
+
+class TickSnapshot:
+    """1回のtickで共有するタイマー状態のスナップショット"""
+
+    def __init__(self, timer_state):
+        self.timer_state = timer_state
+        self.now = timezone.now()
+
+    @classmethod
+    def load(cls, room_id):
+        """ルームのTimerStateを現在のタイマー・担当者込みで取得（Redisキャッシュ経由）"""
+        return cls(TimerState.load(room_id))
+
+    @property
+    def room_id(self):
+        return self.timer_state.room_id
+
+    @property
+    def current_timer(self):
+        return self.timer_state.current_timer
+
+    @property
+    def is_ticking(self):
+        """実行中かつ一時停止していないか"""
+        state = self.timer_state
+        return bool(state.is_running and not state.is_paused and state.current_timer and state.started_at)
+
+    @property
+    def remaining_seconds(self):
+        """現在のタイマーの残り時間（秒、小数）"""
+        elapsed = (self.now - self.timer_state.started_at).total_seconds()
+        return self.current_timer.minutes * 60 - elapsed
+
+    @property
+    def next_timer(self):
+        """現在のタイマーの次の未完了タイマー（TimerState.next_timer に保存済み）"""
+        if not self.current_timer:
+            return None
+        return self.timer_state.next_timer
+
+    @cached_property
+    def timer_counts(self):
+        """タイマー総数と未完了数（1クエリ）"""
+        return Timer.objects.filter(room_id=self.room_id).aggregate(
+            total=Count('id'),
+            incomplete=Count('id', filter=Q(completed_at__isnull=True)),
+        )
+
+    @cached_property
+    def sent_notifications(self):
+        """送信済み通知の (timer_id, notification_type) 集合（1クエリ）"""
+        from apps.line_integration.models import LineNotification
+
+        condition = Q(timer__isnull=True)
+        if self.next_timer:
+            condition |= Q(timer=self.next_timer)
+        return set(
+            LineNotification.objects.filter(room_id=self.room_id).filter(condition).values_list(
+                'timer_id', 'notification_type'
+            )
+        )
+
+    def is_notification_sent(self, notification_type, timer=None):
+        return ((timer.id if timer else None), notification_type) in self.sent_notifications
+
+
+def _complete_stage(snapshot, check_completion):
+    """
+    残り0秒なら現在のタイマーを完了して次のタイマーを開始し、配信する
+
+    遷移後の状態（完了しなかった場合は遷移時に読んだ状態）のスナップショットを返す。
+    """
+    if not check_completion or not snapshot.is_ticking:
+        return snapshot, False
+
+    if snapshot.remaining_seconds > 0:
+        return snapshot, False
+
+    try:
+        timer_state, completed_timer = transitions.complete(snapshot.room_id)
+    except Exception as e:
+        logger.error(f'タイマー完了に失敗 (room={snapshot.room_id}): {e}', exc_info=True)
+        return snapshot, False
+
+    if completed_timer is None:
+        # スキップ等が先に適用されていた
+        return TickSnapshot(timer_state), False
+
+    logger.info(f'タイマー完了: {completed_timer.band_name} ({completed_timer.actual_seconds}秒)')
+    if timer_state.current_timer:
+        logger.info(f'次のタイマー自動開始: {timer_state.current_timer.band_name}')
+    else:
+        logger.info('すべてのタイマーが完了しました')
+
+    transitions.publish(snapshot.room_id, timer_state, completed_timer)
+    return TickSnapshot(timer_state), True
+
+
+def _broadcast_stage(snapshot, completed):
+    """
+    実行中なら従来クライアント向けに状態を配信（完了時は完了ステージで配信済み）
+
+    clock=syncのクライアントは状態遷移時の配信だけを受け取り、カウントダウンは
+    クライアント側で描画するため、TIMER_TICK_BROADCAST=False なら配信自体を省略できる。
+    """
+    from .utils import broadcast_timer_state
+
+    if not settings.TIMER_TICK_BROADCAST:
+        return
+
+    if completed or not snapshot.timer_state.is_running or not snapshot.current_timer:
+        return
+
+    broadcast_timer_state(snapshot.room_id, tick=True)
+
+
+def _notification_stage(snapshot):
+    """LINE通知ルールをまとめて評価"""
+    from apps.line_integration.tasks import (
+        process_five_minute_notification,
+        process_rehearsal_start_notification,
+        process_rehearsal_end_notification,
+    )
+
+    if not snapshot.timer_state.line_notifications_enabled:
+        return
+
+    process_rehearsal_start_notification(snapshot)
+    process_five_minute_notification(snapshot)
+    process_rehearsal_end_notification(snapshot)
+
+
+def run_tick(room_id, check_completion=True, broadcast=True):
+    """
+    ルームの1回分のtickを実行
+
+    Args:
+        room_id: ルームID
+        check_completion: 完了ステージを実行するか（deadlineモードの配信tickではFalse）
+        broadcast: 配信ステージを実行するか
+
+    Returns:
+        dict: ステージ名 → 所要時間（ミリ秒）
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    snapshot = TickSnapshot.load(room_id)
+    timings['load'] = (time.perf_counter() - started) * 1000
+
+    stage_started = time.perf_counter()
+    snapshot, completed = _complete_stage(snapshot, check_completion)
+    timings['completion'] = (time.perf_counter() - stage_started) * 1000
+
+    if broadcast:
+        stage_started = time.perf_counter()
+        _broadcast_stage(snapshot, completed)
+        timings['broadcast'] = (time.perf_counter() - stage_started) * 1000
+
+    stage_started = time.perf_counter()
+    _notification_stage(snapshot)
+    timings['notifications'] = (time.perf_counter() - stage_started) * 1000
+
+    timings['total'] = (time.perf_counter() - started) * 1000
+
+    summary = ' '.join(f'{name}={ms:.1f}ms' for name, ms in timings.items())
+    if timings['total'] > SLOW_TICK_SECONDS * 1000:
+        logger.warning(f'tick処理が遅延 (room={room_id}): {summary}')
+    else:
+        logger.debug(f'tick (room={room_id}): {summary}')
+
+    return timings
+
+
+def run_room_ticks(check_completion=True, broadcast=True, should_continue=None):
+    """
+    全ルームのtickを実行（1つのルームでエラーが起きても他のルームは続行）
+
+    Args:
+        should_continue: ルームごとに呼び、False なら残りのルームを実行しない
+            （asgiモードでリーダーロックを失った場合）
+
+    Returns:
+        dict: ルームID → run_tick の所要時間
+    """
+    results = {}
+    for room_id in Room.objects.values_list('id', flat=True):
+        if should_continue is not None and not should_continue():
+            logger.warning(f'tickを中断 (room={room_id} 以降を実行しない)')
+            break
+        try:
+            results[room_id] = run_tick(room_id, check_completion, broadcast)
+        except Exception as e:
+            logger.error(f'tick error (room={room_id}): {e}', exc_info=True)
+    return results
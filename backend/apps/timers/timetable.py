@@ -0,0 +1,205 @@
+"""
+タイムテーブルの一括登録（JSON・CSV）と書き出し
+
+一括登録では全行をまとめて検証し（担当者は全行分を1クエリで取得）、1件でもエラーが
+あれば何も登録せずに全行のエラーを返す。登録は bulk_create で行い、order は最後尾から
+ORDER_STEP 間隔で1回で割り当てる（views.import_timers）。
+
+行の形式（JSONの各要素・CSVの各列）:
+    band_name: バンド名
+    minutes: 予定時間（分）
+    member1, member2, member3: 担当者の名前
+    member1_id, member2_id, member3_id: 担当者のID（名前の代わりに指定可）
+それ以外の列（書き出しで付く position・actual_seconds 等）は無視するため、書き出した
+CSVをそのまま別のルームに登録できる。
+"""
+import csv
+import io
+from django.db.models import Q
+from apps.members.models import Member
+from .json_codec import dumps
+from .models import Timer
+
+# 一括登録できる行数の上限
+MAX_IMPORT_ROWS = 1000
+
+MEMBER_FIELDS = ('member1', 'member2', 'member3')
+
+# 書き出す列（先頭の5列は一括登録の列と同じ）
+EXPORT_COLUMNS = (
+    'band_name', 'minutes', 'member1', 'member2', 'member3',
+    'position', 'actual_seconds', 'paused_seconds', 'time_difference', 'completed_at',
+)
+
+
+class TimetableError(ValueError):
+    """一括登録の入力が不正（行ごとのエラーを errors に持つ）"""
+
+    def __init__(self, detail, errors=()):
+        super().__init__(detail)
+        self.detail = detail
+        self.errors = list(errors)
+
+
+def parse_csv(content):
+    """
+    CSVを行（dict）のリストに変換
+
+    Args:
+        content: CSVのバイト列または文字列（UTF-8、BOM付きも可）
+    """
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise TimetableError('CSVはUTF-8で指定してください。')
+    reader = csv.DictReader(io.StringIO(content.lstrip('\ufeff')))
+    if not reader.fieldnames or 'band_name' not in reader.fieldnames:
+        raise TimetableError('CSVの1行目に列名（band_name, minutes, member1, member2, member3）を指定してください。')
+    return [{key.strip(): (value or '').strip() for key, value in row.items() if key} for row in reader]
+
+
+def _member_refs(row):
+    """行の担当者指定（('id', ID) または ('name', 名前)）のリスト"""
+    refs = []
+    for field in MEMBER_FIELDS:
+        member_id = row.get(f'{field}_id')
+        if member_id not in (None, ''):
+            try:
+                refs.append(('id', int(member_id)))
+            except (TypeError, ValueError):
+                refs.append(None)
+        else:
+            name = str(row.get(field) or '').strip()
+            refs.append(('name', name) if name else None)
+    return refs
+
+
+def _row_error(row, refs):
+    """担当者の検索前に判定できる行のエラー"""
+    band_name = str(row.get('band_name') or '').strip()
+    if not band_name:
+        return 'バンド名は必須です。'
+    if len(band_name) > Timer._meta.get_field('band_name').max_length:
+        return 'バンド名が長すぎます。'
+    try:
+        minutes = int(row.get('minutes'))
+    except (TypeError, ValueError):
+        minutes = 0
+    if minutes <= 0:
+        return '予定時間は1分以上で指定してください。'
+    if not all(refs):
+        return '担当者3名を全て指定してください。'
+    if len(set(refs)) != 3:
+        return '同じメンバーを複数回選択することはできません。'
+    return None
+
+
+def validate_rows(rows):
+    """
+    全行を検証して、登録するタイマーの値に変換
+
+    担当者は全行分をまとめて1クエリで取得する。
+
+    Args:
+        rows: 行（dict）のリスト
+
+    Returns:
+        list: [{'band_name', 'minutes', 'member1', 'member2', 'member3'}, ...]（Memberはインスタンス）
+
+    Raises:
+        TimetableError: 行が空・上限超過・エラーのある行がある場合
+    """
+    if not rows:
+        raise TimetableError('登録するタイマーがありません。')
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise TimetableError(f'一度に登録できるタイマーは{MAX_IMPORT_ROWS}件までです。')
+
+    errors = []
+    parsed = []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({'row': number, 'detail': '行の形式が不正です。'})
+            parsed.append(None)
+            continue
+        refs = _member_refs(row)
+        error = _row_error(row, refs)
+        if error:
+            errors.append({'row': number, 'detail': error})
+            parsed.append(None)
+        else:
+            parsed.append((row, refs))
+
+    # 担当者をまとめて取得（1クエリ）
+    refs = [ref for item in parsed if item for ref in item[1]]
+    ids = {value for kind, value in refs if kind == 'id'}
+    names = {value for kind, value in refs if kind == 'name'}
+    members = {}
+    if refs:
+        for member in Member.objects.filter(Q(id__in=ids) | Q(name__in=names), is_active=True):
+            members[('id', member.id)] = member
+            members[('name', member.name)] = member
+
+    validated = []
+    for number, item in enumerate(parsed, start=1):
+        if item is None:
+            continue
+        row, row_refs = item
+        row_members = [members.get(ref) for ref in row_refs]
+        if not all(row_members):
+            errors.append({'row': number, 'detail': '指定されたメンバーが見つかりません。'})
+            continue
+        if len({member.id for member in row_members}) != 3:
+            errors.append({'row': number, 'detail': '同じメンバーを複数回選択することはできません。'})
+            continue
+        validated.append({
+            'band_name': str(row['band_name']).strip(),
+            'minutes': int(row['minutes']),
+            **dict(zip(MEMBER_FIELDS, row_members)),
+        })
+
+    if errors:
+        errors.sort(key=lambda error: error['row'])
+        raise TimetableError(f'{len(errors)}行にエラーがあります。', errors)
+    return validated
+
+
+def export_rows(room_id):
+    """ルームのタイマーを書き出す行（dict）を order 順に返すジェネレーター"""
+    timers = Timer.objects.with_members().filter(room_id=room_id).order_by('order')
+    for position, timer in enumerate(timers.iterator(chunk_size=500), start=1):
+        yield {
+            'band_name': timer.band_name,
+            'minutes': timer.minutes,
+            'member1': timer.member1.name,
+            'member2': timer.member2.name,
+            'member3': timer.member3.name,
+            'position': position,
+            'actual_seconds': timer.actual_seconds,
+            'paused_seconds': timer.paused_seconds,
+            'time_difference': timer.time_difference if timer.actual_seconds is not None else None,
+            'completed_at': timer.completed_at.isoformat() if timer.completed_at else None,
+        }
+
+
+class _Echo:
+    """csv.writer の書き込み先（書き込んだ文字列をそのまま返す）"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(room_id):
+    """タイムテーブルのCSVを1行ずつ返す（Excelで開けるようBOM付き）"""
+    writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_COLUMNS)
+    yield '\ufeff' + writer.writeheader()
+    for row in export_rows(room_id):
+        yield writer.writerow(row)
+
+
+def iter_json(room_id):
+    """タイムテーブルのJSON（{"timers": [...]}）を1行ずつ返す"""
+    yield b'{"timers":['
+    for index, row in enumerate(export_rows(room_id)):
+        yield (b',' if index else b'') + dumps(row)
+    yield b']}'
@@ -0,0 +1,517 @@
+"""
+タイマーの状態機械（開始・一時停止・再開・スキップ・完了）
+
+状態と遷移:
+
+    待機（current_timer あり・停止中） --start-->  実行中
+    実行中                           --pause-->  一時停止中 --resume--> 実行中
+    実行中・一時停止中                --skip--->  実行中（次のタイマー） / 終了（次がない）
+    実行中（残り0秒）                 --complete->  同上（tick・完了タスク）
+    一時停止中・終了                  --start-->  実行中（指定したタイマー・最初の未完了タイマー）
+
+スキップと完了は同じ「現在のタイマーを完了して次へ進む」処理（_advance）を使う。
+
+各遷移は TimerState を読んだ時点の version を条件にした1つの UPDATE 文
+（UPDATE ... WHERE room_id = ? AND version = ?）で適用する。他の遷移・保存が先に
+version を進めていれば更新件数が0になるため、DBから読み直して遷移を計算し直す
+（楽観的ロック）。行ロックは UPDATE 文の間しか保持しないため、複数の端末から同時に
+操作しても待ち合わせが起きず、同じタイマーを2回完了することも一時停止を失うこともない。
+
+1回の遷移で発行する文は固定:
+  - 開始・完了・スキップ: 次に実行するタイマーと、その次のタイマーを1クエリで取得
+  - 状態の UPDATE（deadlineモードの予約トークンも同じ文で更新）
+  - 完了・スキップのみ: 完了したタイマーの UPDATE（状態と同じトランザクション）
+version が一致した場合、UPDATE 後の状態は読んだ状態に変更を適用したものと等しいため、
+読み直さずにその場で組み立てて返す（Redisキャッシュにも書き込む）。配信（publish）にも
+そのまま渡すため、遷移後に状態をDB・キャッシュから読み直すことはない。
+
+タイマーの作成・一括登録・削除・並べ替え・設定変更・全削除・予約し直しによる状態の書き込みも
+同じ apply_transition で適用する（attach, release, refresh_next, set_line_notifications, reset,
+renew_schedule。管理コマンドでの修正・復元は set_fields）。読んだ状態をそのまま保存すると、
+その間に適用された遷移を古い値で上書きしてしまう（完了済みのタイマーが現在のタイマーに
+戻る等）ため、TimerState.save() はリクエストの処理では使わない（save() も version を
+進めるため、管理画面等での保存とも競合を検出できる）。
+適用した遷移は同じトランザクションでイベントとして記録する（journal.py）。
+
+一括操作（services.apply_operations）のトランザクション内で呼ばれた場合は、キャッシュが
+コミット前の変更を反映していないため状態をDBから読み、完了タスクの予約し直しも
+コミット後に行う（取り消された場合に実行中の予約を消さないように）。
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
+from .models import Timer, TimerState
+from .scheduler import is_deadline_mode, new_schedule_token, dispatch
+from .state_cache import load_from_db, store
+from . import journal
+import copy
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 競合時に遷移を計算し直す回数の上限
+MAX_ATTEMPTS = 5
+
+
+class TransitionError(Exception):
+    """現在の状態ではその遷移ができない"""
+
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class TransitionConflict(Exception):
+    """再試行しても他の更新と競合し続けた"""
+
+
+def _stopped_fields():
+    """実行中でない状態（全タイマー完了）"""
+    return {
+        'current_timer': None,
+        'next_timer': None,
+        'started_at': None,
+        'paused_at': None,
+        'elapsed_seconds': 0,
+        'total_paused_seconds': 0,
+        'is_running': False,
+        'is_paused': False,
+    }
+
+
+def _running_fields(timer, next_timer, now):
+    """timer を now から開始した状態"""
+    return {
+        'current_timer': timer,
+        'next_timer': next_timer,
+        'started_at': now,
+        'paused_at': None,
+        'elapsed_seconds': 0,
+        'total_paused_seconds': 0,
+        'is_running': True,
+        'is_paused': False,
+    }
+
+
+def _first_incomplete(room_id, exclude_id=None):
+    """最初の未完了タイマーとその次の未完了タイマー（1クエリ）"""
+    timers = Timer.objects.with_members().filter(room_id=room_id, completed_at__isnull=True)
+    if exclude_id:
+        timers = timers.exclude(id=exclude_id)
+    timers = list(timers.order_by('order')[:2])
+    return (timers + [None, None])[:2]
+
+
+def _timer_and_next(room_id, timer_id):
+    """
+    指定したタイマーとその次の未完了タイマー（1クエリ）
+
+    Raises:
+        Timer.DoesNotExist: タイマーがルームにない場合
+    """
+    timers = list(Timer.objects.with_members().filter(room_id=room_id).filter(
+        Q(id=timer_id) | Q(
+            completed_at__isnull=True,
+            order__gt=Timer.objects.filter(id=timer_id).values('order')[:1],
+        )
+    ).order_by('order')[:2])
+    if not timers or timers[0].id != int(timer_id):
+        raise Timer.DoesNotExist
+    return timers[0], (timers[1] if len(timers) > 1 else None)
+
+
+def apply_transition(room_id, kind, transition):
+    """
+    遷移を version を条件にした UPDATE で適用（競合したら読み直して再試行）
+
+    deadlineモードでは予約トークンも同じ UPDATE で更新し、コミット後に完了タスクを予約し直す。
+    呼び出し元のトランザクション内ではキャッシュではなくDBから状態を読む。
+
+    Args:
+        room_id: ルームID
+        kind: イベントの種類（TimerEvent.KIND_CHOICES）
+        transition: transition(timer_state, now) -> (変更するフィールドの辞書, 適用後に呼ぶ関数 or None)
+            変更がなければ (None, None)。適用後に呼ぶ関数は UPDATE と同じトランザクション内で
+            呼ばれる（完了したタイマーの更新）。戻り値の辞書はイベントの詳細として記録する
+
+    Returns:
+        TimerState: 遷移後の状態（変更なしの場合は読んだ状態）
+
+    Raises:
+        TransitionError: 遷移できない状態
+        TransitionConflict: MAX_ATTEMPTS 回競合した
+    """
+    if transaction.get_connection().in_atomic_block:
+        timer_state = load_from_db(room_id)
+    else:
+        timer_state = TimerState.load(room_id)
+    for attempt in range(MAX_ATTEMPTS):
+        now = timezone.now()
+        changes, on_applied = transition(timer_state, now)
+        if not changes:
+            return timer_state
+
+        new_state = copy.copy(timer_state)
+        for name, value in changes.items():
+            setattr(new_state, name, value)
+        if is_deadline_mode():
+            changes['schedule_token'] = new_state.schedule_token = new_schedule_token(new_state)
+        new_state.version = timer_state.version + 1
+        new_state.updated_at = now
+
+        with transaction.atomic():
+            updated = TimerState.objects.filter(room_id=room_id, version=timer_state.version).update(
+                version=new_state.version, updated_at=now, **changes
+            )
+            if updated:
+                data = on_applied() if on_applied else None
+                store(new_state)
+                # 開始は開始したタイマー、それ以外は遷移前の現在のタイマーの操作として記録
+                timer_id = new_state.current_timer_id if kind == 'start' else timer_state.current_timer_id
+                journal.record(
+                    room_id, kind, timer_id=timer_id, data=data, timer_state=new_state, changes=changes
+                )
+
+        if updated:
+            if is_deadline_mode():
+                old_token = timer_state.schedule_token
+                # 完了はtickパイプラインが続けて通知のステージを実行する
+                notify = kind != 'complete'
+                transaction.on_commit(lambda: dispatch(room_id, new_state, old_token, notify))
+            return new_state
+
+        # キャッシュが古い・他の遷移が先に適用された: DBから読み直して計算し直す
+        logger.debug(f'状態遷移の競合 (room={room_id}, version={timer_state.version}, attempt={attempt + 1})')
+        timer_state = load_from_db(room_id)
+
+    raise TransitionConflict(f'状態遷移が{MAX_ATTEMPTS}回競合しました (room={room_id})')
+
+
+def start(room_id, timer_id=None):
+    """
+    タイマーを開始（timer_id 省略時は最初の未完了タイマー）
+
+    Returns:
+        TimerState: 遷移後の状態
+
+    Raises:
+        TransitionError, TransitionConflict
+        Timer.DoesNotExist: timer_id のタイマーがルームにない場合
+    """
+    def transition(timer_state, now):
+        if timer_state.is_running and not timer_state.is_paused:
+            raise TransitionError('既にタイマーが実行中です。')
+
+        if timer_id:
+            timer, next_timer = _timer_and_next(room_id, timer_id)
+        else:
+            timer, next_timer = _first_incomplete(room_id)
+            if not timer:
+                raise TransitionError('タイマーがありません。')
+        return _running_fields(timer, next_timer, now), None
+
+    return apply_transition(room_id, 'start', transition)
+
+
+def pause(room_id):
+    """実行中のタイマーを一時停止"""
+    def transition(timer_state, now):
+        if not timer_state.is_running:
+            raise TransitionError('タイマーが実行中ではありません。')
+        if timer_state.is_paused:
+            raise TransitionError('タイマーは既に一時停止中です。')
+
+        # 表示される残り時間を基準に経過時間を保存（表示の一貫性を保つ）
+        elapsed = (now - timer_state.started_at).total_seconds()
+        total_seconds = timer_state.current_timer.minutes * 60
+        display_remaining = max(0, math.ceil(total_seconds - elapsed))
+        return {
+            'elapsed_seconds': total_seconds - display_remaining,
+            'paused_at': now,
+            'is_paused': True,
+        }, None
+
+    return apply_transition(room_id, 'pause', transition)
+
+
+def resume(room_id):
+    """一時停止中のタイマーを再開"""
+    def transition(timer_state, now):
+        if not timer_state.is_running:
+            raise TransitionError('タイマーが実行中ではありません。')
+        if not timer_state.is_paused:
+            raise TransitionError('タイマーは一時停止中ではありません。')
+
+        # 一時停止していた時間を累積し、started_at を経過時間の分だけ前にずらす
+        paused_duration = int((now - timer_state.paused_at).total_seconds())
+        return {
+            'total_paused_seconds': timer_state.total_paused_seconds + paused_duration,
+            'started_at': now - timedelta(seconds=timer_state.elapsed_seconds),
+            'paused_at': None,
+            'is_paused': False,
+        }, None
+
+    return apply_transition(room_id, 'resume', transition)
+
+
+def _actual_seconds(timer_state, now):
+    """現在のタイマーの実際にかかった時間（経過時間 + 累積一時停止時間）"""
+    if timer_state.is_paused:
+        # 現在の一時停止時間も加算
+        current_pause = int((now - timer_state.paused_at).total_seconds())
+        return timer_state.elapsed_seconds + timer_state.total_paused_seconds + current_pause
+    if timer_state.is_running:
+        return int((now - timer_state.started_at).total_seconds()) + timer_state.total_paused_seconds
+    return 0
+
+
+def _advance(room_id, timer_state, now, completed):
+    """
+    現在のタイマーを完了し、次の未完了タイマーを開始する変更（スキップ・完了で共通）
+
+    Args:
+        completed: 完了したタイマーを受け取るリスト（遷移が適用されたら追加する）
+    """
+    current_timer = copy.copy(timer_state.current_timer)
+    current_timer.actual_seconds = _actual_seconds(timer_state, now)
+    current_timer.completed_at = now
+    current_timer.paused_seconds = timer_state.total_paused_seconds
+    if timer_state.is_paused:
+        current_timer.paused_seconds += int((now - timer_state.paused_at).total_seconds())
+
+    next_timer, following_timer = _first_incomplete(room_id, exclude_id=current_timer.id)
+    changes = _running_fields(next_timer, following_timer, now) if next_timer else _stopped_fields()
+    # 押し巻き合計（version が一致したときだけ適用されるため、読んだ値に加算してよい）
+    changes['completed_time_difference'] = timer_state.completed_time_difference + current_timer.time_difference
+
+    def on_applied():
+        Timer.objects.filter(id=current_timer.id).update(
+            actual_seconds=current_timer.actual_seconds,
+            paused_seconds=current_timer.paused_seconds,
+            completed_at=current_timer.completed_at,
+        )
+        completed.append(current_timer)
+        return {'actual_seconds': current_timer.actual_seconds, 'paused_seconds': current_timer.paused_seconds}
+
+    return changes, on_applied
+
+
+def skip(room_id, timer_id=None):
+    """
+    現在のタイマーをスキップ（完了）して次のタイマーを開始
+
+    Args:
+        timer_id: スキップするタイマーのID（指定時、現在のタイマーと異なれば TransitionError。
+            二重送信で次のタイマーまでスキップしないように）
+
+    Returns:
+        tuple: (遷移後の状態, 完了したTimer)
+
+    Raises:
+        TransitionError, TransitionConflict
+    """
+    completed = []
+
+    def transition(timer_state, now):
+        if not timer_state.current_timer:
+            raise TransitionError('現在実行中のタイマーがありません。')
+        if timer_id and timer_state.current_timer.id != int(timer_id):
+            raise TransitionError('指定されたタイマーは既に完了しています。')
+        return _advance(room_id, timer_state, now, completed)
+
+    timer_state = apply_transition(room_id, 'skip', transition)
+    return timer_state, completed[0]
+
+
+def complete(room_id):
+    """
+    残り0秒になった現在のタイマーを完了して次のタイマーを開始（tick・完了タスク）
+
+    読み直した状態で残り時間が残っていれば（スキップ等が先に適用された）何もしない。
+
+    Returns:
+        tuple: (遷移後の状態, 完了したTimer or None)
+    """
+    completed = []
+
+    def transition(timer_state, now):
+        if not (timer_state.is_running and not timer_state.is_paused
+                and timer_state.current_timer and timer_state.started_at):
+            return None, None
+        remaining = timer_state.current_timer.minutes * 60 - (now - timer_state.started_at).total_seconds()
+        if remaining > 0:
+            return None, None
+        return _advance(room_id, timer_state, now, completed)
+
+    timer_state = apply_transition(room_id, 'complete', transition)
+    return timer_state, (completed[0] if completed else None)
+
+
+def _apply_changes(room_id, kind, compute):
+    """
+    compute(timer_state) が返す変更を適用（状態遷移以外の書き込み）
+
+    Returns:
+        tuple: (適用後の状態, 変更したか)
+    """
+    applied = []
+
+    def transition(timer_state, now):
+        changes = compute(timer_state)
+        if not changes:
+            return None, None
+        return changes, lambda: applied.append(True)
+
+    timer_state = apply_transition(room_id, kind, transition)
+    return timer_state, bool(applied)
+
+
+def _next_after(room_id, timer):
+    """timer の次の未完了タイマー"""
+    return Timer.objects.with_members().filter(
+        room_id=room_id, completed_at__isnull=True, order__gt=timer.order
+    ).exclude(id=timer.id).order_by('order').first()
+
+
+def attach(room_id, timer):
+    """
+    作成したタイマーを状態に反映（作成・一括登録）
+
+    現在のタイマーがなければ timer を現在のタイマー（待機中）にし、次のタイマーが
+    なければ次のタイマーを求め直す。
+
+    Returns:
+        tuple: (適用後の状態, 変更したか)
+    """
+    def compute(timer_state):
+        if not timer_state.current_timer:
+            return {'current_timer': timer, 'next_timer': _next_after(room_id, timer)}
+        if not timer_state.next_timer:
+            next_timer = timer_state.find_next_timer()
+            if next_timer:
+                return {'next_timer': next_timer}
+        return None
+
+    return _apply_changes(room_id, 'state', compute)
+
+
+def release(room_id, timer):
+    """
+    削除するタイマーを状態から外す（削除の前に同じトランザクションで呼ぶ）
+
+    現在のタイマー（待機中）なら次の未完了タイマーを現在のタイマーにし、次のタイマーなら
+    その次の未完了タイマーを次のタイマーにする。外してから削除するため、外部キーの
+    SET NULL で状態が version を進めずに（イベントを記録せずに）変わることはない。
+
+    Returns:
+        tuple: (適用後の状態, 変更したか)
+
+    Raises:
+        TransitionError: timer が実行中の場合（確認した後に開始された）
+    """
+    def compute(timer_state):
+        if timer_state.current_timer_id == timer.id:
+            if timer_state.is_running:
+                raise TransitionError('実行中のタイマーは削除できません。')
+            following = list(Timer.objects.with_members().filter(
+                room_id=room_id, completed_at__isnull=True, order__gt=timer.order
+            ).exclude(id=timer.id).order_by('order')[:2])
+            current_timer, next_timer = (following + [None, None])[:2]
+            return {'current_timer': current_timer, 'next_timer': next_timer}
+        if timer_state.next_timer_id == timer.id:
+            return {'next_timer': _next_after(room_id, timer)}
+        return None
+
+    return _apply_changes(room_id, 'state', compute)
+
+
+def refresh_next(room_id):
+    """
+    次のタイマーを求め直す（並べ替え・移動）
+
+    現在のタイマーの order が変わった場合もキャッシュ・配信用の状態を作り直すため、
+    次のタイマーが変わらなくても書き込む（version を進める）。
+
+    Returns:
+        TimerState: 適用後の状態
+    """
+    return _apply_changes(room_id, 'state', lambda timer_state: {'next_timer': timer_state.find_next_timer()})[0]
+
+
+def set_line_notifications(room_id, enabled):
+    """
+    LINE通知の有効・無効を切り替え
+
+    Returns:
+        TimerState: 適用後の状態
+    """
+    def compute(timer_state):
+        if timer_state.line_notifications_enabled == enabled:
+            return None
+        return {'line_notifications_enabled': enabled}
+
+    return _apply_changes(room_id, 'state', compute)[0]
+
+
+def renew_schedule(room_id):
+    """
+    完了タスクを予約し直す（deadlineモード。予約トークンは apply_transition が作り直す）
+
+    Returns:
+        TimerState: 適用後の状態
+    """
+    return _apply_changes(
+        room_id, 'state', lambda timer_state: {'schedule_token': new_schedule_token(timer_state)}
+    )[0]
+
+
+def set_fields(room_id, fields):
+    """
+    フィールドを指定した値にする（管理コマンドでの修正・復元。現在の値と異なるものだけ書き込む）
+
+    Args:
+        fields: {フィールドの attname: 値}
+
+    Returns:
+        tuple: (適用後の状態, 変更したか)
+    """
+    def compute(timer_state):
+        return {name: value for name, value in fields.items() if getattr(timer_state, name) != value}
+
+    return _apply_changes(room_id, 'state', compute)
+
+
+def reset(room_id, clear):
+    """
+    状態を初期化し、同じトランザクションで clear() を呼ぶ（全削除）
+
+    現在・次のタイマーを外してから clear() でタイマーを削除するため、外部キーの
+    SET NULL で状態が version を進めずに変わることはない。
+
+    Args:
+        clear: clear() -> イベントの詳細（dict）。UPDATE の後に1回だけ呼ばれる
+
+    Returns:
+        TimerState: 初期化した状態
+    """
+    def transition(timer_state, now):
+        return {**_stopped_fields(), 'completed_time_difference': 0}, clear
+
+    return apply_transition(room_id, 'reset', transition)
+
+
+def publish(room_id, timer_state, completed_timer=None):
+    """
+    遷移後の状態をWebSocketで配信（遷移が返した状態をそのまま使い、読み直さない）
+
+    Args:
+        timer_state: 遷移後の状態
+        completed_timer: 完了・スキップしたタイマー（リストの差分として配信）
+    """
+    from .utils import broadcast_timer_state, broadcast_timer_changes
+
+    broadcast_timer_state(room_id, timer_state=timer_state)
+    if completed_timer:
+        broadcast_timer_changes(room_id, upserted=[completed_timer])
@@ -7,13 +7,23 @@ urlpatterns = [
     # タイマー一覧
     path('', views.get_timers, name='get_timers'),
 
+    # スケジュール予測
+    path('schedule/', views.get_schedule, name='get_schedule'),
+
+    # WebSocket送信キューのカウンター
+    path('ws-stats/', views.get_websocket_stats, name='get_websocket_stats'),
+
     # タイマーCRUD（MVP Step 3）
     # 注意: 具体的なパスを動的パターン(<int:timer_id>/)より先に配置
     path('create/', views.create_timer, name='create_timer'),
     path('reorder/', views.reorder_timers, name='reorder_timers'),
     path('delete-all/', views.delete_all_timers, name='delete_all_timers'),
+    path('import/', views.import_timers, name='import_timers'),
+    path('export/', views.export_timers, name='export_timers'),
+    path('batch/', views.batch_operations, name='batch_operations'),
     path('<int:timer_id>/', views.update_timer, name='update_timer'),
     path('<int:timer_id>/delete/', views.delete_timer, name='delete_timer'),
+    path('<int:timer_id>/move/', views.move_timer, name='move_timer'),
 
     # タイマー状態
     path('timer-state/', views.get_timer_state, name='get_timer_state'),
@@ -21,4 +31,11 @@ urlpatterns = [
     path('timer-state/pause/', views.pause_timer, name='pause_timer'),
     path('timer-state/resume/', views.resume_timer, name='resume_timer'),
     path('timer-state/skip/', views.skip_timer, name='skip_timer'),
+
+    # イベント（操作・状態遷移の記録）
+    path('events/', views.get_events, name='get_events'),
+
+    # リハーサル記録と押し巻きの集計
+    path('archives/', views.get_archives, name='get_archives'),
+    path('analytics/', views.get_analytics, name='get_analytics'),
 ]
@@ -1,56 +1,256 @@
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from .models import TimerState, Timer
-from .serializers import TimerStateSerializer, TimerSerializer
+from .models import Timer
+from .serializers import TimerSerializer
+from .redis_client import get_redis, redis_key
+from .state_cache import rotate_generation
+from .query_budget import query_budget
+from . import msgpack_protocol
+from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 配信グループの種類（実際のグループ名は room_group() でルームごとに分ける）
+# 全クライアント向け: 状態遷移（開始・一時停止・再開・スキップ・完了・編集）のみ
+TIMER_GROUP = 'timer_updates'
+# 従来クライアント向け: 1秒ごとの状態配信（clock=syncのクライアントは参加しない）
+TICK_GROUP = 'timer_ticks'
+# 従来クライアント向け: 変更のたびにリスト全体を配信
+LIST_GROUP = 'timer_lists'
+# list=deltaのクライアント向け: バージョン付きの差分（upsert/delete/reorder）を配信
+DELTA_GROUP = 'timer_list_deltas'
 
-def broadcast_timer_state():
+
+def room_group(group, room_id, binary=False):
+    """
+    ルームごとのグループ名（クライアントは自分のルームの配信だけを受け取る）
+
+    MessagePackサブプロトコルのクライアントはバイナリフレーム用の別グループに参加する。
+    """
+    if binary:
+        return f'{group}.{room_id}.msgpack'
+    return f'{group}.{room_id}'
+
+
+def list_version_key(room_id):
+    return redis_key('timers', 'list-version', room_id)
+
+
+# イベントログ（再接続時に取りこぼした配信だけを再送するため。ルームごと）
+def event_seq_key(room_id):
+    return redis_key('events', 'seq', room_id)
+
+
+def event_stream_key(room_id):
+    return redis_key('events', 'stream', room_id)
+
+
+# 採番・フレームへのseqの埋め込み・Streamへの追記を原子的に行う（seqがそのままStreamのIDになる）
+APPEND_EVENT_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+local frame = ARGV[4] .. seq .. ARGV[5]
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], seq .. '-0', 'group', ARGV[2], 'type', ARGV[3], 'frame', frame)
+return seq
+"""
+
+_append_event_script = None
+
+
+def get_list_version(room_id):
+    """タイマーリストの現在のバージョン"""
+    return int(get_redis().get(list_version_key(room_id)) or 0)
+
+
+def get_event_seq(room_id):
+    """最後に配信したイベントのシーケンス番号"""
+    return int(get_redis().get(event_seq_key(room_id)) or 0)
+
+
+def get_events_since(room_id, last_seq):
+    """
+    last_seqより後のイベントをイベントログから取得
+
+    Returns:
+        list: (グループの種類, message) のリスト。取りこぼしがなければ空リスト
+              message は配信時と同じ {'type': ..., 'frame': エンコード済みフレーム}
+        None: 既にStreamから削除されている等で再送できない場合（スナップショットが必要）
+    """
+    current_seq = get_event_seq(room_id)
+    if last_seq == current_seq:
+        return []
+    if last_seq > current_seq:
+        # Redisがリセットされた等
+        return None
+
+    entries = get_redis().xrange(event_stream_key(room_id), min=f'{last_seq + 1}-0')
+    if not entries or int(entries[0][0].split(b'-')[0]) != last_seq + 1:
+        return None
+    if any(b'frame' not in fields for _, fields in entries):
+        # フレームを持たない旧形式のイベント
+        return None
+
+    return [
+        (fields[b'group'].decode(), {'type': fields[b'type'].decode(), 'frame': fields[b'frame'].decode()})
+        for _, fields in entries
+    ]
+
+
+def send_event(room_id, group, event_type, payload, journal=True, **fields):
+    """
+    ルームのグループにメッセージを配信
+
+    WebSocketに送るフレームはここで1回だけエンコードし、チャネルレイヤーには
+    エンコード済みの文字列だけを渡す（コンシューマーはそのまま送信する）。
+    購読者数が増えてもエンコードの回数は変わらない。TIMER_MSGPACK_PROTOCOL が有効なら
+    MessagePackのバイナリフレームも1回だけ作り、バイナリ用のグループに配信する。
+
+    Args:
+        room_id: 配信先ルーム
+        group: 配信先グループの種類（TIMER_GROUP など）
+        event_type: チャネルレイヤーのメッセージタイプ（'timer.state.updated' など）。
+                    フレームの type は '.' を '_' にしたもの
+        payload: data にするペイロード（payloads.Payload）
+        journal: イベントログに追記してseqを付与するか（1秒ごとの配信など、
+                 すぐに古くなるものはFalse）
+        **fields: フレームに含めるその他の値（version など）
+    """
+    from .payloads import frame_parts
+
+    global _append_event_script
+
+    message_type = event_type.replace('.', '_')
+    prefix, suffix = frame_parts(message_type, payload, **fields)
+    if journal:
+        if _append_event_script is None:
+            _append_event_script = get_redis().register_script(APPEND_EVENT_SCRIPT)
+        seq = _append_event_script(
+            keys=[event_seq_key(room_id), event_stream_key(room_id)],
+            args=[settings.TIMER_EVENT_STREAM_MAXLEN, group, event_type, prefix, suffix]
+        )
+        frame = f'{prefix}{seq}{suffix}'
+    else:
+        seq = None
+        frame = f'{prefix}null{suffix}'
+
+    # イベントログに残さない配信は次の配信で置き換えてよい（遅いクライアントには最新だけ送る）
+    replaceable = not journal
+    messages = [(room_group(group, room_id), {'type': event_type, 'frame': frame, 'replaceable': replaceable})]
+    if settings.TIMER_MSGPACK_PROTOCOL:
+        binary_frame = msgpack_protocol.encode_frame(message_type, payload.data, seq, **fields)
+        messages.append((
+            room_group(group, room_id, binary=True),
+            {'type': event_type, 'frame': binary_frame, 'replaceable': replaceable}
+        ))
+
+    async_to_sync(_group_send)(messages)
+
+
+async def _group_send(messages):
+    """(グループ名, メッセージ) のリストを順に配信（イベントループへの切り替えを1回にする）"""
+    channel_layer = get_channel_layer()
+    for group_name, message in messages:
+        await channel_layer.group_send(group_name, message)
+
+
+@query_budget(2, 'broadcast:timer-state')
+def broadcast_timer_state(room_id, tick=False, timer_state=None):
     """
     タイマー状態をWebSocketで配信
 
     使用箇所:
-      - views.py (start, pause, resume, skip)
-      - tasks.py (update_timer_state)
+      - transitions.py (publish: start, pause, resume, skip, complete)
+      - views.py (create, import, delete-all)
+      - tick.py (run_tick)
+
+    Args:
+        room_id: 配信するルーム
+        tick: 1秒ごとの定期配信の場合True（従来クライアントのグループにのみ配信）
+        timer_state: 配信する状態（状態遷移が返した状態。省略時はキャッシュから取得）
     """
+    from .payloads import get_timer_state_payload
+
     try:
-        channel_layer = get_channel_layer()
-        timer_state = TimerState.load()
-        serializer = TimerStateSerializer(timer_state)
-
-        async_to_sync(channel_layer.group_send)(
-            'timer_updates',
-            {
-                'type': 'timer.state.updated',
-                'data': serializer.data
-            }
+        send_event(
+            room_id,
+            TICK_GROUP if tick else TIMER_GROUP,
+            'timer.state.updated',
+            get_timer_state_payload(room_id, timer_state),
+            journal=not tick
         )
-        logger.debug('WebSocket配信: timer_state_updated')
+        logger.debug(f'WebSocket配信: timer_state_updated (tick={tick})')
     except Exception as e:
         logger.error(f'broadcast_timer_state error: {e}', exc_info=True)
 
 
-def broadcast_timer_list():
+@query_budget(1, 'broadcast:timer-list')
+def broadcast_timer_list(room_id):
     """
-    タイマーリストをWebSocketで配信
+    タイマーリスト全体をWebSocketで配信（従来クライアント向け）
 
     使用箇所:
-      - views.py (skip)
+      - broadcast_timer_changes
     """
+    from .payloads import get_timer_list_payload
+
     try:
-        channel_layer = get_channel_layer()
-        timers = Timer.objects.all().order_by('order')
-        serializer = TimerSerializer(timers, many=True)
-
-        async_to_sync(channel_layer.group_send)(
-            'timer_updates',
-            {
-                'type': 'timer.list.updated',
-                'data': serializer.data
-            }
-        )
+        send_event(room_id, LIST_GROUP, 'timer.list.updated', get_timer_list_payload(room_id))
         logger.debug('WebSocket配信: timer_list_updated')
     except Exception as e:
         logger.error(f'broadcast_timer_list error: {e}', exc_info=True)
+
+
+# スナップショット + 従来クライアント向けの全体配信（差分は渡されたTimerをそのまま使う）
+@query_budget(2, 'broadcast:timer-changes')
+def broadcast_timer_changes(room_id, upserted=(), deleted=(), reordered=None, reset=False):
+    """
+    タイマーリストの変更をWebSocketで配信
+
+    list=deltaのクライアントには変更分だけをバージョン付きで、従来クライアントには
+    リスト全体を配信する（TIMER_LIST_FULL_BROADCAST=Falseなら全体配信は省略）。
+
+    使用箇所:
+      - views.py (create, update, delete, reorder, move, skip, delete-all)
+      - transitions.py (publish: skip, complete)
+
+    Args:
+        room_id: 変更のあったルーム
+        upserted: 作成・更新されたTimerのリスト
+        deleted: 削除されたタイマーIDのリスト
+        reordered: {タイマーID: 新しいorder} の辞書
+        reset: リスト全体が入れ替わった場合True（差分ではなくスナップショットを配信）
+    """
+    from .payloads import encode_payload
+
+    try:
+        events = []
+
+        if reset:
+            events.append(('timer.list.snapshot', TimerSerializer(
+                Timer.objects.with_members().filter(room_id=room_id).order_by('order'), many=True
+            ).data))
+        else:
+            for timer in upserted:
+                events.append(('timer.upserted', TimerSerializer(timer).data))
+            for timer_id in deleted:
+                events.append(('timer.deleted', {'id': timer_id}))
+            if reordered:
+                events.append(('timers.reordered', [
+                    {'id': timer_id, 'order': order} for timer_id, order in reordered.items()
+                ]))
+
+        if events:
+            # 差分ごとにバージョンを1つ進める（クライアントは欠番を検知したらresyncを要求）
+            last_version = get_redis().incrby(list_version_key(room_id), len(events))
+            first_version = last_version - len(events) + 1
+            if first_version == 1:
+                # キーが作り直された（バージョンが1からやり直し）: 同じ番号の古いペイロードを使わない
+                rotate_generation(room_id)
+            for version, (event_type, data) in enumerate(events, start=first_version):
+                send_event(room_id, DELTA_GROUP, event_type, encode_payload(data), version=version)
+            logger.debug(f'WebSocket配信: タイマーリスト差分 {len(events)}件 (version={last_version})')
+    except Exception as e:
+        logger.error(f'broadcast_timer_changes error: {e}', exc_info=True)
+
+    if settings.TIMER_LIST_FULL_BROADCAST:
+        broadcast_timer_list(room_id)
@@ -1,28 +1,46 @@
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
-from django.utils import timezone
-from django.db import models, transaction
-from datetime import timedelta
-from .models import Timer, TimerState
-from .serializers import TimerStateSerializer, TimerSerializer
-from .utils import broadcast_timer_state, broadcast_timer_list
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from .models import RehearsalArchive, Room, Timer, TimerEvent, TimerState
+from .serializers import (
+    RehearsalArchiveSerializer, RoomSerializer, TimerEventSerializer, TimerStateSerializer, TimerSerializer,
+)
+from .utils import broadcast_timer_state, broadcast_timer_changes
+from .payloads import get_timer_list_payload, get_timer_state_payload, get_schedule_payload
+from . import archive, services, transitions
+from .timetable import TimetableError, parse_csv, validate_rows, iter_csv, iter_json
+from .query_budget import query_budget
+from .rooms import room_view
+from .send_queue import get_counters
 import logging
 
 logger = logging.getLogger(__name__)
 
+# イベント取得の件数（既定・上限）
+EVENTS_PAGE_SIZE = 100
+MAX_EVENTS_PAGE_SIZE = 1000
+
+# リハーサル記録の一覧の件数（既定・上限）
+ARCHIVES_PAGE_SIZE = 50
+MAX_ARCHIVES_PAGE_SIZE = 500
+
 
 @api_view(['GET'])
-def get_timer_state(request):
+@room_view
+@query_budget(2, 'GET /api/timers/timer-state/')
+def get_timer_state(request, room_id):
     """
     タイマー状態を取得
 
     GET /api/timer-state/
     """
     try:
-        timer_state = TimerState.load()
-        serializer = TimerStateSerializer(timer_state)
-        return Response(serializer.data)
+        payload = get_timer_state_payload(room_id)
+        return HttpResponse(payload.json, content_type='application/json')
     except Exception as e:
         logger.error(f'get_timer_state error: {e}')
         return Response(
@@ -32,7 +50,8 @@ def get_timer_state(request):
 
 
 @api_view(['POST'])
-def start_timer(request):
+@room_view
+def start_timer(request, room_id):
     """
     タイマーを開始
 
@@ -40,48 +59,20 @@ def start_timer(request):
     Body: { "timer_id": 1 }  # オプション
     """
     try:
-        timer_state = TimerState.load()
-
-        # 既に実行中の場合はエラー
-        if timer_state.is_running and not timer_state.is_paused:
+        try:
+            timer_state = transitions.start(room_id, timer_id=request.data.get('timer_id'))
+        except transitions.TransitionError as e:
+            return Response({'detail': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        except Timer.DoesNotExist:
             return Response(
-                {'detail': '既にタイマーが実行中です。'},
-                status=status.HTTP_400_BAD_REQUEST
+                {'detail': '指定されたタイマーが見つかりません。'},
+                status=status.HTTP_404_NOT_FOUND
             )
 
-        # timer_idが指定されていれば、そのタイマーを開始
-        timer_id = request.data.get('timer_id')
-        if timer_id:
-            try:
-                timer = Timer.objects.get(id=timer_id)
-            except Timer.DoesNotExist:
-                return Response(
-                    {'detail': '指定されたタイマーが見つかりません。'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-        else:
-            # 最初の未完了タイマーを取得
-            timer = Timer.objects.filter(completed_at__isnull=True).first()
-            if not timer:
-                return Response(
-                    {'detail': 'タイマーがありません。'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-        # タイマーを開始
-        timer_state.current_timer = timer
-        timer_state.started_at = timezone.now()
-        timer_state.paused_at = None
-        timer_state.elapsed_seconds = 0
-        timer_state.total_paused_seconds = 0
-        timer_state.is_running = True
-        timer_state.is_paused = False
-        timer_state.save()
-
-        logger.info(f'タイマー開始: {timer.band_name}')
+        logger.info(f'タイマー開始: {timer_state.current_timer.band_name}')
 
-        # WebSocketで配信
-        broadcast_timer_state()
+        # WebSocketで配信（遷移後の状態をそのまま使う）
+        transitions.publish(room_id, timer_state)
 
         serializer = TimerStateSerializer(timer_state)
         return Response({
@@ -89,6 +80,12 @@ def start_timer(request):
             'state': serializer.data
         })
 
+    except transitions.TransitionConflict as e:
+        logger.warning(f'start_timer conflict: {e}')
+        return Response(
+            {'detail': '他の操作と競合しました。もう一度お試しください。'},
+            status=status.HTTP_409_CONFLICT
+        )
     except Exception as e:
         logger.error(f'start_timer error: {e}')
         return Response(
@@ -98,7 +95,9 @@ def start_timer(request):
 
 
 @api_view(['GET'])
-def get_timers(request):
+@room_view
+@query_budget(1, 'GET /api/timers/')
+def get_timers(request, room_id):
     """
     全タイマー一覧を取得
     実行中タイマーの暫定時間差を含めてリアルタイム更新
@@ -106,9 +105,8 @@ def get_timers(request):
     GET /api/timers/
     """
     try:
-        timers = Timer.objects.all().order_by('order')
-        serializer = TimerSerializer(timers, many=True)
-        return Response(serializer.data)
+        payload = get_timer_list_payload(room_id)
+        return HttpResponse(payload.json, content_type='application/json')
     except Exception as e:
         logger.error(f'get_timers error: {e}', exc_info=True)
         return Response(
@@ -117,45 +115,66 @@ def get_timers(request):
         )
 
 
-@api_view(['POST'])
-def pause_timer(request):
+@api_view(['GET'])
+@room_view
+@query_budget(2, 'GET /api/timers/schedule/')
+def get_schedule(request, room_id):
     """
-    タイマーを一時停止
+    スケジュール予測を取得（各タイマーの予定/予測の開始・終了時刻）
 
-    POST /api/timers/timer-state/pause/
+    GET /api/timers/schedule/
     """
     try:
-        timer_state = TimerState.load()
+        payload = get_schedule_payload(room_id)
+        return HttpResponse(payload.json, content_type='application/json')
+    except Exception as e:
+        logger.error(f'get_schedule error: {e}', exc_info=True)
+        return Response(
+            {'detail': 'スケジュール予測の取得に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
-        # バリデーション: 実行中でないと一時停止できない
-        if not timer_state.is_running:
-            return Response(
-                {'detail': 'タイマーが実行中ではありません。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
 
-        # バリデーション: 既に一時停止中
-        if timer_state.is_paused:
-            return Response(
-                {'detail': 'タイマーは既に一時停止中です。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+@api_view(['GET'])
+@room_view
+def get_websocket_stats(request, room_id):
+    """
+    WebSocket送信キューのカウンターを取得（遅いクライアントの状況確認用）
 
-        # 表示される残り時間を基準に経過時間を保存（表示の一貫性を保つ）
-        import math
-        elapsed = (timezone.now() - timer_state.started_at).total_seconds()
-        total_seconds = timer_state.current_timer.minutes * 60
-        remaining = total_seconds - elapsed
-        display_remaining = max(0, math.ceil(remaining))
-        timer_state.elapsed_seconds = total_seconds - display_remaining
-        timer_state.paused_at = timezone.now()
-        timer_state.is_paused = True
-        timer_state.save()
+    GET /api/timers/ws-stats/
+
+    sent: 送信したフレーム数 / coalesced: 新しいフレームで置き換えて送らなかった数 /
+    dropped: 上限超過の切断時に破棄した数 / overflows: 上限超過で切断した接続数
+    （接続中のカウンターは最大30秒遅れて反映される）
+    """
+    try:
+        return Response(get_counters(room_id))
+    except Exception as e:
+        logger.error(f'get_websocket_stats error: {e}', exc_info=True)
+        return Response(
+            {'detail': 'WebSocketの統計の取得に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+@room_view
+def pause_timer(request, room_id):
+    """
+    タイマーを一時停止
+
+    POST /api/timers/timer-state/pause/
+    """
+    try:
+        try:
+            timer_state = transitions.pause(room_id)
+        except transitions.TransitionError as e:
+            return Response({'detail': e.detail}, status=status.HTTP_400_BAD_REQUEST)
 
         logger.info(f'タイマー一時停止: {timer_state.current_timer.band_name if timer_state.current_timer else "None"}')
 
-        # WebSocketで配信
-        broadcast_timer_state()
+        # WebSocketで配信（遷移後の状態をそのまま使う）
+        transitions.publish(room_id, timer_state)
 
         serializer = TimerStateSerializer(timer_state)
         return Response({
@@ -163,6 +182,12 @@ def pause_timer(request):
             'state': serializer.data
         })
 
+    except transitions.TransitionConflict as e:
+        logger.warning(f'pause_timer conflict: {e}')
+        return Response(
+            {'detail': '他の操作と競合しました。もう一度お試しください。'},
+            status=status.HTTP_409_CONFLICT
+        )
     except Exception as e:
         logger.error(f'pause_timer error: {e}')
         return Response(
@@ -172,43 +197,23 @@ def pause_timer(request):
 
 
 @api_view(['POST'])
-def resume_timer(request):
+@room_view
+def resume_timer(request, room_id):
     """
     タイマーを再開
 
     POST /api/timers/timer-state/resume/
     """
     try:
-        timer_state = TimerState.load()
-
-        # バリデーション: 実行中でないと再開できない
-        if not timer_state.is_running:
-            return Response(
-                {'detail': 'タイマーが実行中ではありません。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # バリデーション: 一時停止中でないと再開できない
-        if not timer_state.is_paused:
-            return Response(
-                {'detail': 'タイマーは一時停止中ではありません。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # 一時停止していた時間を累積
-        paused_duration = int((timezone.now() - timer_state.paused_at).total_seconds())
-        timer_state.total_paused_seconds += paused_duration
-
-        # started_at を調整（経過時間を考慮）
-        timer_state.started_at = timezone.now() - timedelta(seconds=timer_state.elapsed_seconds)
-        timer_state.paused_at = None
-        timer_state.is_paused = False
-        timer_state.save()
+        try:
+            timer_state = transitions.resume(room_id)
+        except transitions.TransitionError as e:
+            return Response({'detail': e.detail}, status=status.HTTP_400_BAD_REQUEST)
 
         logger.info(f'タイマー再開: {timer_state.current_timer.band_name if timer_state.current_timer else "None"}')
 
-        # WebSocketで配信
-        broadcast_timer_state()
+        # WebSocketで配信（遷移後の状態をそのまま使う）
+        transitions.publish(room_id, timer_state)
 
         serializer = TimerStateSerializer(timer_state)
         return Response({
@@ -216,6 +221,12 @@ def resume_timer(request):
             'state': serializer.data
         })
 
+    except transitions.TransitionConflict as e:
+        logger.warning(f'resume_timer conflict: {e}')
+        return Response(
+            {'detail': '他の操作と競合しました。もう一度お試しください。'},
+            status=status.HTTP_409_CONFLICT
+        )
     except Exception as e:
         logger.error(f'resume_timer error: {e}')
         return Response(
@@ -225,99 +236,42 @@ def resume_timer(request):
 
 
 @api_view(['POST'])
-def skip_timer(request):
+@room_view
+def skip_timer(request, room_id):
     """
     タイマーをスキップして次に進む
 
     POST /api/timers/timer-state/skip/
+    Body: { "timer_id": 1 }  # オプション（現在のタイマーが異なれば400。二重送信対策）
     """
     try:
-        timer_state = TimerState.load()
-
-        # バリデーション: 現在のタイマーが存在するか
-        if not timer_state.current_timer:
-            return Response(
-                {'detail': '現在実行中のタイマーがありません。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        try:
+            timer_state, skipped_timer = transitions.skip(room_id, timer_id=request.data.get('timer_id'))
+        except transitions.TransitionError as e:
+            return Response({'detail': e.detail}, status=status.HTTP_400_BAD_REQUEST)
 
-        current_timer = timer_state.current_timer
-
-        # タイマーの経過時間を計算
-        if timer_state.is_paused:
-            timer_elapsed = timer_state.elapsed_seconds
-            # 現在の一時停止時間も加算
-            current_pause = int((timezone.now() - timer_state.paused_at).total_seconds())
-            total_paused = timer_state.total_paused_seconds + current_pause
-        elif timer_state.is_running:
-            timer_elapsed = int((timezone.now() - timer_state.started_at).total_seconds())
-            total_paused = timer_state.total_paused_seconds
+        logger.info(f'タイマースキップ: {skipped_timer.band_name} ({skipped_timer.actual_seconds}秒)')
+        if timer_state.current_timer:
+            logger.info(f'次のタイマー自動開始: {timer_state.current_timer.band_name}')
         else:
-            timer_elapsed = 0
-            total_paused = 0
-
-        # actual_seconds = タイマー経過時間 + 累積一時停止時間
-        actual_seconds = timer_elapsed + total_paused
-
-        # 現在のタイマーを完了マーク
-        current_timer.actual_seconds = actual_seconds
-        current_timer.completed_at = timezone.now()
-        current_timer.save()
-
-        logger.info(f'タイマースキップ: {current_timer.band_name} ({actual_seconds}秒)')
-
-        # 次の未完了タイマーを取得
-        next_timer = Timer.objects.filter(
-            completed_at__isnull=True
-        ).order_by('order').first()
-
-        if next_timer:
-            # 次のタイマーを自動開始
-            timer_state.current_timer = next_timer
-            timer_state.started_at = timezone.now()
-            timer_state.paused_at = None
-            timer_state.elapsed_seconds = 0
-            timer_state.total_paused_seconds = 0
-            timer_state.is_running = True
-            timer_state.is_paused = False
-            timer_state.save()
-
-            logger.info(f'次のタイマー自動開始: {next_timer.band_name}')
-
-            # WebSocketで配信（状態とリストの両方）
-            broadcast_timer_state()
-            broadcast_timer_list()
-
-            serializer = TimerStateSerializer(timer_state)
-            return Response({
-                'detail': 'タイマーをスキップして次に進みました。',
-                'skipped_timer': TimerSerializer(current_timer).data,
-                'state': serializer.data
-            })
-        else:
-            # 全タイマー完了
-            timer_state.current_timer = None
-            timer_state.started_at = None
-            timer_state.paused_at = None
-            timer_state.elapsed_seconds = 0
-            timer_state.total_paused_seconds = 0
-            timer_state.is_running = False
-            timer_state.is_paused = False
-            timer_state.save()
-
             logger.info('全タイマー完了')
 
-            # WebSocketで配信（状態とリストの両方）
-            broadcast_timer_state()
-            broadcast_timer_list()
+        # WebSocketで配信（状態とリストの両方。遷移後の状態をそのまま使う）
+        transitions.publish(room_id, timer_state, skipped_timer)
 
-            serializer = TimerStateSerializer(timer_state)
-            return Response({
-                'detail': '全てのタイマーが完了しました。',
-                'skipped_timer': TimerSerializer(current_timer).data,
-                'state': serializer.data
-            })
+        serializer = TimerStateSerializer(timer_state)
+        return Response({
+            'detail': 'タイマーをスキップして次に進みました。' if timer_state.current_timer else '全てのタイマーが完了しました。',
+            'skipped_timer': TimerSerializer(skipped_timer).data,
+            'state': serializer.data
+        })
 
+    except transitions.TransitionConflict as e:
+        logger.warning(f'skip_timer conflict: {e}')
+        return Response(
+            {'detail': '他の操作と競合しました。もう一度お試しください。'},
+            status=status.HTTP_409_CONFLICT
+        )
     except Exception as e:
         logger.error(f'skip_timer error: {e}')
         return Response(
@@ -331,73 +285,9 @@ def skip_timer(request):
 # ============================================================================
 
 
-def _validate_timer_data(data):
-    """
-    タイマーデータのバリデーション
-
-    Args:
-        data: リクエストデータ
-
-    Returns:
-        tuple: (error_response, validated_data)
-        - error_response: バリデーションエラー時はResponse、成功時はNone
-        - validated_data: バリデーション成功時は検証済みデータのdict
-    """
-    from apps.members.models import Member
-
-    band_name = data.get('band_name', '').strip()
-    minutes = data.get('minutes')
-    member1_id = data.get('member1_id')
-    member2_id = data.get('member2_id')
-    member3_id = data.get('member3_id')
-
-    # 必須フィールドチェック
-    if not band_name:
-        return Response(
-            {'detail': 'バンド名は必須です。'},
-            status=status.HTTP_400_BAD_REQUEST
-        ), None
-
-    if not minutes or minutes <= 0:
-        return Response(
-            {'detail': '予定時間は1分以上で指定してください。'},
-            status=status.HTTP_400_BAD_REQUEST
-        ), None
-
-    if not all([member1_id, member2_id, member3_id]):
-        return Response(
-            {'detail': '担当者3名を全て選択してください。'},
-            status=status.HTTP_400_BAD_REQUEST
-        ), None
-
-    # 重複チェック
-    if len(set([member1_id, member2_id, member3_id])) != 3:
-        return Response(
-            {'detail': '同じメンバーを複数回選択することはできません。'},
-            status=status.HTTP_400_BAD_REQUEST
-        ), None
-
-    # メンバーの存在確認
-    try:
-        member1 = Member.objects.get(id=member1_id, is_active=True)
-        member2 = Member.objects.get(id=member2_id, is_active=True)
-        member3 = Member.objects.get(id=member3_id, is_active=True)
-    except Member.DoesNotExist:
-        return Response(
-            {'detail': '指定されたメンバーが見つかりません。'},
-            status=status.HTTP_404_NOT_FOUND
-        ), None
-
-    return None, {
-        'band_name': band_name,
-        'minutes': minutes,
-        'member1': member1,
-        'member2': member2,
-        'member3': member3,
-    }
-
 @api_view(['POST'])
-def create_timer(request):
+@room_view
+def create_timer(request, room_id):
     """
     新しいタイマーを作成
 
@@ -411,38 +301,14 @@ def create_timer(request):
     }
     """
     try:
-        # バリデーション
-        error_response, validated_data = _validate_timer_data(request.data)
-        if error_response:
-            return error_response
-
-        # 順序の自動割り当て（最大値 + 1）
-        max_order = Timer.objects.aggregate(models.Max('order'))['order__max'] or 0
-        new_order = max_order + 1
-
-        # タイマー作成
-        timer = Timer.objects.create(
-            band_name=validated_data['band_name'],
-            minutes=validated_data['minutes'],
-            member1=validated_data['member1'],
-            member2=validated_data['member2'],
-            member3=validated_data['member3'],
-            order=new_order
-        )
-
-        logger.info(f'タイマー作成: {timer.band_name} (order: {timer.order})')
-
-        # current_timerがnullの場合、新規作成したタイマーを自動セット
-        timer_state = TimerState.load()
-        if not timer_state.current_timer:
-            timer_state.current_timer = timer
-            timer_state.save()
-            logger.info(f'current_timerを自動設定: {timer.band_name}')
-            # タイマー状態も配信
-            broadcast_timer_state()
+        changes = services.Changes()
+        try:
+            timer = services.create_timer(room_id, request.data, changes)
+        except services.ServiceError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
 
         # WebSocketで配信
-        broadcast_timer_list()
+        changes.publish(room_id)
 
         serializer = TimerSerializer(timer)
         return Response({
@@ -459,7 +325,8 @@ def create_timer(request):
 
 
 @api_view(['PUT'])
-def update_timer(request, timer_id):
+@room_view
+def update_timer(request, timer_id, room_id):
     """
     タイマーを更新
 
@@ -473,49 +340,14 @@ def update_timer(request, timer_id):
     }
     """
     try:
-        # タイマー取得
+        changes = services.Changes()
         try:
-            timer = Timer.objects.get(id=timer_id)
-        except Timer.DoesNotExist:
-            return Response(
-                {'detail': '指定されたタイマーが見つかりません。'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        # 編集制限チェック
-        timer_state = TimerState.load()
-
-        # 完了済みタイマーは編集不可
-        if timer.is_completed:
-            return Response(
-                {'detail': '完了済みのタイマーは編集できません。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # 実行中のタイマーは編集不可
-        if timer_state.is_running and timer_state.current_timer and timer_state.current_timer.id == timer.id:
-            return Response(
-                {'detail': '実行中のタイマーは編集できません。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # バリデーション
-        error_response, validated_data = _validate_timer_data(request.data)
-        if error_response:
-            return error_response
-
-        # タイマー更新
-        timer.band_name = validated_data['band_name']
-        timer.minutes = validated_data['minutes']
-        timer.member1 = validated_data['member1']
-        timer.member2 = validated_data['member2']
-        timer.member3 = validated_data['member3']
-        timer.save()
-
-        logger.info(f'タイマー更新: {timer.band_name} (id: {timer.id})')
+            timer = services.update_timer(room_id, timer_id, request.data, changes)
+        except services.ServiceError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
 
         # WebSocketで配信
-        broadcast_timer_list()
+        changes.publish(room_id)
 
         serializer = TimerSerializer(timer)
         return Response({
@@ -532,122 +364,290 @@ def update_timer(request, timer_id):
 
 
 @api_view(['DELETE'])
-def delete_timer(request, timer_id):
+@room_view
+def delete_timer(request, timer_id, room_id):
     """
     タイマーを削除
 
     DELETE /api/timers/{timer_id}/delete/
     """
     try:
-        # タイマー取得
+        changes = services.Changes()
         try:
-            timer = Timer.objects.get(id=timer_id)
-        except Timer.DoesNotExist:
-            return Response(
-                {'detail': '指定されたタイマーが見つかりません。'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            services.delete_timer(room_id, timer_id, changes)
+        except services.ServiceError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
 
-        # 削除制限チェック
-        timer_state = TimerState.load()
+        # 完了タスクの再予約とWebSocket配信
+        changes.publish(room_id)
 
-        # 完了済みタイマーは削除不可
-        if timer.is_completed:
-            return Response(
-                {'detail': '完了済みのタイマーは削除できません。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return Response({
+            'detail': 'タイマーを削除しました。'
+        })
 
-        # 実行中のタイマーは削除不可
-        if timer_state.is_running and timer_state.current_timer and timer_state.current_timer.id == timer.id:
-            return Response(
-                {'detail': '実行中のタイマーは削除できません。'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    except Exception as e:
+        logger.error(f'delete_timer error: {e}', exc_info=True)
+        return Response(
+            {'detail': 'タイマーの削除に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
-        # 削除するタイマーのorder値を保存
-        deleted_order = timer.order
-        band_name = timer.band_name
 
-        # タイマー削除
-        timer.delete()
+@api_view(['POST'])
+@room_view
+def reorder_timers(request, room_id):
+    """
+    タイマーの順序を変更
+
+    POST /api/timers/reorder/
+    Body: {
+        "timer_ids": [3, 1, 2, 4, 5]  // 新しい順序のタイマーID配列
+    }
+    """
+    try:
+        changes = services.Changes()
+        try:
+            services.reorder_timers(room_id, request.data.get('timer_ids', []), changes)
+        except services.ServiceError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+
+        # 完了タスクの再予約とWebSocket配信（orderが変わったタイマーのみ）
+        changes.publish(room_id)
+
+        return Response({
+            'detail': 'タイマーの順序を変更しました。'
+        })
 
-        # 残りのタイマーのorderを詰める（deleted_orderより大きいorderを-1する）
-        Timer.objects.filter(order__gt=deleted_order).update(
-            order=models.F('order') - 1
+    except Exception as e:
+        logger.error(f'reorder_timers error: {e}', exc_info=True)
+        return Response(
+            {'detail': 'タイマーの順序変更に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-        logger.info(f'タイマー削除: {band_name} (order: {deleted_order})')
 
-        # WebSocketで配信
-        broadcast_timer_list()
+@api_view(['POST'])
+@room_view
+def move_timer(request, timer_id, room_id):
+    """
+    タイマーを指定したタイマーの間に移動（移動したタイマーのorderだけを更新）
+
+    POST /api/timers/{timer_id}/move/
+    Body: {
+        "after_id": 3,   // 直前に来るタイマーID（先頭へ移動する場合は省略）
+        "before_id": 5   // 直後に来るタイマーID（最後尾へ移動する場合は省略）
+    }
+    """
+    try:
+        changes = services.Changes()
+        try:
+            orders = services.move_timer(
+                room_id, timer_id, request.data.get('after_id'), request.data.get('before_id'), changes
+            )
+        except services.ServiceError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+
+        # 完了タスクの再予約とWebSocket配信
+        changes.publish(room_id)
 
         return Response({
-            'detail': 'タイマーを削除しました。'
+            'detail': 'タイマーを移動しました。',
+            'order': orders[timer_id]
         })
 
     except Exception as e:
-        logger.error(f'delete_timer error: {e}', exc_info=True)
+        logger.error(f'move_timer error: {e}', exc_info=True)
         return Response(
-            {'detail': 'タイマーの削除に失敗しました。'},
+            {'detail': 'タイマーの移動に失敗しました。'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
 
 @api_view(['POST'])
-def reorder_timers(request):
+@room_view
+def batch_operations(request, room_id):
     """
-    タイマーの順序を変更
+    複数の操作を1つのトランザクションで順に実行し、まとめて1回配信（操作卓向け）
 
-    POST /api/timers/reorder/
+    1つでも失敗した操作があれば全て取り消し、失敗した操作の位置（index）を返す。
+
+    POST /api/timers/batch/
     Body: {
-        "timer_ids": [3, 1, 2, 4, 5]  // 新しい順序のタイマーID配列
+        "operations": [
+            {"op": "skip", "timer_id": 3},
+            {"op": "update", "timer_id": 5, "band_name": "...", "minutes": 10, "member1_id": 1, ...},
+            {"op": "move", "timer_id": 7, "after_id": 4},
+            {"op": "start"}
+        ]
     }
+    op: start（timer_id 任意）, pause, resume, skip（timer_id 任意）, create, update, delete,
+        reorder（timer_ids）, move（timer_id, after_id, before_id）
+    各操作のパラメータは個別のAPIのBodyと同じ。
     """
     try:
-        timer_ids = request.data.get('timer_ids', [])
-
-        if not timer_ids or not isinstance(timer_ids, list):
+        try:
+            changes = services.apply_operations(room_id, request.data.get('operations'))
+        except services.OperationError as e:
             return Response(
-                {'detail': 'timer_idsは配列で指定してください。'},
-                status=status.HTTP_400_BAD_REQUEST
+                {'detail': e.detail, 'index': e.index, 'op': e.op},
+                status=e.status_code
             )
+        except services.ServiceError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+
+        # 完了タスクの再予約とWebSocket配信（全操作分を1回に）
+        changes.publish(room_id)
+
+        operations = request.data['operations']
+        serializer = TimerStateSerializer(changes.timer_state or TimerState.load(room_id))
+        return Response({
+            'detail': f'{len(operations)}件の操作を実行しました。',
+            'state': serializer.data
+        })
+
+    except Exception as e:
+        logger.error(f'batch_operations error: {e}', exc_info=True)
+        return Response(
+            {'detail': '一括操作に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+@parser_classes([JSONParser, MultiPartParser])
+@room_view
+def import_timers(request, room_id):
+    """
+    タイマーを一括登録（タイムテーブルの取り込み）
 
-        # 全タイマーIDを取得
-        all_timer_ids = set(Timer.objects.values_list('id', flat=True))
-        requested_timer_ids = set(timer_ids)
+    全行を検証してから最後尾にまとめて追加する（1行でもエラーがあれば何も登録しない）。
 
-        # IDの整合性チェック
-        if requested_timer_ids != all_timer_ids:
+    POST /api/timers/import/
+    Body（JSON）: {
+        "timers": [
+            {"band_name": "Band A", "minutes": 15, "member1": "名前", "member2": "名前", "member3": "名前"},
+            {"band_name": "Band B", "minutes": 20, "member1_id": 1, "member2_id": 2, "member3_id": 3}
+        ]
+    }
+    Body（CSV）: Content-Type: text/csv の本文、または multipart の file
+        band_name,minutes,member1,member2,member3
+        Band A,15,名前,名前,名前
+    """
+    try:
+        try:
+            if request.content_type.startswith('text/csv'):
+                rows = parse_csv(request.body)
+            elif 'file' in request.FILES:
+                rows = parse_csv(request.FILES['file'].read())
+            else:
+                rows = request.data.get('timers')
+                if not isinstance(rows, list):
+                    raise TimetableError('timersは配列で指定してください。')
+            validated_rows = validate_rows(rows)
+        except TimetableError as e:
             return Response(
-                {'detail': 'タイマーIDが不正です。全てのタイマーを指定してください。'},
+                {'detail': e.detail, 'errors': e.errors},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # 順序を更新（トランザクション）
-        with transaction.atomic():
-            for index, timer_id in enumerate(timer_ids):
-                Timer.objects.filter(id=timer_id).update(order=index + 1)
+        changes = services.Changes()
+        try:
+            timers = services.import_timers(room_id, validated_rows, changes)
+        except services.ServiceError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
 
-        logger.info(f'タイマー順序変更: {timer_ids}')
+        # WebSocketで配信（状態・リストの差分をまとめて1回）
+        changes.publish(room_id)
+
+        return Response({
+            'detail': f'{len(timers)}件のタイマーを登録しました。',
+            'created_count': len(timers),
+            'timers': TimerSerializer(timers, many=True).data
+        }, status=status.HTTP_201_CREATED)
+
+    except Exception as e:
+        logger.error(f'import_timers error: {e}', exc_info=True)
+        return Response(
+            {'detail': 'タイマーの一括登録に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
-        # WebSocketで配信
-        broadcast_timer_list()
 
+@api_view(['GET'])
+@room_view
+def export_timers(request, room_id):
+    """
+    タイムテーブルと実績を書き出し（order順にストリーミング）
+
+    GET /api/timers/export/              CSV（一括登録にそのまま使える列 + 実績）
+    GET /api/timers/export/?output=json  JSON（{"timers": [...]}）
+    """
+    try:
+        if request.query_params.get('output') == 'json':
+            response = StreamingHttpResponse(iter_json(room_id), content_type='application/json')
+            extension = 'json'
+        else:
+            response = StreamingHttpResponse(iter_csv(room_id), content_type='text/csv; charset=utf-8')
+            extension = 'csv'
+        response['Content-Disposition'] = f'attachment; filename="timetable-{room_id}.{extension}"'
+        return response
+    except Exception as e:
+        logger.error(f'export_timers error: {e}', exc_info=True)
+        return Response(
+            {'detail': 'タイムテーブルの書き出しに失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@room_view
+@query_budget(1, 'GET /api/timers/events/')
+def get_events(request, room_id):
+    """
+    イベント（操作・状態遷移の記録）を古い順に取得
+
+    GET /api/timers/events/?after=120&kind=skip,complete&since=2026-10-18T10:00:00%2B09:00&limit=100
+        after: このイベントIDより後のイベント（前回のレスポンスの next を指定して続きを取得）
+        kind: 種類（カンマ区切り）
+        since: この日時以降のイベント
+        limit: 件数（既定100、最大1000）
+    """
+    try:
+        events = TimerEvent.objects.filter(room_id=room_id)
+        try:
+            if request.query_params.get('after'):
+                events = events.filter(id__gt=int(request.query_params['after']))
+            if request.query_params.get('since'):
+                since = parse_datetime(request.query_params['since'])
+                if since is None:
+                    raise ValueError
+                events = events.filter(created_at__gte=since)
+            limit = min(int(request.query_params.get('limit', EVENTS_PAGE_SIZE)), MAX_EVENTS_PAGE_SIZE)
+        except ValueError:
+            return Response(
+                {'detail': 'after・since・limitの形式が不正です。'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if request.query_params.get('kind'):
+            events = events.filter(kind__in=request.query_params['kind'].split(','))
+
+        events = list(events.order_by('id')[:max(limit, 1)])
         return Response({
-            'detail': 'タイマーの順序を変更しました。'
+            'events': TimerEventSerializer(events, many=True).data,
+            'next': events[-1].id if events else None
         })
 
     except Exception as e:
-        logger.error(f'reorder_timers error: {e}', exc_info=True)
+        logger.error(f'get_events error: {e}', exc_info=True)
         return Response(
-            {'detail': 'タイマーの順序変更に失敗しました。'},
+            {'detail': 'イベントの取得に失敗しました。'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
 
 @api_view(['POST'])
-def update_settings(request):
+@room_view
+def update_settings(request, room_id):
     """
     設定を更新
 
@@ -657,15 +657,14 @@ def update_settings(request):
     }
     """
     try:
-        timer_state = TimerState.load()
-
-        # LINE通知設定の更新
+        # LINE通知設定の更新（変更するフィールドだけを version を条件に更新）
         if 'line_notifications_enabled' in request.data:
-            timer_state.line_notifications_enabled = request.data['line_notifications_enabled']
-            timer_state.save()
+            timer_state = transitions.set_line_notifications(room_id, request.data['line_notifications_enabled'])
 
             status_text = '有効' if timer_state.line_notifications_enabled else '無効'
             logger.info(f'LINE通知設定を{status_text}に変更')
+        else:
+            timer_state = TimerState.load(room_id)
 
         serializer = TimerStateSerializer(timer_state)
         return Response({
@@ -673,6 +672,12 @@ def update_settings(request):
             'state': serializer.data
         })
 
+    except transitions.TransitionConflict as e:
+        logger.warning(f'update_settings conflict: {e}')
+        return Response(
+            {'detail': '他の操作と競合しました。もう一度お試しください。'},
+            status=status.HTTP_409_CONFLICT
+        )
     except Exception as e:
         logger.error(f'update_settings error: {e}', exc_info=True)
         return Response(
@@ -682,15 +687,18 @@ def update_settings(request):
 
 
 @api_view(['POST'])
-def delete_all_timers(request):
+@room_view
+def delete_all_timers(request, room_id):
     """
     全てのタイマーを削除（全タイマー完了時のみ可能）
 
+    削除する前に、完了済みタイマーの実績をリハーサル記録として保存する（archive.py）。
+
     POST /api/timers/delete-all/
     """
     try:
         # タイマーが存在するかチェック
-        timer_count = Timer.objects.count()
+        timer_count = Timer.objects.filter(room_id=room_id).count()
         if timer_count == 0:
             return Response(
                 {'detail': 'タイマーが存在しません。'},
@@ -698,48 +706,168 @@ def delete_all_timers(request):
             )
 
         # 全タイマーが完了しているかチェック
-        incomplete_count = Timer.objects.filter(completed_at__isnull=True).count()
+        incomplete_count = Timer.objects.filter(room_id=room_id, completed_at__isnull=True).count()
         if incomplete_count > 0:
             return Response(
                 {'detail': '未完了のタイマーが存在するため、全削除できません。'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # トランザクション内で全削除とTimerStateリセット
-        with transaction.atomic():
-            # LINE通知履歴を削除
+        result = {}
+
+        def clear():
+            """リハーサル記録を保存してから全削除（TimerStateを初期化した UPDATE と同じトランザクション）"""
             from apps.line_integration.models import LineNotification
-            notification_count = LineNotification.objects.all().delete()[0]
-
-            # 全タイマーを削除
-            deleted_count = Timer.objects.all().delete()[0]
-
-            # TimerStateをリセット
-            timer_state = TimerState.load()
-            timer_state.current_timer = None
-            timer_state.started_at = None
-            timer_state.paused_at = None
-            timer_state.elapsed_seconds = 0
-            timer_state.total_paused_seconds = 0
-            timer_state.is_running = False
-            timer_state.is_paused = False
-            timer_state.save()
 
+            rehearsal_archive = archive.archive_room(room_id)
+            result['archive_id'] = rehearsal_archive.id if rehearsal_archive else None
+
+            # LINE通知履歴を削除
+            result['notification_deleted_count'] = LineNotification.objects.filter(room_id=room_id).delete()[0]
+
+            # 全タイマーを削除（イベントの記録は残す）
+            result['deleted_count'] = Timer.objects.filter(room_id=room_id).delete()[0]
+            return result
+
+        # TimerStateをリセットしてから全削除（予約済みタスクの解除もコミット後に行われる）
+        timer_state = transitions.reset(room_id, clear)
+
+        deleted_count, notification_count = result['deleted_count'], result['notification_deleted_count']
         logger.info(f'全タイマー削除: {deleted_count}件, LINE通知履歴削除: {notification_count}件')
 
         # WebSocketで配信（状態とリストの両方）
-        broadcast_timer_state()
-        broadcast_timer_list()
+        broadcast_timer_state(room_id, timer_state=timer_state)
+        broadcast_timer_changes(room_id, reset=True)
 
         return Response({
             'detail': f'{deleted_count}件のタイマーと{notification_count}件の通知履歴を削除しました。',
             'deleted_count': deleted_count,
-            'notification_deleted_count': notification_count
+            'notification_deleted_count': notification_count,
+            'archive_id': result['archive_id']
         })
 
+    except transitions.TransitionConflict as e:
+        logger.warning(f'delete_all_timers conflict: {e}')
+        return Response(
+            {'detail': '他の操作と競合しました。もう一度お試しください。'},
+            status=status.HTTP_409_CONFLICT
+        )
     except Exception as e:
         logger.error(f'delete_all_timers error: {e}', exc_info=True)
         return Response(
             {'detail': '全タイマーの削除に失敗しました。'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['GET'])
+@room_view
+@query_budget(1, 'GET /api/timers/archives/')
+def get_archives(request, room_id):
+    """
+    リハーサル記録の一覧（新しい順）
+
+    GET /api/timers/archives/?limit=50
+    """
+    try:
+        try:
+            limit = min(int(request.query_params.get('limit', ARCHIVES_PAGE_SIZE)), MAX_ARCHIVES_PAGE_SIZE)
+        except ValueError:
+            return Response(
+                {'detail': 'limitの形式が不正です。'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        archives = RehearsalArchive.objects.filter(room_id=room_id).order_by('-archived_at')[:max(limit, 1)]
+        return Response(RehearsalArchiveSerializer(archives, many=True).data)
+
+    except Exception as e:
+        logger.error(f'get_archives error: {e}', exc_info=True)
+        return Response(
+            {'detail': 'リハーサル記録の取得に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@room_view
+@query_budget(2, 'GET /api/timers/analytics/')
+def get_analytics(request, room_id):
+    """
+    リハーサル記録の押し巻きをバンド・担当者ごとに集計
+
+    GET /api/timers/analytics/?group=band&since=2026-04-01T00:00:00%2B09:00
+        group: band（バンド名ごと、既定）または member（担当者ごと）
+        since: この日時以降にアーカイブした記録だけを集計
+    """
+    try:
+        since = None
+        if request.query_params.get('since'):
+            since = parse_datetime(request.query_params['since'])
+            if since is None:
+                return Response(
+                    {'detail': 'sinceの形式が不正です。'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        group = request.query_params.get('group', 'band')
+        if group not in archive.GROUPS:
+            return Response(
+                {'detail': 'groupにはbandまたはmemberを指定してください。'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(archive.overrun_stats(room_id, group=group, since=since))
+
+    except Exception as e:
+        logger.error(f'get_analytics error: {e}', exc_info=True)
+        return Response(
+            {'detail': '押し巻きの集計に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+# ============================================================================
+# Rooms
+# ============================================================================
+
+
+@api_view(['GET', 'POST'])
+def rooms(request):
+    """
+    ルーム一覧を取得 / ルームを作成
+
+    GET /api/rooms/
+    POST /api/rooms/
+    Body: { "slug": "stage-b", "name": "Bステージ" }
+
+    作成したルームのAPIは /api/rooms/{slug}/timers/...、WebSocketは /ws/timer/{slug}/
+    """
+    try:
+        if request.method == 'GET':
+            return Response(RoomSerializer(Room.objects.all(), many=True).data)
+
+        serializer = RoomSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'detail': 'ルームIDとルーム名を正しく指定してください。', 'errors': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            room = serializer.save()
+            TimerState.objects.create(room=room)
+
+        logger.info(f'ルーム作成: {room.name} ({room.slug})')
+
+        return Response({
+            'detail': 'ルームを作成しました。',
+            'room': RoomSerializer(room).data
+        }, status=status.HTTP_201_CREATED)
+
+    except Exception as e:
+        logger.error(f'rooms error: {e}', exc_info=True)
+        return Response(
+            {'detail': 'ルームの処理に失敗しました。'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
@@ -14,6 +14,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings.development')
 django_asgi_app = get_asgi_application()
 
 # Channelsのルーティングをインポート（Djangoアプリ初期化後）
+from django.conf import settings
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from apps.timers.routing import websocket_urlpatterns
@@ -26,3 +27,10 @@ application = ProtocolTypeRouter({
         )
     ),
 })
+
+# asgiモード: ASGIプロセス内でtickエンジンを動かす（Celery Worker/Beat不要）
+if settings.TIMER_SCHEDULER_MODE == 'asgi':
+    from apps.timers.engine import TickEngineMiddleware, start_on_boot
+    application = TickEngineMiddleware(application)
+    # 接続を待たずに起動する（Daphneはlifespan非対応のため）
+    start_on_boot()
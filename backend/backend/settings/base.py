@@ -131,7 +131,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework設定
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'apps.timers.renderers.FastJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
@@ -151,12 +151,16 @@ CORS_ALLOWED_ORIGINS = config(
 CORS_ALLOW_CREDENTIALS = True
 
 
+# Redis
+REDIS_URL = config('REDIS_URL', default='redis://redis:6379/0')
+
+
 # Channels設定（WebSocket）
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [config('REDIS_URL', default='redis://redis:6379/0')],
+            "hosts": [REDIS_URL],
         },
     },
 }
@@ -170,25 +174,70 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
-# Celery Beat スケジュール（1秒ごとのタスク実行）
-CELERY_BEAT_SCHEDULE = {
-    'update-timer-state': {
+# タイマー完了スケジューラ
+#   beat: Celery Beatで1秒ごとに完了チェック（従来方式）
+#   deadline: 開始/再開時に完了時刻を計算してETAタスクを1件だけ予約（アイドル時のDBアクセスなし）
+#   asgi: Daphne(ASGI)プロセス内のasyncioタスクでtick（Celery Worker/Beat不要）
+TIMER_SCHEDULER_MODE = config('TIMER_SCHEDULER_MODE', default='beat')
+
+# asgiモードのリーダーロックTTL（秒）。リーダー停止後、この時間内に他のレプリカが引き継ぐ
+TIMER_ENGINE_LOCK_TTL = config('TIMER_ENGINE_LOCK_TTL', default=5.0, cast=float)
+
+# 1秒ごとの状態配信（従来クライアント向け）
+# 全クライアントが clock=sync（状態遷移のみ受信し、カウントダウンを自前で描画）ならFalseにできる
+TIMER_TICK_BROADCAST = config('TIMER_TICK_BROADCAST', default=True, cast=bool)
+
+# 変更のたびのタイマーリスト全体配信（従来クライアント向け）
+# 全クライアントが list=delta（差分のみ受信）ならFalseにできる
+TIMER_LIST_FULL_BROADCAST = config('TIMER_LIST_FULL_BROADCAST', default=True, cast=bool)
+
+# TimerState のRedisライトスルーキャッシュ（読み取り時にSQLを発行しない）
+TIMER_STATE_CACHE = config('TIMER_STATE_CACHE', default=True, cast=bool)
+
+# シリアライズ済みペイロード（タイマーリスト・タイマー状態）のバージョン別キャッシュ
+# REST・WebSocket配信・接続時の送信で共有する
+TIMER_PAYLOAD_CACHE = config('TIMER_PAYLOAD_CACHE', default=True, cast=bool)
+
+# WebSocketのMessagePackサブプロトコル（kanritimer.msgpack.v1）
+# 有効な場合、配信ごとにバイナリフレームも作り、サブプロトコルを指定したクライアントに送る
+TIMER_MSGPACK_PROTOCOL = config('TIMER_MSGPACK_PROTOCOL', default=True, cast=bool)
+
+# WebSocket接続ごとの送信キューの上限（1秒ごとの状態配信を除く未送信フレーム数）
+# 超えた接続は閉じる（クライアントは last_seq を指定して再接続する）
+TIMER_WS_MAX_PENDING = config('TIMER_WS_MAX_PENDING', default=100, cast=int)
+
+# JSONエンコーダー（REST・WebSocket共通。出力はDRFのJSONRendererと同じ）
+#   auto: orjson がインストールされていれば orjson、なければ標準の json
+#   orjson / json: 指定したものを使用
+JSON_ENCODER = config('JSON_ENCODER', default='auto')
+
+# 読み取り経路ごとのクエリ数上限（off: 無効 / warn: 超過をログに警告 / raise: 例外）
+# テスト・開発時は raise にしてN+1の混入を検知する
+QUERY_BUDGET_MODE = config('QUERY_BUDGET_MODE', default='off')
+
+# 再接続時の再送用イベントログ（Redis Stream）の保持件数（概算）
+# これより古いseqで再接続したクライアントにはスナップショットを送る
+TIMER_EVENT_STREAM_MAXLEN = config('TIMER_EVENT_STREAM_MAXLEN', default=1000, cast=int)
+
+# 操作・状態遷移の記録（TimerEvent。apps/timers/journal.py）
+TIMER_EVENT_JOURNAL = config('TIMER_EVENT_JOURNAL', default=True, cast=bool)
+
+# 状態のスナップショットを保存する間隔（TimerState.version の件数。0で保存しない）
+# 状態の再構築で読むイベントは最大でもこの件数
+TIMER_EVENT_SNAPSHOT_INTERVAL = config('TIMER_EVENT_SNAPSHOT_INTERVAL', default=100, cast=int)
+
+# Celery Beat スケジュール
+# 完了チェック・配信・LINE通知は1本のtickパイプラインで1秒ごとに実行
+# （deadline/asgiモードではBeatのエントリは不要）
+# deadlineモードの通知は実行中の配信タスクと、実行が終わったときに1回だけ予約する
+# run_notifications タスクで評価する（scheduler.dispatch）
+CELERY_BEAT_SCHEDULE = {}
+
+if TIMER_SCHEDULER_MODE == 'beat':
+    CELERY_BEAT_SCHEDULE['update-timer-state'] = {
         'task': 'apps.timers.tasks.update_timer_state',
         'schedule': 1.0,  # 1秒ごと
-    },
-    'check-and-send-notifications': {
-        'task': 'apps.line_integration.tasks.check_and_send_notifications',
-        'schedule': 1.0,  # 1秒ごと
-    },
-    'send-rehearsal-start-notification': {
-        'task': 'apps.line_integration.tasks.send_rehearsal_start_notification',
-        'schedule': 1.0,  # 1秒ごと
-    },
-    'send-rehearsal-end-notification': {
-        'task': 'apps.line_integration.tasks.send_rehearsal_end_notification',
-        'schedule': 1.0,  # 1秒ごと
-    },
-}
+    }
 
 
 # LINE設定
@@ -4,7 +4,7 @@ URLルーティング設定
 
 from django.contrib import admin
 from django.urls import path, include
-from apps.timers.views import update_settings
+from apps.timers.views import update_settings, rooms
 
 urlpatterns = [
     # Django管理画面
@@ -15,4 +15,9 @@ urlpatterns = [
     path('api/timers/', include('apps.timers.urls')),
     path('api/line/', include('apps.line_integration.urls')),  # Step 5で追加
     path('api/settings/', update_settings, name='update_settings'),
+
+    # ルーム（同時進行する複数ステージ）。ルーム指定なしのAPIは既定のルームを操作する
+    path('api/rooms/', rooms, name='rooms'),
+    path('api/rooms/<slug:room>/timers/', include(('apps.timers.urls', 'timers'), namespace='room_timers')),
+    path('api/rooms/<slug:room>/settings/', update_settings, name='room_update_settings'),
 ]